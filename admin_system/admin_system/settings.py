@@ -149,7 +149,74 @@ CHANNEL_LAYERS = {
 DEFAULT_MODEL_PATH = 'D:/AI-DEV/models/Qwen-VL-Chat-Int4'
 DEFAULT_DEVICE = 'cuda'
 DEFAULT_PRECISION = 'float16'
+# CUDA不可用回退到CPU时替代float16的精度: float32、bfloat16或int8_dynamic(动态int8量化)
+CPU_FALLBACK_PRECISION = 'float32'
 DEFAULT_BATCH_SIZE = 1
+# 动态批处理的最长凑批等待时间(毫秒)
+INFERENCE_BATCH_MAX_WAIT_MS = 10
+# 等待模型加载完成的超时时间(秒)，None表示一直等待
+MODEL_LOAD_WAIT_TIMEOUT = 600
+# 热切换模型时等待旧模型推理结束的最长时间(秒)
+MODEL_RELOAD_DRAIN_TIMEOUT = 300
+# 模型宿主进程地址列表(由scripts/model_preload.py启动)，为空时在Web进程内加载模型
+MODEL_HOST_ADDRESSES = []
+# 连接模型宿主进程的认证密钥，为空时使用SECRET_KEY
+MODEL_HOST_AUTHKEY = None
+# 远程模式下宿主模型签名的缓存时间(秒)，其他Web进程切换模型后最多这么久本进程的响应缓存键随之更新
+MODEL_HOST_SIGNATURE_TTL = 5
+# 多轮对话KV前缀缓存：是否启用、内存上限(MB)和最大条目数
+PREFIX_CACHE_ENABLED = True
+PREFIX_CACHE_MAX_MB = 1024
+PREFIX_CACHE_MAX_ENTRIES = 64
+# 完全相同请求的响应缓存：是否启用、最大条目数和有效期(秒)；temperature大于0的请求不使用缓存
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_TTL = 600
+# 视觉编码结果缓存的内存上限(MB)，同一图像的后续提问复用编码结果
+VISUAL_EMBEDDING_CACHE_MB = 512
+# 图像预处理：解码后图像的最长边、原始图像像素数和字节数上限、解码线程数
+IMAGE_PREPROCESS_MAX_SIDE = 1344
+IMAGE_MAX_PIXELS = 40000000
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_PREPROCESS_WORKERS = 4
+# 多图像分析时单个批次的最大图像数
+MULTI_IMAGE_BATCH_SIZE = 8
+# 联合模式(多张图像放入同一个提示词)允许的最大图像数，每张图像约占256个token
+JOINT_ANALYSIS_MAX_IMAGES = 6
+# 单次请求允许生成的最大token数，可由API接口或API密钥单独配置
+MAX_NEW_TOKENS_LIMIT = 512
+# 模型加载后预热生成的token数，为0时冷启动跳过预热(热切换仍会生成1个token验证新模型)
+MODEL_WARMUP_MAX_NEW_TOKENS = 8
+# 最近一次模型加载各阶段耗时报告的保存路径
+MODEL_LOAD_REPORT_PATH = os.path.join(BASE_DIR, 'logs', 'model_load_report.json')
+# 边界框图像：输出格式(JPEG或WEBP)、压缩质量、后台渲染线程数、首次访问时等待渲染的最长时间(秒)
+BOX_IMAGE_FORMAT = 'JPEG'
+BOX_IMAGE_QUALITY = 85
+BOX_IMAGE_RENDER_WORKERS = 2
+BOX_IMAGE_WAIT_TIMEOUT = 10
+# 边界框在原图上绘制，原图最长边超过此值时先缩小
+BOX_IMAGE_MAX_SIDE = 4096
+# 边界框图像存储：磁盘总大小上限(MB，超出时按最近访问时间淘汰)和内存缓存上限(MB)
+BOX_IMAGE_STORE_MAX_MB = 1024
+BOX_IMAGE_HOT_CACHE_MB = 64
+# 图像分析结果持久化缓存(按图像感知哈希、查询文本和模型配置)：是否启用和有效期(秒)
+ANALYSIS_RESULT_STORE_ENABLED = True
+ANALYSIS_RESULT_STORE_TTL = 7 * 24 * 3600
+# 推理类接口(图像分析、聊天完成)的执行线程数，以及所有线程都忙时允许排队的请求数，超出时返回429
+INFERENCE_EXECUTOR_WORKERS = 8
+INFERENCE_MAX_QUEUE_DEPTH = 32
+# 批量聊天完成接口单次允许的最大请求条数，以及对话历史和生成参数相同的请求每批同时生成的条数
+CHAT_BATCH_MAX_REQUESTS = 256
+CHAT_BATCH_GENERATE_SIZE = 8
+# 带Idempotency-Key的推理请求：成功响应的保存时间(秒)和最大保存条数，期间相同的重试直接返回保存的响应
+IDEMPOTENCY_KEY_TTL = 3600
+IDEMPOTENCY_MAX_ENTRIES = 1024
+# API速率限制(令牌桶)：是否启用、未配置接口的默认每分钟请求数(0表示不限制)，以及令牌桶存储
+# memory为进程内存储；多进程部署时使用sqlite，各进程共享RATE_LIMIT_SQLITE_PATH中的令牌桶
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_DEFAULT = 0
+RATE_LIMIT_BACKEND = 'memory'
+RATE_LIMIT_SQLITE_PATH = os.path.join(BASE_DIR, 'rate_limit.sqlite3')
 
 # 静态文件目录配置
 STATICFILES_DIRS = [
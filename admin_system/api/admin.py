@@ -28,7 +28,7 @@ class APIEndpointAdmin(admin.ModelAdmin):
             'classes': ('collapse',),
         }),
         ('限制与统计', {
-            'fields': ('rate_limit', 'call_count', 'error_count', 'average_response_time')
+            'fields': ('rate_limit', 'max_new_tokens_limit', 'call_count', 'error_count', 'average_response_time')
         }),
         ('时间信息', {
             'fields': ('created_at', 'updated_at'),
@@ -101,7 +101,7 @@ class APIKeyAdmin(admin.ModelAdmin):
             'fields': ('is_active', 'expires_at')
         }),
         ('限制', {
-            'fields': ('allowed_ips', 'rate_limit_override')
+            'fields': ('allowed_ips', 'rate_limit_override', 'max_new_tokens_override')
         }),
         ('统计', {
             'fields': ('call_count',)
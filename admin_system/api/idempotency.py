@@ -0,0 +1,115 @@
+"""
+幂等键模块 - 处理推理接口的Idempotency-Key请求头
+
+同一调用方以相同的Idempotency-Key和请求体重复提交时：前一次仍在执行则等待并
+共用其响应，已成功完成则在IDEMPOTENCY_KEY_TTL内直接返回保存的响应，不再推理。
+"""
+import json
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from core.image_preprocess import ImageTooLargeError
+from core.json_codec import get_json_body, dumps
+from core.response_cache import ResponseCache, hash_bytes
+
+from .uploads import is_binary_body, read_raw_body, upload_digests
+
+# 重放的响应带有此响应头
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+_responses = None
+_responses_lock = threading.Lock()
+
+
+def get_response_store():
+    """获取已完成响应的存储"""
+    global _responses
+
+    if _responses is None:
+        with _responses_lock:
+            if _responses is None:
+                _responses = ResponseCache(
+                    max_entries=getattr(settings, 'IDEMPOTENCY_MAX_ENTRIES', 1024),
+                    ttl=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 3600)
+                )
+    return _responses
+
+
+def request_digest(request):
+    """
+    请求内容的摘要，与视图共用同一次解析或读取，不直接访问request.body
+
+    multipart上传使用表单字段和各文件的哈希，其他二进制上传使用查询字符串和请求体哈希，
+    JSON请求使用解析后的内容。
+
+    Returns:
+        bytes: 摘要内容，请求体无法解析时返回None
+    """
+    try:
+        if request.content_type == 'multipart/form-data':
+            fields = sorted(request.POST.lists())
+            return dumps([fields, upload_digests(request)])
+        if is_binary_body(request):
+            read_raw_body(request)
+            return dumps([request.META.get('QUERY_STRING', ''), request.raw_body_sha256])
+        return dumps([request.META.get('QUERY_STRING', ''), get_json_body(request)])
+    except (json.JSONDecodeError, ImageTooLargeError):
+        # 请求不合法时视图直接返回错误，不需要合并
+        return None
+
+
+def get_idempotency_key(request):
+    """
+    根据Idempotency-Key请求头生成合并键
+
+    键包含请求路径、调用方(API密钥或客户端IP)和请求内容摘要，不同调用方或不同请求内容
+    使用相同的Idempotency-Key时互不影响。
+
+    Returns:
+        str: 合并键，未提供Idempotency-Key或请求体无法解析时返回None
+    """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return None
+    digest = request_digest(request)
+    if digest is None:
+        return None
+    caller = request.META.get('HTTP_X_API_KEY') or request.META.get('REMOTE_ADDR', '')
+    return 'idempotency:' + hash_bytes(
+        f"{request.method} {request.path}|{caller}|{idempotency_key}|".encode('utf-8') + digest
+    )
+
+
+def snapshot(response):
+    """
+    保存响应内容，流式响应无法重放，返回None
+
+    Returns:
+        tuple: (状态码, 内容, Content-Type)
+    """
+    if response.streaming:
+        return None
+    return response.status_code, response.content, response['Content-Type']
+
+
+def replay(saved):
+    """由snapshot保存的内容构造新的响应"""
+    status, content, content_type = saved
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def get_saved_response(key):
+    """获取已成功完成的响应，没有时返回None"""
+    saved = get_response_store().get(key)
+    return replay(saved) if saved else None
+
+
+def save_response(key, response):
+    """保存成功的响应，失败的请求重试时重新执行"""
+    saved = snapshot(response)
+    if saved and 200 <= saved[0] < 300:
+        get_response_store().set(key, saved)
@@ -1,11 +1,18 @@
 import json
 import time
 import re
+import hashlib
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
 from django.urls import resolve
 
+from core.json_codec import get_json_body, loads
+
 from .models import APIEndpoint, APILog, APIKey
+from .rate_limit import check_rate_limit
+from .uploads import is_binary_body, upload_digests
 
 class APILoggingMiddleware:
     """
@@ -14,27 +21,67 @@ class APILoggingMiddleware:
     记录所有API请求的详细信息，包括请求参数、响应状态、响应时间等
     """
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
         # API路径模式，匹配/api/开头的路径或views中定义的原有API路径
-        self.api_path_pattern = re.compile(r'^/api/|^/analyze$|^/v1/chat/completions$|^/search$|^/status$')
+        self.api_path_pattern = re.compile(r'^/api/|^/analyze(/upload)?$|^/v1/chat/completions(/batch)?$|^/search$|^/status$')
+        # ASGI下以异步方式处理，异步的推理视图不会被切换到同步线程中串行执行
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
         # 判断是否是API请求
         if not self.api_path_pattern.match(request.path):
             return self.get_response(request)
         
         # 记录请求开始时间
         start_time = time.time()
+        request_data = self.parse_request_data(request)
+        
+        # 处理请求
+        response = self.get_response(request)
+        
+        self.log_request(request, response, request_data, start_time)
+        return response
+    
+    async def __acall__(self, request):
+        if not self.api_path_pattern.match(request.path):
+            return await self.get_response(request)
+        
+        start_time = time.time()
+        request_data = self.parse_request_data(request)
+        
+        response = await self.get_response(request)
         
-        # 尝试解析请求体为JSON
+        # 数据库写入在同步线程中执行
+        await sync_to_async(self.log_request)(request, response, request_data, start_time)
+        return response
+    
+    def parse_request_data(self, request):
+        """尝试解析请求体为JSON，二进制上传在响应后只记录大小和哈希"""
         request_data = {}
-        if request.body:
+        if not is_binary_body(request) and request.body:
             try:
-                request_data = json.loads(request.body)
+                # 解析结果缓存在request上，视图不再重复解析
+                request_data = get_json_body(request)
             except json.JSONDecodeError:
                 # 如果不是有效的JSON，记录原始内容
                 request_data = {'raw_content': request.body.decode('utf-8', errors='replace')}
+        return request_data
+    
+    def log_request(self, request, response, request_data, start_time):
+        """记录API调用日志并更新端点和API密钥的统计信息"""
+        if is_binary_body(request):
+            request_data = self.summarize_binary_body(request)
+        
+        # 计算响应时间（毫秒）
+        response_time = (time.time() - start_time) * 1000
         
         # 获取请求头信息
         ip_address = self.get_client_ip(request)
@@ -43,12 +90,6 @@ class APILoggingMiddleware:
         # 获取API密钥
         api_key = request.META.get('HTTP_X_API_KEY', '')
         
-        # 处理请求
-        response = self.get_response(request)
-        
-        # 计算响应时间（毫秒）
-        response_time = (time.time() - start_time) * 1000
-        
         # 获取响应大小
         response_size = len(response.content) if hasattr(response, 'content') else 0
         
@@ -63,7 +104,9 @@ class APILoggingMiddleware:
                 method=method,
                 defaults={
                     'name': f"{method} {path}",
-                    'description': f"自动创建的API端点 ({timezone.now().strftime('%Y-%m-%d %H:%M:%S')})"
+                    'description': f"自动创建的API端点 ({timezone.now().strftime('%Y-%m-%d %H:%M:%S')})",
+                    # 自动创建的接口沿用全局默认限制，需要限流时在API接口管理中单独设置
+                    'rate_limit': getattr(settings, 'RATE_LIMIT_DEFAULT', 0)
                 }
             )
             
@@ -104,8 +147,6 @@ class APILoggingMiddleware:
         except Exception as e:
             # 记录日志中间件不应该影响正常请求处理
             print(f"API日志记录错误: {str(e)}")
-        
-        return response
     
     def get_client_ip(self, request):
         """获取客户端真实IP地址"""
@@ -116,6 +157,29 @@ class APILoggingMiddleware:
             ip = request.META.get('REMOTE_ADDR')
         return ip
     
+    def summarize_binary_body(self, request):
+        """
+        二进制请求体的日志摘要，只包含大小和SHA-256哈希
+        
+        在视图处理之后调用，此时请求体已被视图读取或解析，不会再次读取网络数据。
+        """
+        summary = {
+            'content_type': request.content_type,
+            'size': int(request.META.get('CONTENT_LENGTH') or 0),
+        }
+        try:
+            if request.content_type == 'multipart/form-data':
+                summary['files'] = [
+                    {'field': field, 'size': size, 'sha256': sha256}
+                    for field, size, sha256 in upload_digests(request)
+                ]
+            else:
+                # 视图按块读取请求体时已计算哈希，此时request.body不再可用
+                summary['sha256'] = getattr(request, 'raw_body_sha256', None) or hashlib.sha256(request.body).hexdigest()
+        except Exception as e:
+            summary['error'] = str(e)
+        return summary
+    
     def get_error_message(self, response):
         """从响应中提取错误信息"""
         if response.status_code < 400:
@@ -124,7 +188,7 @@ class APILoggingMiddleware:
         try:
             if hasattr(response, 'content'):
                 # 尝试解析JSON响应
-                data = json.loads(response.content.decode('utf-8'))
+                data = loads(response.content)
                 if 'error' in data:
                     return data['error']
                 elif 'message' in data:
@@ -140,10 +204,15 @@ class APIKeyMiddleware:
     验证请求中的API密钥，并强制执行速率限制和IP限制
     """
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
         # API路径模式，匹配/api/开头的路径或views中定义的原有API路径
-        self.api_path_pattern = re.compile(r'^/api/|^/analyze$|^/v1/chat/completions$|^/search$|^/status$')
+        self.api_path_pattern = re.compile(r'^/api/|^/analyze(/upload)?$|^/v1/chat/completions(/batch)?$|^/search$|^/status$')
         
         # 路径白名单，不需要API密钥验证的路径
         self.path_whitelist = [
@@ -154,10 +223,21 @@ class APIKeyMiddleware:
             '/api/test/execute/',  # 测试执行API
             '/api/endpoint/',  # 端点详情API
         ]
+        # 不做速率限制的路径：边界框图像内容不变且可长期缓存，不经过模型
+        self.rate_limit_exempt_pattern = re.compile(r'^(/api)?/box_images/')
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        # 速率限制在读取请求体之前执行，被限流的请求不会占用解析和推理资源
+        result = self.check_rate_limit(request)
+        if result and not result.allowed:
+            return result.apply_headers(self.rate_limited_response(result))
+        
         # 临时完全禁用API密钥验证，直接放行所有请求
-        return self.get_response(request)
+        response = self.get_response(request)
+        return result.apply_headers(response) if result else response
         
         # 以下代码暂时不执行
         """
@@ -199,8 +279,7 @@ class APIKeyMiddleware:
                         'error': f'此API密钥不允许从IP {client_ip} 访问'
                     }, status=403)
             
-            # 检查速率限制（此处仅为示例，真实实现应使用Redis等工具进行速率限制）
-            # 在这个简化实现中，我们不检查速率限制
+            # 速率限制已在check_rate_limit中检查
             
         except APIKey.DoesNotExist:
             return JsonResponse({
@@ -211,6 +290,37 @@ class APIKeyMiddleware:
         return self.get_response(request)
         """
     
+    async def __acall__(self, request):
+        result = await sync_to_async(self.check_rate_limit)(request)
+        if result and not result.allowed:
+            return result.apply_headers(self.rate_limited_response(result))
+        
+        response = await self.get_response(request)
+        return result.apply_headers(response) if result else response
+    
+    def check_rate_limit(self, request):
+        """
+        按API密钥(未提供时按客户端IP)和接口检查速率限制
+        
+        Returns:
+            RateLimitResult: 检查结果，不需要限流的请求返回None
+        """
+        if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            return None
+        if (not self.api_path_pattern.match(request.path) or request.path in self.path_whitelist
+                or self.rate_limit_exempt_pattern.match(request.path)):
+            return None
+        
+        api_key = request.META.get('HTTP_X_API_KEY', '')
+        identity = f"key:{api_key}" if api_key else f"ip:{self.get_client_ip(request)}"
+        return check_rate_limit(identity, request.path, request.method, api_key)
+    
+    def rate_limited_response(self, result):
+        """超过速率限制时的429响应"""
+        return JsonResponse({
+            'error': f'请求过于频繁，每分钟最多{result.limit}次，请{result.retry_after}秒后重试'
+        }, status=429)
+    
     def get_client_ip(self, request):
         """获取客户端真实IP地址"""
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
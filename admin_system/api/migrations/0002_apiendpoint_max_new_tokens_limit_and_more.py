@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiendpoint',
+            name='max_new_tokens_limit',
+            field=models.IntegerField(blank=True, help_text='单次请求允许生成的最大token数，留空表示使用全局默认上限', null=True, verbose_name='最大生成token数'),
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='max_new_tokens_override',
+            field=models.IntegerField(blank=True, help_text='单次请求允许生成的最大token数，覆盖接口默认上限，留空表示使用接口默认上限', null=True, verbose_name='最大生成token数覆盖'),
+        ),
+    ]
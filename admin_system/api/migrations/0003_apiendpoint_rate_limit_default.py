@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def reset_auto_created_limits(apps, schema_editor):
+    """自动创建的接口此前使用模型默认值60，限流生效后改为不限制"""
+    APIEndpoint = apps.get_model('api', 'APIEndpoint')
+    APIEndpoint.objects.filter(description__startswith='自动创建的API端点', rate_limit=60).update(rate_limit=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_apiendpoint_max_new_tokens_limit_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apiendpoint',
+            name='rate_limit',
+            field=models.IntegerField(default=0, help_text='每分钟允许的最大请求次数，0表示不限制', verbose_name='速率限制(每分钟)'),
+        ),
+        migrations.RunPython(reset_auto_created_limits, migrations.RunPython.noop),
+    ]
@@ -34,7 +34,9 @@ class APIEndpoint(models.Model):
     response_schema = models.JSONField('响应参数配置', default=dict, blank=True, null=True)
     
     # 速率限制配置
-    rate_limit = models.IntegerField('速率限制(每分钟)', default=60, help_text='每分钟允许的最大请求次数')
+    rate_limit = models.IntegerField('速率限制(每分钟)', default=0, help_text='每分钟允许的最大请求次数，0表示不限制')
+    max_new_tokens_limit = models.IntegerField('最大生成token数', blank=True, null=True,
+                                               help_text='单次请求允许生成的最大token数，留空表示使用全局默认上限')
     
     # 统计信息
     call_count = models.IntegerField('调用次数', default=0)
@@ -143,6 +145,8 @@ class APIKey(models.Model):
     # 限制
     rate_limit_override = models.IntegerField('速率限制覆盖', blank=True, null=True,
                                             help_text='每分钟请求数，覆盖接口默认限制，留空表示使用接口默认限制')
+    max_new_tokens_override = models.IntegerField('最大生成token数覆盖', blank=True, null=True,
+                                                  help_text='单次请求允许生成的最大token数，覆盖接口默认上限，留空表示使用接口默认上限')
     
     # 统计
     call_count = models.IntegerField('调用次数', default=0)
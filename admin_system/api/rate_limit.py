@@ -0,0 +1,224 @@
+"""
+速率限制模块 - 按API密钥(或客户端IP)和接口的令牌桶限流
+
+每个(调用方, 接口)对应一个令牌桶，容量为每分钟允许的请求数，令牌按相同速率
+持续补充，因此允许短时突发但长期速率不超过限制。限制值优先取APIKey.rate_limit_override，
+其次取APIEndpoint.rate_limit，都没有时使用RATE_LIMIT_DEFAULT；限制值不大于0表示不限制。
+
+令牌桶默认保存在进程内存中；多个Web进程部署时可设置RATE_LIMIT_BACKEND = 'sqlite'，
+所有进程共享同一个SQLite文件中的令牌桶。
+"""
+import math
+import time
+import logging
+import sqlite3
+import threading
+
+from django.conf import settings
+
+from .models import APIEndpoint, APIKey
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 令牌桶从空补满的时间(秒)，容量为每分钟请求数，补满正好需要一分钟
+REFILL_WINDOW = 60.0
+# 限制值的缓存时间(秒)，管理后台修改后最多延迟这么久生效
+LIMIT_CACHE_TTL = 10
+# 内存令牌桶数超过此值时清理已补满的桶
+MEMORY_PRUNE_THRESHOLD = 10000
+
+_backend = None
+_backend_lock = threading.Lock()
+
+_limit_cache = {}  # (路径, 方法, API密钥) -> (限制值, 过期时间)
+_limit_cache_lock = threading.Lock()
+
+
+class RateLimitResult:
+    """一次限流检查的结果"""
+
+    def __init__(self, allowed, limit, remaining, reset, retry_after=0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset  # 令牌桶补满所需的秒数
+        self.retry_after = retry_after  # 被拒绝时下一个令牌可用所需的秒数
+
+    def apply_headers(self, response):
+        """在响应中添加X-RateLimit-*头，被拒绝时另加Retry-After"""
+        response['X-RateLimit-Limit'] = str(self.limit)
+        response['X-RateLimit-Remaining'] = str(self.remaining)
+        response['X-RateLimit-Reset'] = str(self.reset)
+        if not self.allowed:
+            response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+def take_token(tokens, updated, capacity, now):
+    """
+    补充令牌并尝试取出一个
+
+    Args:
+        tokens: 上次更新后的令牌数，None表示新的令牌桶
+        updated: 上次更新时间
+        capacity: 令牌桶容量(每分钟请求数)
+        now: 当前时间
+
+    Returns:
+        tuple: (是否取得令牌, 剩余令牌数)
+    """
+    if tokens is None:
+        tokens = float(capacity)
+    else:
+        tokens = min(float(capacity), tokens + max(0.0, now - updated) * capacity / REFILL_WINDOW)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class MemoryBucketBackend:
+    """进程内的令牌桶，只对当前进程生效"""
+
+    def __init__(self):
+        self._buckets = {}  # 键 -> (令牌数, 更新时间)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, now=None):
+        """取出一个令牌，返回值同take_token"""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, now))
+            allowed, tokens = take_token(tokens, updated, capacity, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MEMORY_PRUNE_THRESHOLD:
+                self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        """删除一个补充周期内未使用的桶，它们已经补满，与新建的桶等价"""
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated >= REFILL_WINDOW]:
+            del self._buckets[key]
+
+
+class SQLiteBucketBackend:
+    """保存在SQLite文件中的令牌桶，同一主机上的多个Web进程共享"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, now=None):
+        """取出一个令牌，返回值同take_token"""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        # IMMEDIATE事务在读取前取得写锁，多个进程对同一个桶的读-改-写不会交错
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (None, now)
+            allowed, tokens = take_token(tokens, updated, capacity, now)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - REFILL_WINDOW,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, tokens
+
+
+def get_backend():
+    """获取令牌桶存储后端"""
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+                    _backend = SQLiteBucketBackend(settings.RATE_LIMIT_SQLITE_PATH)
+                else:
+                    _backend = MemoryBucketBackend()
+    return _backend
+
+
+def get_rate_limit(path, method, api_key):
+    """
+    获取调用方对接口的每分钟请求数限制
+
+    Args:
+        path: 请求路径
+        method: 请求方法
+        api_key: API密钥，可为空
+
+    Returns:
+        int: 每分钟请求数，不大于0表示不限制
+    """
+    cache_key = (path, method, api_key)
+    now = time.time()
+    cached = _limit_cache.get(cache_key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    limit = None
+    if api_key:
+        limit = APIKey.objects.filter(key=api_key).values_list('rate_limit_override', flat=True).first()
+    if limit is None:
+        limit = APIEndpoint.objects.filter(path=path, method=method).values_list('rate_limit', flat=True).first()
+    if limit is None:
+        limit = getattr(settings, 'RATE_LIMIT_DEFAULT', 0)
+
+    with _limit_cache_lock:
+        if len(_limit_cache) > MEMORY_PRUNE_THRESHOLD:
+            _limit_cache.clear()
+        _limit_cache[cache_key] = (limit, now + LIMIT_CACHE_TTL)
+    return limit
+
+
+def check_rate_limit(identity, path, method, api_key=None):
+    """
+    检查并消耗一次请求的配额
+
+    Args:
+        identity: 调用方标识，有API密钥时为密钥，否则为客户端IP
+        path: 请求路径
+        method: 请求方法
+        api_key: API密钥，用于查找限制覆盖值
+
+    Returns:
+        RateLimitResult: 检查结果，不限制或限流存储出错时返回None
+    """
+    limit = get_rate_limit(path, method, api_key)
+    if limit <= 0:
+        return None
+
+    try:
+        allowed, tokens = get_backend().take(f"{identity}|{method} {path}", limit)
+    except Exception as e:
+        # 限流存储不可用时放行，不影响正常请求
+        logger.warning(f"速率限制检查失败: {str(e)}")
+        return None
+
+    rate = limit / REFILL_WINDOW
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=int(tokens),
+        reset=math.ceil((limit - tokens) / rate),
+        retry_after=0 if allowed else max(1, math.ceil((1 - tokens) / rate)),
+    )
@@ -161,4 +161,143 @@ class ApiVectorIntegrationTests(TestCase):
         # 验证回复中包含知识库中的关键信息
         # 至少应该提到天安门、故宫或长城中的一个
         mentioned_landmarks = any(landmark in content for landmark in ['天安门', '故宫', '长城'])
-        self.assertTrue(mentioned_landmarks, f"回复中未包含知识库中的地标信息: {content}") 
\ No newline at end of file
+        self.assertTrue(mentioned_landmarks, f"回复中未包含知识库中的地标信息: {content}") 
+
+class GenerationOptionsTests(TestCase):
+    """生成参数与最大生成token数限制测试"""
+    
+    def setUp(self):
+        self.client = Client()
+    
+    def test_max_tokens_capped_by_api_key(self):
+        """API密钥的覆盖值优先于接口配置"""
+        from api.models import APIEndpoint, APIKey
+        from api.views import parse_generation_options
+        from django.test import RequestFactory
+        
+        APIEndpoint.objects.create(name='chat', path='/v1/chat/completions', method='POST', max_new_tokens_limit=256)
+        APIKey.objects.create(name='test', key='test-key', max_new_tokens_override=64)
+        
+        request = RequestFactory().post('/v1/chat/completions')
+        self.assertEqual(parse_generation_options(request, {'max_tokens': 1000})['max_new_tokens'], 256)
+        
+        request = RequestFactory().post('/v1/chat/completions', HTTP_X_API_KEY='test-key')
+        options = parse_generation_options(request, {'max_tokens': 1000, 'temperature': 0, 'stop': '###'})
+        self.assertEqual(options, {'max_new_tokens': 64, 'do_sample': False, 'stop': ['###']})
+    
+    def test_invalid_max_tokens(self):
+        """非法的max_tokens返回400"""
+        response = self.client.post(
+            '/v1/chat/completions',
+            json.dumps({'messages': [{'role': 'user', 'content': '你好'}], 'max_tokens': -1}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+    
+    def test_form_params(self):
+        """表单和查询字符串中的生成参数按JSON请求体的类型解析"""
+        from api.views import parse_form_params
+        from django.http import QueryDict
+        
+        params = QueryDict('max_tokens=32&temperature=0.5&stop=%23%23&stop=END')
+        self.assertEqual(parse_form_params(params), {'max_tokens': 32, 'temperature': 0.5, 'stop': ['##', 'END']})
+        with self.assertRaises(ValueError):
+            parse_form_params(QueryDict('max_tokens=abc'))
+
+class BinaryUploadTests(TestCase):
+    """二进制上传测试"""
+    
+    def test_is_binary_body(self):
+        """上传接口的任何Content-Type都按二进制处理，其他接口只看Content-Type"""
+        from api.uploads import is_binary_body
+        from django.test import RequestFactory
+        
+        factory = RequestFactory()
+        for content_type in ('text/plain', 'application/json', 'image/png'):
+            for path in ('/api/analyze/upload', '/analyze/upload'):
+                self.assertTrue(is_binary_body(factory.post(path, b'\x89PNG', content_type=content_type)))
+        self.assertFalse(is_binary_body(factory.post('/api/analyze', '{}', content_type='application/json')))
+        self.assertTrue(is_binary_body(factory.post('/api/analyze', b'\x00', content_type='application/octet-stream')))
+
+class RateLimitTests(TestCase):
+    """令牌桶速率限制测试"""
+    
+    def test_token_bucket(self):
+        """令牌用完后拒绝，按每分钟限制的速率补充"""
+        from api.rate_limit import MemoryBucketBackend
+        
+        backend = MemoryBucketBackend()
+        self.assertEqual([backend.take('k', 2, now=100.0)[0] for _ in range(3)], [True, True, False])
+        # 每分钟2次，30秒补充1个令牌
+        self.assertTrue(backend.take('k', 2, now=130.0)[0])
+        self.assertFalse(backend.take('k', 2, now=131.0)[0])
+    
+    def test_rate_limit_headers(self):
+        """超过API密钥的限制时返回429和X-RateLimit-*头，且不进入视图"""
+        from api.models import APIKey
+        
+        APIKey.objects.create(name='limited', key='limited-key', rate_limit_override=1)
+        body = json.dumps({'messages': []})
+        response = self.client.post('/v1/chat/completions', body, content_type='application/json',
+                                    HTTP_X_API_KEY='limited-key')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['X-RateLimit-Limit'], '1')
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+        
+        response = self.client.post('/v1/chat/completions', body, content_type='application/json',
+                                    HTTP_X_API_KEY='limited-key')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_unlimited_by_default(self):
+        """未配置限制时不限流，日志中间件自动创建的接口同样不限流"""
+        body = json.dumps({'messages': []})
+        for _ in range(3):
+            response = self.client.post('/v1/chat/completions', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('X-RateLimit-Limit', response)
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key合并键测试"""
+    
+    def test_idempotency_key(self):
+        """键区分调用方和请求体，未提供请求头时不合并"""
+        from api.idempotency import get_idempotency_key
+        from django.test import RequestFactory
+        
+        factory = RequestFactory()
+        
+        def make_key(body, **extra):
+            return get_idempotency_key(factory.post('/api/analyze', body, content_type='application/json', **extra))
+        
+        self.assertIsNone(make_key('{}'))
+        key = make_key('{}', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(key, make_key('{}', HTTP_IDEMPOTENCY_KEY='retry-1'))
+        self.assertNotEqual(key, make_key('{"a": 1}', HTTP_IDEMPOTENCY_KEY='retry-1'))
+        self.assertNotEqual(key, make_key('{}', HTTP_IDEMPOTENCY_KEY='retry-1', HTTP_X_API_KEY='other'))
+    
+    def test_idempotency_key_for_uploads(self):
+        """上传请求按文件哈希生成键，生成键后视图仍能读取上传的文件和请求体"""
+        from api.idempotency import get_idempotency_key
+        from api.uploads import read_raw_body
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+        
+        factory = RequestFactory()
+        
+        def upload(content):
+            request = factory.post('/api/analyze/upload', {
+                'query': '布局',
+                'image': SimpleUploadedFile('a.png', content, content_type='image/png'),
+            }, HTTP_IDEMPOTENCY_KEY='retry-1')
+            return request, get_idempotency_key(request)
+        
+        request, key = upload(b'image-1')
+        self.assertEqual(key, upload(b'image-1')[1])
+        self.assertNotEqual(key, upload(b'image-2')[1])
+        self.assertEqual(request.FILES['image'].read(), b'image-1')
+        
+        request = factory.post('/api/analyze/upload?query=x', b'raw-image', content_type='text/plain',
+                               HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertIsNotNone(get_idempotency_key(request))
+        self.assertEqual(bytes(read_raw_body(request)), b'raw-image')
@@ -0,0 +1,99 @@
+"""
+二进制上传模块 - 判断和读取以二进制方式上传的请求体
+
+日志中间件、幂等键和上传视图共用这里的判断和读取结果：二进制请求体只按块
+读取一次，读取结果和哈希缓存在request上。
+"""
+import re
+import hashlib
+
+from django.conf import settings
+
+from core.image_preprocess import ImageTooLargeError
+
+# 以二进制方式上传的请求体，日志中只记录大小和哈希，不解析内容
+BINARY_CONTENT_TYPES = ('multipart/form-data', 'application/octet-stream')
+# 二进制上传接口，无论Content-Type如何，视图都把非multipart的请求体当作图像原始字节
+BINARY_UPLOAD_PATH_PATTERN = re.compile(r'^(/api)?/analyze/upload$')
+
+# 读取二进制请求体的块大小
+RAW_BODY_CHUNK_SIZE = 64 * 1024
+
+# 请求对象上缓存读取结果和文件摘要的属性名
+_RAW_BODY_ATTR = '_raw_body'
+_DIGESTS_ATTR = '_upload_digests'
+
+
+def is_binary_body(request):
+    """判断请求体是否为二进制上传"""
+    content_type = request.content_type or ''
+    return (content_type in BINARY_CONTENT_TYPES or content_type.startswith('image/')
+            or bool(BINARY_UPLOAD_PATH_PATTERN.match(request.path)))
+
+
+def read_raw_body(request):
+    """
+    按块读取二进制上传的请求体，结果缓存在request上
+
+    不经过request.body，因此不受DATA_UPLOAD_MAX_MEMORY_SIZE限制，上限为IMAGE_MAX_BYTES，
+    超过上限时立即停止读取。读取时计算的SHA-256保存在request.raw_body_sha256。
+
+    Returns:
+        bytearray: 请求体
+
+    Raises:
+        ImageTooLargeError: 请求体超过IMAGE_MAX_BYTES，后续调用抛出同一异常
+    """
+    body = getattr(request, _RAW_BODY_ATTR, None)
+    if body is None:
+        try:
+            body = _read_chunks(request)
+        except ImageTooLargeError as e:
+            body = e
+        setattr(request, _RAW_BODY_ATTR, body)
+    if isinstance(body, ImageTooLargeError):
+        raise body
+    return body
+
+
+def _read_chunks(request):
+    """读取请求体并计算哈希"""
+    max_bytes = getattr(settings, 'IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+    error = f"图像大小超过上限 {max_bytes // 1024 // 1024}MB"
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes:
+        raise ImageTooLargeError(error)
+
+    body = bytearray()
+    digest = hashlib.sha256()
+    while True:
+        chunk = request.read(RAW_BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        body += chunk
+        if len(body) > max_bytes:
+            raise ImageTooLargeError(error)
+        digest.update(chunk)
+    request.raw_body_sha256 = digest.hexdigest()
+    return body
+
+
+def upload_digests(request):
+    """
+    multipart上传中各文件的摘要，按块计算，不把文件读入内存；结果缓存在request上
+
+    Returns:
+        list: [(字段名, 文件大小, SHA-256), ...]
+    """
+    digests = getattr(request, _DIGESTS_ATTR, None)
+    if digests is None:
+        digests = []
+        for field, uploads in request.FILES.lists():
+            for uploaded in uploads:
+                digest = hashlib.sha256()
+                for chunk in uploaded.chunks():
+                    digest.update(chunk)
+                # chunks()读到文件末尾，复位以便视图再次读取
+                uploaded.seek(0)
+                digests.append((field, uploaded.size, digest.hexdigest()))
+        setattr(request, _DIGESTS_ATTR, digests)
+    return digests
@@ -10,10 +10,13 @@ urlpatterns = [
     # 首页路由
     path('', views.index_view, name='index'),
     # 原有API接口
-    path('analyze', views.analyze_image, name='api_analyze_image'),
-    path('v1/chat/completions', views.chat_completions, name='api_chat_completions'),
+    path('analyze', views.analyze_image_async, name='api_analyze_image'),
+    path('analyze/upload', views.analyze_image_upload_async, name='api_analyze_image_upload'),
+    path('v1/chat/completions', views.chat_completions_async, name='api_chat_completions'),
+    path('v1/chat/completions/batch', views.chat_completions_batch_async, name='api_chat_completions_batch'),
     path('search', views.search_knowledge_base, name='api_search_kb'),
     path('status', views.get_service_status, name='api_service_status'),
+    path('box_images/<str:name>', views.box_image, name='api_box_image'),
     
     # API管理界面
     path('docs/', views.api_docs_view, name='api_docs'),
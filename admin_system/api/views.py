@@ -5,19 +5,34 @@ API视图函数 - 提供与原系统兼容的API接口
 """
 import json
 import time
-from django.http import JsonResponse, HttpResponse
+import asyncio
+import threading
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 # 导入核心功能模块
-from core.image_analysis import analyze_image as analyze_image_core
-from core.text_processing import chat_completion
+from core.image_analysis import analyze_image as analyze_image_core, ANALYSIS_MODES
+from core.image_preprocess import ImageTooLargeError
+from core.text_processing import chat_completion, iter_chat_completions
 from core.model_service import get_service_status as get_model_status
+from core.utils import build_generation_options
+from core.box_images import get_boxed_image
+from core.timing import get_timing_stats
+from core.inference_executor import get_inference_executor, InferenceQueueFullError
+from core.json_codec import JsonResponse, get_json_body, dumps
+from core.single_flight import get_single_flight
 from management.models import KnowledgeBase
 from knowledge_base.services import search_knowledge_base as kb_vector_search
 
 # 导入API模型
 from .models import APIEndpoint, APIKey
+from .idempotency import get_idempotency_key, get_saved_response, save_response, snapshot, replay
+from .uploads import read_raw_body
 
 # 导入管理员装饰器
 from django.contrib.admin.views.decorators import staff_member_required
@@ -36,11 +51,43 @@ def index_view(request):
         '<ul>'
         '<li>/api/analyze - 图像分析接口</li>'
         '<li>/api/v1/chat/completions - 聊天完成接口</li>'
+        '<li>/api/v1/chat/completions/batch - 批量聊天完成接口</li>'
         '<li>/api/search - 知识库搜索接口</li>'
         '<li>/api/status - 服务状态接口</li>'
         '</ul>'
     )
 
+def get_max_tokens_limit(request):
+    """
+    获取当前请求允许的最大生成token数
+    
+    优先使用API密钥的覆盖值，其次使用接口配置，均未配置时返回None(使用全局默认上限)。
+    """
+    api_key = request.META.get('HTTP_X_API_KEY', '')
+    if api_key:
+        key_limit = APIKey.objects.filter(key=api_key).values_list('max_new_tokens_override', flat=True).first()
+        if key_limit:
+            return key_limit
+    
+    return APIEndpoint.objects.filter(
+        path=request.path,
+        method=request.method
+    ).values_list('max_new_tokens_limit', flat=True).first()
+
+def parse_generation_options(request, data):
+    """
+    从请求体中解析生成参数，并应用服务端的最大生成token数限制
+    
+    Raises:
+        ValueError: 参数不合法
+    """
+    return build_generation_options(
+        max_tokens=data.get('max_tokens', data.get('max_new_tokens')),
+        temperature=data.get('temperature'),
+        stop=data.get('stop'),
+        max_tokens_limit=get_max_tokens_limit(request)
+    )
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def analyze_image(request):
@@ -51,7 +98,7 @@ def analyze_image(request):
     """
     try:
         # 解析JSON请求体
-        data = json.loads(request.body)
+        data = get_json_body(request)
         
         # 提取图像和查询
         image_base64 = data.get('image_base64')
@@ -68,8 +115,21 @@ def analyze_image(request):
                 'error': '缺少查询文本 (query)'
             }, status=400)
         
+        mode = data.get('mode', 'separate')
+        if mode not in ANALYSIS_MODES:
+            return JsonResponse({
+                'error': f"mode必须是{'或'.join(ANALYSIS_MODES)}"
+            }, status=400)
+        
+        try:
+            options = parse_generation_options(request, data)
+        except ValueError as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+        
         # 调用核心分析函数
-        result = analyze_image_core(image_base64, query)
+        result = analyze_image_core(image_base64, query, options, mode)
         
         # 返回结果
         return JsonResponse(result)
@@ -84,6 +144,94 @@ def analyze_image(request):
             'error': f'处理请求时出错: {str(e)}'
         }, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def analyze_image_upload(request):
+    """
+    二进制图像分析接口
+    
+    multipart/form-data请求中image字段为图像文件(可重复以上传多张)，query等参数为
+    表单字段；其他Content-Type时请求体为图像原始字节，query等参数放在查询字符串中。
+    图像不经过Base64和JSON，直接交给解码器。
+    """
+    try:
+        if request.content_type == 'multipart/form-data':
+            images = request.FILES.getlist('image')
+            params = request.POST
+        else:
+            try:
+                body = read_raw_body(request)
+            except ImageTooLargeError as e:
+                return JsonResponse({
+                    'error': str(e)
+                }, status=413)
+            images = [body] if body else []
+            params = request.GET
+        
+        query = params.get('query')
+        
+        # 验证必要字段
+        if not images:
+            return JsonResponse({
+                'error': '缺少图像数据 (image)'
+            }, status=400)
+            
+        if not query:
+            return JsonResponse({
+                'error': '缺少查询文本 (query)'
+            }, status=400)
+        
+        mode = params.get('mode', 'separate')
+        if mode not in ANALYSIS_MODES:
+            return JsonResponse({
+                'error': f"mode必须是{'或'.join(ANALYSIS_MODES)}"
+            }, status=400)
+        
+        try:
+            options = parse_generation_options(request, parse_form_params(params))
+        except ValueError as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+        
+        # 调用核心分析函数
+        result = analyze_image_core(images if len(images) > 1 else images[0], query, options, mode)
+        
+        # 返回结果
+        return JsonResponse(result)
+        
+    except Exception as e:
+        return JsonResponse({
+            'error': f'处理请求时出错: {str(e)}'
+        }, status=500)
+
+def parse_form_params(params):
+    """
+    把表单或查询字符串中的生成参数转换为与JSON请求体相同的类型
+    
+    Raises:
+        ValueError: 参数不合法
+    """
+    data = {}
+    max_tokens = params.get('max_tokens', params.get('max_new_tokens'))
+    if max_tokens:
+        try:
+            data['max_tokens'] = int(max_tokens)
+        except ValueError:
+            raise ValueError('max_tokens必须是正整数')
+    
+    temperature = params.get('temperature')
+    if temperature:
+        try:
+            data['temperature'] = float(temperature)
+        except ValueError:
+            raise ValueError('temperature必须在0到2之间')
+    
+    stop = params.getlist('stop')
+    if stop:
+        data['stop'] = stop if len(stop) > 1 else stop[0]
+    return data
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def chat_completions(request):
@@ -94,7 +242,7 @@ def chat_completions(request):
     """
     try:
         # 解析JSON请求体
-        data = json.loads(request.body)
+        data = get_json_body(request)
         
         # 提取消息
         messages = data.get('messages', [])
@@ -106,26 +254,26 @@ def chat_completions(request):
                 'error': '缺少消息列表 (messages)'
             }, status=400)
         
+        try:
+            options = parse_generation_options(request, data)
+        except ValueError as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+        
         # 调用核心聊天完成函数
-        result = chat_completion(messages, stream)
+        result = chat_completion(messages, stream, options)
         
-        # 处理流式响应（这里简化处理，实际应使用StreamingHttpResponse）
+        # 处理流式响应，以server-sent events逐段返回
         if stream and 'stream' in result:
-            # 将生成器转换为列表
-            responses = list(result['stream'])
-            result = {
-                'id': f"chatcmpl-{int(time.time()*1000)}",
-                'object': 'chat.completion.chunk',
-                'choices': [
-                    {
-                        'index': 0,
-                        'delta': {
-                            'content': ''.join(responses)
-                        },
-                        'finish_reason': 'stop'
-                    }
-                ]
-            }
+            response = StreamingHttpResponse(
+                sse_chat_chunks(result['stream']),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            # 禁止反向代理缓冲，保证首个token尽快到达客户端
+            response['X-Accel-Buffering'] = 'no'
+            return response
         
         # 返回结果
         return JsonResponse(result)
@@ -140,6 +288,264 @@ def chat_completions(request):
             'error': f'处理请求时出错: {str(e)}'
         }, status=500)
 
+# 批量请求中各条共用的生成参数，单条中的同名参数优先
+BATCH_SHARED_OPTIONS = ('max_tokens', 'max_new_tokens', 'temperature', 'stop')
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def chat_completions_batch(request):
+    """
+    批量聊天完成接口
+
+    请求体为{"requests": [{"messages": [...], ...}, ...]}，顶层的生成参数作为各条的默认值。
+    所有对话一起提交到推理调度器；stream为false时按请求顺序返回全部结果，为true时
+    以NDJSON每完成一条返回一行。单条出错只在该条结果中返回error。
+    """
+    try:
+        data = get_json_body(request)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'error': '无效的JSON格式'
+        }, status=400)
+
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({
+            'error': '缺少请求列表 (requests)'
+        }, status=400)
+
+    max_requests = getattr(settings, 'CHAT_BATCH_MAX_REQUESTS', 256)
+    if len(items) > max_requests:
+        return JsonResponse({
+            'error': f'单次最多{max_requests}条请求'
+        }, status=400)
+
+    try:
+        # 最大生成token数限制对整个批次只查询一次
+        max_tokens_limit = get_max_tokens_limit(request)
+        defaults = {key: data[key] for key in BATCH_SHARED_OPTIONS if key in data}
+
+        # 参数不合法的条目直接返回错误，其余条目提交推理
+        errors = []
+        conversations = []
+        indexes = []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('请求必须是JSON对象')
+                params = {**defaults, **item}
+                options = build_generation_options(
+                    max_tokens=params.get('max_tokens', params.get('max_new_tokens')),
+                    temperature=params.get('temperature'),
+                    stop=params.get('stop'),
+                    max_tokens_limit=max_tokens_limit
+                )
+            except ValueError as e:
+                errors.append((index, {'error': str(e), 'processing_time': 'N/A'}))
+                continue
+            conversations.append((item.get('messages'), options))
+            indexes.append(index)
+
+        def results():
+            yield from errors
+            for position, result in iter_chat_completions(conversations):
+                yield indexes[position], result
+
+        if data.get('stream', False):
+            response = StreamingHttpResponse(
+                (dumps({'index': index, **result}) + b'\n' for index, result in results()),
+                content_type='application/x-ndjson'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        start_time = time.time()
+        ordered = [None] * len(items)
+        for index, result in results():
+            ordered[index] = {'index': index, **result}
+
+        return JsonResponse({
+            'object': 'list',
+            'data': ordered,
+            'processing_time': f"{time.time() - start_time:.2f}秒"
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'error': f'处理请求时出错: {str(e)}'
+        }, status=500)
+
+def sse_chat_chunks(deltas):
+    """
+    将增量文本转换为OpenAI格式的server-sent events
+    
+    Args:
+        deltas: 增量文本生成器
+    
+    Yields:
+        str: "data: ..."格式的事件文本，最后以"data: [DONE]"结束
+    """
+    chunk_id = f"chatcmpl-{int(time.time()*1000)}"
+    created = int(time.time())
+    
+    def make_chunk(delta, finish_reason=None):
+        chunk = {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': 'qwen-vl-chat',
+            'choices': [
+                {
+                    'index': 0,
+                    'delta': delta,
+                    'finish_reason': finish_reason
+                }
+            ]
+        }
+        return f"data: {dumps(chunk).decode('utf-8')}\n\n"
+    
+    yield make_chunk({'role': 'assistant'})
+    for delta in deltas:
+        yield make_chunk({'content': delta})
+    yield make_chunk({}, finish_reason='stop')
+    yield "data: [DONE]\n\n"
+
+async def iterate_in_thread(iterator):
+    """
+    在线程中逐段迭代同步生成器
+
+    ASGI下Django 4.2会把同步的流式响应内容整个读完再发送，转换为异步迭代器后
+    每段内容生成后立即发送。
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    end = object()
+    while True:
+        chunk = await next_chunk(iterator, end)
+        if chunk is end:
+            break
+        yield chunk
+
+class HeldStream:
+    """
+    流式响应内容的包装，内容发送完毕或响应被关闭时释放推理执行器的名额
+
+    不使用生成器实现，因为未开始迭代的生成器在close时不会执行finally。
+    """
+
+    def __init__(self, chunks, executor, started_at):
+        self._chunks = iter(chunks)
+        self._executor = executor
+        self._started_at = started_at
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._executor.release(self._started_at)
+
+def run_view(view, request, *args, **kwargs):
+    """
+    在推理线程池中执行视图
+
+    流式响应的生成发生在视图返回之后，返回前把视图占用的名额转交给响应内容，
+    直到内容发送完毕才释放，因此打开的流同样受INFERENCE_MAX_QUEUE_DEPTH限制。
+    """
+    response = view(request, *args, **kwargs)
+    if response.streaming:
+        executor = get_inference_executor()
+        started_at = executor.acquire(force=True)
+        response.streaming_content = HeldStream(response.streaming_content, executor, started_at)
+    return response
+
+async def run_idempotent(key, view, request, *args, **kwargs):
+    """
+    执行带Idempotency-Key的请求，相同键的请求正在执行时等待并共用其响应
+
+    Raises:
+        InferenceQueueFullError: 推理线程池排队已满
+    """
+    flights = get_single_flight()
+    future, leader = flights.claim(key)
+    if not leader:
+        saved = snapshot(await asyncio.wrap_future(future))
+        if saved is None:
+            return JsonResponse({
+                'error': '相同Idempotency-Key的流式请求正在处理中'
+            }, status=409)
+        return replay(saved)
+
+    try:
+        job = get_inference_executor().submit(run_view, view, request, *args, **kwargs)
+    except Exception as e:
+        flights.settle(key, error=e)
+        raise
+
+    def save(job):
+        if not job.cancelled() and job.exception() is None:
+            save_response(key, job.result())
+
+    # 先保存响应再结束合并，之后的重试直接命中保存的响应；合并跟随线程池中的任务结束，
+    # 当前请求被客户端中断不影响等待中的请求
+    job.add_done_callback(save)
+    flights.bind(key, job)
+    return await asyncio.wrap_future(job)
+
+def inference_view(view):
+    """
+    把同步的推理视图包装为异步视图
+
+    视图在有界的推理线程池中执行，等待推理时不占用Web服务器的线程，/api/status和
+    管理后台等请求不受影响。所有执行线程都忙且排队请求数达到INFERENCE_MAX_QUEUE_DEPTH时
+    立即返回429，Retry-After为按最近服务时间估算的等待秒数；未结束的流式响应同样计入，
+    见run_view。请求带有Idempotency-Key时见run_idempotent。
+
+    Django 4.2的csrf_exempt和require_http_methods只能用于同步视图，因此装饰在被包装的
+    同步视图上，csrf_exempt标记由wraps复制到异步视图。
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = get_idempotency_key(request)
+        if key is not None:
+            saved = get_saved_response(key)
+            if saved is not None:
+                return saved
+
+        try:
+            if key is None:
+                response = await get_inference_executor().run(run_view, view, request, *args, **kwargs)
+            else:
+                response = await run_idempotent(key, view, request, *args, **kwargs)
+        except InferenceQueueFullError as e:
+            response = JsonResponse({
+                'error': f'服务繁忙，请{e.retry_after}秒后重试'
+            }, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+        if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+            response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+        return response
+    return wrapper
+
+analyze_image_async = inference_view(analyze_image)
+analyze_image_upload_async = inference_view(analyze_image_upload)
+chat_completions_async = inference_view(chat_completions)
+chat_completions_batch_async = inference_view(chat_completions_batch)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def search_knowledge_base(request):
@@ -150,7 +556,7 @@ def search_knowledge_base(request):
     """
     try:
         # 解析JSON请求体
-        data = json.loads(request.body)
+        data = get_json_body(request)
         
         # 提取查询
         query = data.get('query', '')
@@ -215,6 +621,15 @@ def get_service_status(request):
         # 获取模型服务状态
         status = get_model_status()
         
+        # 各处理阶段的耗时直方图
+        status['stage_timings'] = get_timing_stats()
+        
+        # 推理线程池的排队情况
+        status['inference_executor'] = get_inference_executor().get_stats()
+        
+        # 合并的相同请求数
+        status['single_flight'] = get_single_flight().get_stats()
+        
         # 返回结果
         return JsonResponse(status)
         
@@ -223,6 +638,22 @@ def get_service_status(request):
             'error': f'获取服务状态时出错: {str(e)}'
         }, status=500) 
 
+@require_http_methods(["GET"])
+def box_image(request, name):
+    """
+    边界框图像接口
+
+    图像分析结果中的boxed_image_urls指向此接口。图像在后台渲染，渲染未完成时
+    等待完成后返回；文件名由内容决定，响应可以长期缓存。
+    """
+    data, content_type = get_boxed_image(name)
+    if data is None:
+        return JsonResponse({'error': '图像不存在'}, status=404)
+
+    response = HttpResponse(data, content_type=content_type)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # 添加新的API文档视图
 @staff_member_required
 def api_docs_view(request):
@@ -412,7 +843,8 @@ def api_test_execute(request):
         return JsonResponse({'error': '仅支持POST请求'}, status=405)
     
     try:
-        data = json.loads(request.body)
+        # 下面会修改参数，复制一份，不影响日志中间件记录的请求数据
+        data = dict(get_json_body(request))
         
         # 获取API端点和密钥
         endpoint_id = data.pop('endpoint_id', None) if 'endpoint_id' in data else None
@@ -0,0 +1,407 @@
+"""
+边界框图像模块 - 在后台线程池中渲染带边界框的图像
+
+文件名由图像内容哈希、边界框和输出格式计算得到，因此分析接口可以在渲染完成前
+立即返回图像URL，相同的渲染结果只保存一份。文件渲染完成后直接提供下载；首次GET
+时仍在排队的任务会在请求线程中立即渲染。
+磁盘上的图像受总大小上限约束，按最近访问时间(文件mtime)淘汰，多个进程共享同一
+目录时同样有效；最近渲染或访问的图像同时保存在内存中。
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .utils import get_box_image_dir
+from .image_preprocess import decode_image
+from .timing import StageTimer, record_timings
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 输出格式 -> (扩展名, Content-Type)
+BOX_IMAGE_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'WEBP': ('webp', 'image/webp'),
+}
+
+# 合法的文件名，访问接口只接受box_image_name生成的名称
+BOX_IMAGE_NAME_RE = re.compile(r'^box_[0-9a-f]{32}\.(jpg|webp)$')
+
+# 超出磁盘上限时淘汰到上限的这一比例，避免每次写入都扫描目录
+PRUNE_LOW_WATERMARK = 0.9
+
+_executor = None
+_executor_lock = threading.Lock()
+_store = None
+_store_lock = threading.Lock()
+_pending = {}  # 文件名 -> (Future, 渲染函数)
+_lock = threading.Lock()
+
+
+class BoxImageStore:
+    """边界框图像存储，磁盘按总大小上限LRU淘汰，内存中保留最近使用的图像"""
+
+    def __init__(self, directory, max_bytes, hot_max_bytes):
+        """
+        Args:
+            directory: 图像目录
+            max_bytes: 磁盘上图像总字节数上限
+            hot_max_bytes: 内存中图像总字节数上限，为0时不使用内存缓存
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_bytes = 0
+        self.hot_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hot = OrderedDict()  # 文件名 -> 图像字节
+        self._disk_bytes = None  # 磁盘占用估算值，首次写入时扫描目录得到
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+
+    def path(self, name):
+        """图像文件路径"""
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        """图像是否已渲染"""
+        with self._lock:
+            if name in self._hot:
+                return True
+        return os.path.exists(self.path(name))
+
+    def get(self, name):
+        """
+        读取图像，并刷新其最近访问时间
+
+        Returns:
+            bytes: 图像数据，不存在时返回None
+        """
+        with self._lock:
+            data = self._hot.get(name)
+            if data is not None:
+                self._hot.move_to_end(name)
+                self.hot_hits += 1
+
+        if data is None:
+            try:
+                with open(self.path(name), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+            self._put_hot(name, data)
+
+        # 文件mtime作为磁盘淘汰的访问时间
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            pass
+        return data
+
+    def put(self, name, data):
+        """写入图像，先写临时文件再重命名，读取方不会看到写了一半的文件"""
+        path = self.path(name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._put_hot(name, data)
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            over_quota = self._disk_bytes is None or self._disk_bytes > self.max_bytes
+        if over_quota:
+            self.prune()
+
+    def _put_hot(self, name, data):
+        """写入内存缓存，超出上限时淘汰最久未使用的图像"""
+        if len(data) > self.hot_max_bytes:
+            return
+        with self._lock:
+            if name in self._hot:
+                self._hot.move_to_end(name)
+                return
+            while self._hot and self.hot_bytes + len(data) > self.hot_max_bytes:
+                _, evicted = self._hot.popitem(last=False)
+                self.hot_bytes -= len(evicted)
+            self._hot[name] = data
+            self.hot_bytes += len(data)
+
+    def scan(self):
+        """
+        扫描目录中的图像文件，包括旧版本生成的box_<uuid>.jpg
+
+        Returns:
+            list: 按最近访问时间从旧到新排列的(文件名, 字节数, mtime)列表
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.startswith('box_') or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((entry.name, stat.st_size, stat.st_mtime))
+        files.sort(key=lambda item: item[2])
+        return files
+
+    def prune(self, max_bytes=None):
+        """
+        删除最久未访问的图像，直到磁盘占用低于上限的PRUNE_LOW_WATERMARK
+
+        Args:
+            max_bytes: 磁盘上限，为空时使用self.max_bytes
+
+        Returns:
+            tuple: (删除的文件数, 删除的字节数)
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        # 已有线程在淘汰时直接返回
+        if not self._prune_lock.acquire(blocking=False):
+            return 0, 0
+        try:
+            files = self.scan()
+            total = sum(size for _, size, _ in files)
+            removed_count, removed_bytes = 0, 0
+            if total > max_bytes:
+                target = max_bytes * PRUNE_LOW_WATERMARK
+                for name, size, _ in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(self.path(name))
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed_count += 1
+                    removed_bytes += size
+
+            with self._lock:
+                self._disk_bytes = total
+                self.evictions += removed_count
+            if removed_count:
+                logger.info(f"淘汰边界框图像 {removed_count} 个，释放 {removed_bytes / 1024 / 1024:.1f}MB")
+            return removed_count, removed_bytes
+        finally:
+            self._prune_lock.release()
+
+    def get_stats(self):
+        """获取存储统计信息"""
+        files = self.scan()
+        disk_bytes = sum(size for _, size, _ in files)
+        with self._lock:
+            self._disk_bytes = disk_bytes
+            return {
+                'directory': self.directory,
+                'files': len(files),
+                'disk_mb': disk_bytes / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+                'oldest_access': files[0][2] if files else None,
+                'newest_access': files[-1][2] if files else None,
+                'hot_entries': len(self._hot),
+                'hot_mb': self.hot_bytes / 1024 / 1024,
+                'hot_max_mb': self.hot_max_bytes / 1024 / 1024,
+                'hot_hits': self.hot_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_box_image_store():
+    """获取边界框图像存储"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BoxImageStore(
+                    get_box_image_dir(),
+                    getattr(settings, 'BOX_IMAGE_STORE_MAX_MB', 1024) * 1024 * 1024,
+                    getattr(settings, 'BOX_IMAGE_HOT_CACHE_MB', 64) * 1024 * 1024
+                )
+    return _store
+
+
+def _get_executor():
+    """获取渲染线程池"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BOX_IMAGE_RENDER_WORKERS', 2),
+                    thread_name_prefix='box-image-render'
+                )
+    return _executor
+
+
+def get_box_image_format():
+    """当前配置的输出格式，不支持的配置回退为JPEG"""
+    fmt = str(getattr(settings, 'BOX_IMAGE_FORMAT', 'JPEG')).upper()
+    return fmt if fmt in BOX_IMAGE_FORMATS else 'JPEG'
+
+
+def box_image_name(image_hash, boxes, fmt):
+    """
+    计算边界框图像的文件名，相同图像、边界框和格式总是得到相同的文件名
+
+    Args:
+        image_hash: 原图内容哈希
+        boxes: [(标签, (x1, y1, x2, y2)), ...]
+        fmt: 输出格式
+
+    Returns:
+        str: 文件名
+    """
+    payload = json.dumps([image_hash, boxes, fmt], ensure_ascii=False)
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+    return f"box_{digest}.{BOX_IMAGE_FORMATS[fmt][0]}"
+
+
+def box_image_url(name):
+    """边界框图像的访问URL"""
+    return f"/api/box_images/{name}"
+
+
+def _render(image, boxes, name, fmt, source=None):
+    """绘制边界框并写入存储，返回图像数据"""
+    from .image_analysis import draw_boxes_on_image
+
+    store = get_box_image_store()
+    data = store.get(name)
+    if data is not None:
+        return data
+
+    timer = StageTimer()
+    if source is not None:
+        # 模型输入是缩小后的图像，改为在原始分辨率的图像上绘制
+        with timer.stage('decode'):
+            image, _ = decode_image(source, max_side=getattr(settings, 'BOX_IMAGE_MAX_SIDE', 4096))
+    else:
+        image = image.copy()
+    with timer.stage('render'):
+        boxed_image = draw_boxes_on_image(image, boxes)
+        buffer = BytesIO()
+        boxed_image.save(buffer, format=fmt, quality=getattr(settings, 'BOX_IMAGE_QUALITY', 85))
+        data = buffer.getvalue()
+    with timer.stage('save'):
+        store.put(name, data)
+
+    timings = timer.as_dict()
+    del timings['total_ms']
+    record_timings('box_image', timings)
+    return data
+
+
+def schedule_boxed_image(image, image_hash, boxes, source=None):
+    """
+    提交边界框图像的渲染任务，立即返回图像URL
+
+    Args:
+        image: RGB模式的PIL图像，调用方之后不应再修改该图像
+        image_hash: 原图内容哈希
+        boxes: [(标签, (x1, y1, x2, y2)), ...]，模型输出的0-1000归一化坐标
+        source: image解码前的原图(Base64、字节或文件对象)，提供时在原始分辨率(最长边
+            不超过BOX_IMAGE_MAX_SIDE)的图像上绘制，为空时直接在image上绘制
+
+    Returns:
+        str: 图像URL
+    """
+    fmt = get_box_image_format()
+    name = box_image_name(image_hash, boxes, fmt)
+    store = get_box_image_store()
+
+    with _lock:
+        if name in _pending or store.exists(name):
+            return box_image_url(name)
+
+        if source is not None and not isinstance(source, (str, bytes, bytearray)):
+            # 上传的文件在请求结束后关闭，后台渲染前先读出内容
+            source.seek(0)
+            source = source.read()
+
+        def render():
+            return _render(image, boxes, name, fmt, source)
+
+        future = _get_executor().submit(render)
+        _pending[name] = (future, render)
+
+    def done(_):
+        with _lock:
+            _pending.pop(name, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"渲染边界框图像失败 {name}: {future.exception()}")
+
+    future.add_done_callback(done)
+    return box_image_url(name)
+
+
+def get_boxed_image(name, timeout=None):
+    """
+    获取边界框图像，渲染未完成时等待
+
+    渲染任务还在排队时取消该任务并在当前线程中渲染。其他进程提交的任务无法
+    直接等待，此时轮询文件直到超时。
+
+    Args:
+        name: 文件名
+        timeout: 最长等待时间(秒)，为空时使用BOX_IMAGE_WAIT_TIMEOUT
+
+    Returns:
+        tuple: (图像数据, Content-Type)，文件名不合法或图像不存在时返回(None, None)
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'BOX_IMAGE_WAIT_TIMEOUT', 10)
+
+    match = BOX_IMAGE_NAME_RE.match(name)
+    if match is None:
+        return None, None
+    content_type = next(t for ext, t in BOX_IMAGE_FORMATS.values() if ext == match.group(1))
+
+    store = get_box_image_store()
+    data = store.get(name)
+    if data is not None:
+        return data, content_type
+
+    with _lock:
+        pending = _pending.get(name)
+
+    if pending is not None:
+        future, render = pending
+        try:
+            if future.cancel():
+                # 任务尚未开始，直接在请求线程中渲染
+                data = render()
+            else:
+                data = future.result(timeout)
+        except Exception as e:
+            logger.error(f"获取边界框图像失败 {name}: {str(e)}")
+    else:
+        deadline = time.time() + timeout
+        while not os.path.exists(store.path(name)) and time.time() < deadline:
+            time.sleep(0.05)
+        data = store.get(name)
+
+    if data is None:
+        return None, None
+    return data, content_type
@@ -3,66 +3,43 @@
 
 此模块提供图像分析、目标检测、边界框处理等功能，是从FastAPI服务迁移的核心功能。
 """
-import os
 import re
 import json
-import uuid
 import time
-import base64
-from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
+import logging
+from PIL import ImageDraw, ImageFont
 from django.conf import settings
 from pathlib import Path
 
-from .model_service import get_model
+from .model_service import ensure_model, submit_chat_batch, get_model_signature
+from .response_cache import get_response_cache, make_cache_key, hash_bytes, is_cacheable
+from .single_flight import get_single_flight
+from .image_preprocess import preprocess_images, perceptual_hash, ImageTooLargeError
+from . import result_store
+from .box_images import schedule_boxed_image
+from .timing import StageTimer, record_timings
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 模型输出的边界框坐标范围，坐标按图像宽高归一化到0-1000
+BOX_COORDINATE_SCALE = 1000
 
 # 字体设置
 FONT_PATH = "SimSun.ttf"
 FONT_SIZE = 15
 try:
     FONT = ImageFont.truetype(FONT_PATH, FONT_SIZE)
-    print(f"成功加载字体: {FONT_PATH}")
+    logger.info(f"成功加载字体: {FONT_PATH}")
 except Exception as e:
-    print(f"无法加载字体 {FONT_PATH}: {e}")
+    logger.warning(f"无法加载字体 {FONT_PATH}: {e}")
     FONT = None
 
-def get_box_image_dir():
-    """获取边界框图像存储目录"""
-    from django.conf import settings
-    
-    # 静态文件目录
-    static_dir = os.path.join(settings.BASE_DIR, 'static')
-    box_image_dir = os.path.join(static_dir, 'box_images')
-    
-    # 确保目录存在
-    os.makedirs(box_image_dir, exist_ok=True)
-    
-    return box_image_dir
-
-def parse_base64_image(image_base64):
-    """解析Base64编码的图像"""
-    if isinstance(image_base64, list):
-        # 处理图像列表
-        images = []
-        for img_str in image_base64:
-            if ',' in img_str:
-                # 处理 "data:image/jpeg;base64,/9j/4AAQ..." 格式
-                img_str = img_str.split(',', 1)[1]
-            img_data = base64.b64decode(img_str)
-            img = Image.open(BytesIO(img_data))
-            images.append(img)
-        return images
-    else:
-        # 处理单张图像
-        if ',' in image_base64:
-            # 处理 "data:image/jpeg;base64,/9j/4AAQ..." 格式
-            image_base64 = image_base64.split(',', 1)[1]
-        img_data = base64.b64decode(image_base64)
-        return Image.open(BytesIO(img_data))
-
 def parse_boxes_from_text(text):
     """从文本中解析边界框信息"""
-    print(f"解析文本中的边界框: {text}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f"解析文本中的边界框: {text}")
     
     # 匹配边界框格式: <box>(x1,y1),(x2,y2)</box>
     box_pattern = r"<box>\((\d+),(\d+)\),\((\d+),(\d+)\)</box>"
@@ -74,8 +51,8 @@ def parse_boxes_from_text(text):
     refs = re.findall(ref_pattern, text)
     box_coords = re.findall(box_pattern, text)
     
-    print(f"找到的refs: {refs}")
-    print(f"找到的坐标: {box_coords}")
+    if debug:
+        logger.debug(f"找到的refs: {refs}, 找到的坐标: {box_coords}")
     
     # 坐标解析
     if len(box_coords) > 0:
@@ -85,22 +62,87 @@ def parse_boxes_from_text(text):
             try:
                 # 正确解析四个坐标值
                 x1, y1, x2, y2 = int(coords[0]), int(coords[1]), int(coords[2]), int(coords[3])
-                print(f"解析坐标: {coords} -> ({x1}, {y1}, {x2}, {y2})")
                 boxes.append((label, (x1, y1, x2, y2)))
             except Exception as e:
-                print(f"解析坐标时出错: {e}")
+                logger.warning(f"解析坐标时出错: {e}")
     
-    print(f"解析后的边界框: {boxes}")
+    if debug:
+        logger.debug(f"解析后的边界框: {boxes}")
     return boxes
 
+# 多张图像的提问方式：separate为每张图像分别回答，joint为所有图像共用一个提示词
+ANALYSIS_MODES = ('separate', 'joint')
+
+# 联合模式回复中指代图像序号的文本，如"Picture 2"、"图片2"、"第2张"
+IMAGE_MENTION_PATTERN = re.compile(r"(?:Picture|Image|图片|图像|图)\s*(\d+)|第\s*(\d+)\s*张")
+
+def parse_boxes_by_image(text, num_images):
+    """
+    解析联合模式回复中的边界框，并按位置归属到对应图像
+    
+    每个边界框归属于它之前最近一次提到的图像序号，回复开头未提到序号的部分
+    归属第一张图像。序号出现在<ref>内时从该<ref>开始切分，保持标签完整。
+    
+    Args:
+        text: 模型回复
+        num_images: 图像数量
+    
+    Returns:
+        list: 每张图像的边界框列表
+    """
+    boxes_by_image = [[] for _ in range(num_images)]
+    
+    # (切分位置, 图像序号)，超出范围的序号忽略
+    splits = [(0, 1)]
+    for match in IMAGE_MENTION_PATTERN.finditer(text):
+        index = int(match.group(1) or match.group(2))
+        if not 1 <= index <= num_images:
+            continue
+        start = match.start()
+        ref_start = text.rfind('<ref>', 0, start)
+        if ref_start != -1 and text.find('</ref>', ref_start, start) == -1:
+            start = ref_start
+        if start <= splits[-1][0]:
+            splits[-1] = (splits[-1][0], index)
+        else:
+            splits.append((start, index))
+    
+    for k, (start, index) in enumerate(splits):
+        end = splits[k + 1][0] if k + 1 < len(splits) else len(text)
+        boxes_by_image[index - 1].extend(parse_boxes_from_text(text[start:end]))
+    return boxes_by_image
+
+def to_pixel_box(box, size):
+    """
+    把模型输出的边界框换算为图像上的像素坐标
+    
+    Qwen-VL的边界框坐标归一化到0-1000，与输入图像的实际尺寸无关。
+    
+    Args:
+        box: (x1, y1, x2, y2)，0-1000归一化坐标
+        size: 图像尺寸(宽, 高)
+    
+    Returns:
+        tuple: (x1, y1, x2, y2)像素坐标
+    """
+    width, height = size
+    x1, y1, x2, y2 = box
+    return (
+        round(x1 * width / BOX_COORDINATE_SCALE),
+        round(y1 * height / BOX_COORDINATE_SCALE),
+        round(x2 * width / BOX_COORDINATE_SCALE),
+        round(y2 * height / BOX_COORDINATE_SCALE)
+    )
+
 def draw_boxes_on_image(image, boxes):
-    """在图像上绘制边界框"""
+    """在图像上绘制边界框，boxes为模型输出的0-1000归一化坐标"""
     draw = ImageDraw.Draw(image)
     
-    print(f"开始绘制边界框，图像尺寸: {image.size}, 边界框: {boxes}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"开始绘制边界框，图像尺寸: {image.size}, 边界框: {boxes}")
     
-    for label, (x1, y1, x2, y2) in boxes:
-        # 模型返回的已经是像素坐标，无需缩放
+    for label, box in boxes:
+        x1, y1, x2, y2 = to_pixel_box(box, image.size)
         # 绘制方框
         draw.rectangle([(x1, y1), (x2, y2)], outline="red", width=3)
         
@@ -113,193 +155,354 @@ def draw_boxes_on_image(image, boxes):
             draw.text((x1 + 5, y1 - 17), label, fill="white", font=FONT)
         else:
             draw.text((x1 + 5, y1 - 17), label, fill="white")
-        print(f"已绘制边界框: {label} 在 ({x1}, {y1}, {x2}, {y2})")
     
     return image
 
-def save_boxed_image(image, boxes):
-    """保存带边界框的图像，并返回其URL"""
-    print(f"保存带边界框的图像，边界框: {boxes}")
-    
+def save_boxed_image(image, boxes, image_hash=None, source=None):
+    """
+    提交带边界框图像的后台渲染，并返回其URL
+
+    URL由图像内容和边界框决定，渲染完成前即可返回，首次访问时渲染未完成会等待。
+
+    Args:
+        image: PIL图像
+        boxes: [(标签, (x1, y1, x2, y2)), ...]
+        image_hash: 原图内容哈希，为空时按像素计算
+        source: image解码前的原图，提供时在原始分辨率的图像上绘制
+
+    Returns:
+        str: 图像URL，没有边界框或出错时返回None
+    """
     if not boxes:
-        print("没有边界框，跳过保存图像")
         return None
         
     try:
-        # 如果图像是RGBA模式，转换为RGB模式
-        if image.mode == 'RGBA':
+        # 如果图像不是RGB模式(如RGBA)，转换为RGB模式
+        if image.mode != 'RGB':
             image = image.convert('RGB')
-            
-        # 绘制边界框
-        print(f"准备绘制边界框到图像上，图像类型: {type(image)}, 图像尺寸: {image.size}")
-        boxed_image = draw_boxes_on_image(image.copy(), boxes)
-        
-        # 生成唯一文件名
-        filename = f"box_{uuid.uuid4().hex}.jpg"
-        box_image_dir = get_box_image_dir()
-        file_path = os.path.join(box_image_dir, filename)
         
-        # 保存图像
-        boxed_image.save(file_path, format="JPEG")
-        print(f"边界框图像已保存到 {file_path}")
+        if image_hash is None:
+            image_hash = hash_bytes(image.tobytes())
         
-        # 返回相对URL
-        rel_url = f"/static/box_images/{filename}"
-        print(f"边界框图像URL: {rel_url}")
+        rel_url = schedule_boxed_image(image, image_hash, boxes, source)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"边界框图像URL: {rel_url}")
         return rel_url
         
     except Exception as e:
-        print(f"保存边界框图像时出错: {e}")
+        logger.error(f"保存边界框图像时出错: {e}")
         return None
 
-def analyze_image(image_base64, query):
+def ask_images(images, texts, image_hashes, options=None, timer=None):
+    """
+    对多张图像分别提问，未命中响应缓存的请求合并为批量生成
+    
+    Args:
+        images: PIL图像列表
+        texts: 与图像一一对应的提问文本
+        image_hashes: 图像内容哈希列表
+        options: 生成参数
+        timer: StageTimer，记录queue_wait(提交到开始推理)和inference(开始推理到全部完成)
+    
+    Returns:
+        list: 与图像顺序一致的模型回复
+    """
+    return _ask([[(image, image_hash)] for image, image_hash in zip(images, image_hashes)], texts, options, timer)
+
+def ask_joint(images, text, image_hashes, options=None, timer=None):
+    """
+    把多张图像放入同一个提示词中提问，只生成一次回复
+    
+    tokenizer.from_list_format会按顺序把图像标注为Picture 1、Picture 2等。
+    
+    Args:
+        images: PIL图像列表
+        text: 提问文本
+        image_hashes: 图像内容哈希列表
+        options: 生成参数
+        timer: StageTimer，见ask_images
+    
+    Returns:
+        str: 模型回复
+    """
+    return _ask([list(zip(images, image_hashes))], [text], options, timer)[0]
+
+def _ask(image_groups, texts, options=None, timer=None):
+    """
+    提交提问，每个提问包含一组图像，未命中响应缓存的提问合并为批量生成
+    
+    相同的提问(图像、文本和生成参数都相同)正在推理时等待其结果，不重复提交；
+    开启采样的提问不使用响应缓存，也不合并。
+    
+    Args:
+        image_groups: 每个提问的[(PIL图像, 内容哈希), ...]
+        texts: 与image_groups一一对应的提问文本
+        options: 生成参数
+        timer: StageTimer
+    
+    Returns:
+        list: 与提问顺序一致的模型回复
+    """
+    options = options or {}
+    cacheable = is_cacheable(options)
+    cache = get_response_cache() if cacheable else None
+    flights = get_single_flight() if cacheable else None
+    signature = get_model_signature()
+    
+    responses = [None] * len(texts)
+    keys = [None] * len(texts)
+    pending = []  # 本次提交推理的提问
+    waiting = []  # 相同提问正在其他请求中推理，等待其结果
+    for i, (text, group) in enumerate(zip(texts, image_groups)):
+        image_hashes = [image_hash for _, image_hash in group]
+        keys[i] = make_cache_key(signature, text, options=options, image_hashes=image_hashes)
+        if cache:
+            responses[i] = cache.get(keys[i])
+            if responses[i] is not None:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"命中响应缓存: {', '.join(h[:12] for h in image_hashes)}")
+                continue
+        if flights is None:
+            pending.append((i, None))
+            continue
+        future, leader = flights.claim(keys[i])
+        (pending if leader else waiting).append((i, future))
+    
+    if pending:
+        # 已解码的图像直接交给推理调度器，由视觉编码器在内存中读取，不经过临时文件
+        try:
+            requests = submit_chat_batch(
+                [
+                    [{'image': image, 'image_hash': image_hash} for image, image_hash in image_groups[i]]
+                    + [{'text': texts[i]}]
+                    for i, _ in pending
+                ],
+                history=[],
+                max_batch=getattr(settings, 'MULTI_IMAGE_BATCH_SIZE', 8),
+                **options
+            )
+        except Exception as e:
+            if flights is not None:
+                for i, _ in pending:
+                    flights.settle(keys[i], error=e)
+            raise
+        if flights is not None:
+            # 先写入缓存再结束合并，之后到达的相同提问直接命中缓存
+            for (i, _), request in zip(pending, requests):
+                on_result = (lambda result, key=keys[i]: cache.set(key, result[0])) if cache else None
+                flights.bind(keys[i], request.future, on_result)
+        
+        for (i, _), request in zip(pending, requests):
+            responses[i], _ = request.result()
+        
+        if timer is not None:
+            # 多个批次依次执行，按整体的开始和结束时间计算
+            finished_at = time.time()
+            enqueued_at = min(request.enqueued_at for request in requests)
+            started_at = min(request.started_at or finished_at for request in requests)
+            timer.add('queue_wait', started_at - enqueued_at)
+            timer.add('inference', finished_at - started_at)
+    
+    if waiting:
+        start = time.time()
+        for i, future in waiting:
+            responses[i], _ = future.result()
+        if timer is not None:
+            timer.add('coalesced_wait', time.time() - start)
+    
+    return responses
+
+def ask_image(image, text, image_hash, options=None, timer=None):
+    """
+    对单张图像提问，相同图像和问题优先使用响应缓存
+    
+    Args:
+        image: PIL图像
+        text: 提问文本
+        image_hash: 图像内容哈希
+        options: 生成参数
+        timer: StageTimer，见ask_images
+    
+    Returns:
+        str: 模型回复
+    """
+    return ask_images([image], [text], [image_hash], options, timer)[0]
+
+def analyze_image(image_base64, query, options=None, mode='separate'):
     """
     分析图像并回答问题
     
+    先按图像感知哈希查询数据库中保存的分析结果，命中时直接使用保存的回复和边界框，
+    未命中的提问提交模型推理，结果再写回数据库。
+    
     Args:
-        image_base64: Base64编码的图像或图像列表
+        image_base64: Base64编码的图像、图像原始字节或上传的文件对象，或它们的列表
         query: 用户查询
+        options: 生成参数，见core.utils.build_generation_options
+        mode: 多张图像时的提问方式，separate为每张图像分别回答，joint为所有图像放入
+            同一个提示词只生成一个回答，边界框按回复中提到的图像序号归属到对应图像
     
     Returns:
-        dict: 包含分析结果和处理时间的字典
+        dict: 包含分析结果、处理时间和各阶段耗时(timings，毫秒)的字典
     """
+    timer = StageTimer()
+    options = options or {}
     try:
-        # 获取开始时间
-        start_time = time.time()
-        
-        # 解析图像
-        images = parse_base64_image(image_base64)
-        if not isinstance(images, list):
-            images = [images]
-        
-        # 获取模型和tokenizer
-        model, tokenizer = get_model()
-        
-        # 检查模型和tokenizer是否成功加载
-        if model is None or tokenizer is None:
-            error_msg = "模型或tokenizer加载失败，无法进行图像分析"
-            print(f"错误: {error_msg}")
+        # 在线程池中解码并缩小图像，同时计算内容哈希用于缓存
+        payloads = image_base64 if isinstance(image_base64, list) else [image_base64]
+        joint = mode == 'joint' and len(payloads) > 1
+        max_joint_images = getattr(settings, 'JOINT_ANALYSIS_MAX_IMAGES', 6)
+        if joint and len(payloads) > max_joint_images:
+            error_msg = f"联合模式最多支持{max_joint_images}张图像"
             return {
                 "result": f"分析过程中出错: {error_msg}",
                 "processing_time": "N/A",
                 "error": error_msg
             }
+        try:
+            decoded = preprocess_images(payloads, timer)
+        except ImageTooLargeError as e:
+            return {
+                "result": f"分析过程中出错: {str(e)}",
+                "processing_time": "N/A",
+                "error": str(e)
+            }
+        images = [image for image, _ in decoded]
+        image_hashes = [image_hash for _, image_hash in decoded]
         
-        # 处理多张图片的情况
-        if len(images) > 1:
-            # 多张图片分析
-            results = []
-            boxed_image_urls = []
-            
-            for i, image in enumerate(images):
-                # 临时保存图像以获取图像路径
-                temp_img_path = f"temp_image_{i}_{uuid.uuid4().hex}.jpg"
-                image_dir = os.path.join(settings.BASE_DIR, 'static', 'temp_images')
-                os.makedirs(image_dir, exist_ok=True)
-                full_img_path = os.path.join(image_dir, temp_img_path)
-                
-                # 保存图像 - 确保转换为RGB模式
-                if image.mode == 'RGBA':
-                    image = image.convert('RGB')
-                image.save(full_img_path, format="JPEG")
-                print(f"临时图像已保存到: {full_img_path}")
-                
-                # 构建提示词
-                img_query = f"图片{i+1}: {query}" if len(images) > 1 else query
-                
-                # 使用from_list_format方法构建输入
-                model_inputs = tokenizer.from_list_format([
-                    {'image': full_img_path},
-                    {'text': img_query}
-                ])
-                
-                # 调用模型 - 不再直接传递image参数
-                response, history = model.chat(
-                    tokenizer,
-                    model_inputs,
-                    history=[]
-                )
-                
-                # 解析边界框
-                boxes = parse_boxes_from_text(response)
-                
-                # 保存带边界框的图像
-                boxed_url = save_boxed_image(image, boxes) if boxes else None
-                
-                # 收集结果
-                results.append(response)
-                if boxed_url:
-                    boxed_image_urls.append(boxed_url)
-                
-                # 删除临时图像
+        # 每个提问包含的图像序号；联合模式只有一个包含全部图像的提问，
+        # 分别回答时多张图像在问题前标注图像序号
+        if joint:
+            groups = [list(range(len(images)))]
+            texts = [query]
+        else:
+            groups = [[i] for i in range(len(images))]
+            texts = [f"图片{i+1}: {query}" for i in range(len(images))] if len(images) > 1 else [query]
+        
+        # 先查询保存的分析结果(开启采样时不使用)，联合提问以各图像感知哈希组合后的哈希为键；
+        # 键使用不带图像序号的问题，同一图像在不同位置上传时命中同一结果
+        group_phashes = None
+        answers = [None] * len(groups)  # (模型回复, 组内每张图像的边界框列表)
+        if result_store.is_enabled() and is_cacheable(options):
+            with timer.stage('result_store'):
+                phashes = [perceptual_hash(image) for image in images]
+                group_phashes = [
+                    phashes[group[0]] if len(group) == 1
+                    else hash_bytes(','.join(phashes[i] for i in group).encode('ascii'))
+                    for group in groups
+                ]
                 try:
-                    os.remove(full_img_path)
-                    print(f"临时图像已删除: {full_img_path}")
+                    stored = result_store.lookup_results(group_phashes, [query] * len(groups), options)
                 except Exception as e:
-                    print(f"删除临时图像时出错: {e}")
+                    logger.warning(f"查询保存的分析结果失败: {str(e)}")
+                    stored = [None] * len(groups)
+            for g, item in enumerate(stored):
+                if item is not None:
+                    response, boxes = item
+                    if len(groups[g]) > 1:
+                        boxes = parse_boxes_by_image(response, len(groups[g]))
+                    else:
+                        boxes = [boxes]
+                    answers[g] = (response, boxes)
+        pending = [g for g, answer in enumerate(answers) if answer is None]
+        
+        if pending:
+            # 确认模型可用，未加载时按需加载
+            with timer.stage('model_wait'):
+                model_ready = ensure_model(getattr(settings, 'MODEL_LOAD_WAIT_TIMEOUT', None))
+            if not model_ready:
+                error_msg = "模型或tokenizer加载失败，无法进行图像分析"
+                logger.error(error_msg)
+                return {
+                    "result": f"分析过程中出错: {error_msg}",
+                    "processing_time": "N/A",
+                    "error": error_msg
+                }
             
-            # 计算处理时间
-            processing_time = time.time() - start_time
+            # 所有未命中的提问一次提交，按批量生成
+            responses = _ask(
+                [[(images[i], image_hashes[i]) for i in groups[g]] for g in pending],
+                [texts[g] for g in pending],
+                options, timer
+            )
             
+            for g, response in zip(pending, responses):
+                # 解析边界框
+                with timer.stage('box_parse'):
+                    if len(groups[g]) > 1:
+                        boxes = parse_boxes_by_image(response, len(groups[g]))
+                    else:
+                        boxes = [parse_boxes_from_text(response)]
+                answers[g] = (response, boxes)
+                
+                if group_phashes is not None:
+                    with timer.stage('result_store'):
+                        try:
+                            result_store.store_result(
+                                group_phashes[g], query, options, response,
+                                [box for image_boxes in boxes for box in image_boxes]
+                            )
+                        except Exception as e:
+                            logger.warning(f"保存分析结果失败: {str(e)}")
+        
+        # 每张图像的边界框
+        boxes_by_image = [[] for _ in images]
+        for group, (_, group_boxes) in zip(groups, answers):
+            for i, boxes in zip(group, group_boxes):
+                boxes_by_image[i] = boxes
+        
+        # 提交带边界框图像的渲染，渲染和保存在后台线程中计时
+        boxed_urls = []
+        with timer.stage('box_schedule'):
+            for image, image_hash, boxes, payload in zip(images, image_hashes, boxes_by_image, payloads):
+                boxed_urls.append(save_boxed_image(image, boxes, image_hash, payload) if boxes else None)
+        
+        timings = timer.as_dict()
+        record_timings('image_analysis', timings)
+        stored_results = len(groups) - len(pending)
+        
+        if joint:
+            # 联合提问，boxes和boxed_image_urls与图像顺序一一对应
             return {
-                "result": results,
-                "processing_time": f"{processing_time:.2f}秒",
+                "result": answers[0][0],
+                "mode": "joint",
+                "processing_time": f"{timings['total_ms'] / 1000:.2f}秒",
+                "timings": timings,
+                "stored_results": stored_results,
+                # 与渲染的图像一致，换算为原图上的像素坐标
+                "boxes": [
+                    [
+                        {"label": label, "box": list(to_pixel_box(box, image.info.get('original_size', image.size)))}
+                        for label, box in boxes
+                    ]
+                    for image, boxes in zip(images, boxes_by_image)
+                ],
+                "boxed_image_urls": boxed_urls
+            }
+        elif len(images) > 1:
+            # 多张图片分析
+            boxed_image_urls = [url for url in boxed_urls if url]
+            return {
+                "result": [response for response, _ in answers],
+                "processing_time": f"{timings['total_ms'] / 1000:.2f}秒",
+                "timings": timings,
+                "stored_results": stored_results,
                 "boxed_image_urls": boxed_image_urls if boxed_image_urls else None
             }
         else:
             # 单张图片分析
-            image = images[0]
-            
-            # 临时保存图像以获取图像路径
-            temp_img_path = f"temp_image_{uuid.uuid4().hex}.jpg"
-            image_dir = os.path.join(settings.BASE_DIR, 'static', 'temp_images')
-            os.makedirs(image_dir, exist_ok=True)
-            full_img_path = os.path.join(image_dir, temp_img_path)
-            
-            # 保存图像 - 确保转换为RGB模式
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-            image.save(full_img_path, format="JPEG")
-            print(f"临时图像已保存到: {full_img_path}")
-            
-            # 使用from_list_format方法构建输入
-            model_inputs = tokenizer.from_list_format([
-                {'image': full_img_path},
-                {'text': query}
-            ])
-            
-            # 调用模型 - 不再直接传递image参数
-            response, history = model.chat(
-                tokenizer,
-                model_inputs,
-                history=[]
-            )
-            
-            # 解析边界框
-            boxes = parse_boxes_from_text(response)
-            
-            # 保存带边界框的图像
-            boxed_url = save_boxed_image(image, boxes) if boxes else None
-            
-            # 删除临时图像
-            try:
-                os.remove(full_img_path)
-                print(f"临时图像已删除: {full_img_path}")
-            except Exception as e:
-                print(f"删除临时图像时出错: {e}")
-            
-            # 计算处理时间
-            processing_time = time.time() - start_time
-            
             return {
-                "result": response,
-                "processing_time": f"{processing_time:.2f}秒",
-                "boxed_image_url": boxed_url
+                "result": answers[0][0],
+                "processing_time": f"{timings['total_ms'] / 1000:.2f}秒",
+                "timings": timings,
+                "stored_results": stored_results,
+                "boxed_image_url": boxed_urls[0]
             }
             
     except Exception as e:
+        logger.exception(f"图像分析出错: {str(e)}")
         return {
             "result": f"分析过程中出错: {str(e)}",
             "processing_time": "N/A",
             "error": str(e)
-        } 
\ No newline at end of file
+        }
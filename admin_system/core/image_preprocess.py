@@ -0,0 +1,181 @@
+"""
+图像预处理模块 - 在线程池中解码请求图像
+
+模型只使用448x448的输入，因此解码时借助Pillow的draft(JPEG按DCT缩放解码)和
+reduce模式直接得到接近目标尺寸的图像，避免在请求线程中按原始分辨率完整解码。
+解码前检查字节数和像素数上限，防止超大图像占满内存。
+"""
+import base64
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from django.conf import settings
+
+from .response_cache import hash_bytes
+from .timing import StageTimer
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImageTooLargeError(ValueError):
+    """图像超过字节数或像素数上限"""
+
+
+def _read_base64(image_base64, max_bytes):
+    """解码Base64图像，返回(文件对象, 内容哈希)"""
+    if ',' in image_base64:
+        # 处理 "data:image/jpeg;base64,/9j/4AAQ..." 格式
+        image_base64 = image_base64.split(',', 1)[1]
+
+    # Base64每4个字符对应3个字节，解码前先按长度估算
+    if len(image_base64) * 3 // 4 > max_bytes:
+        raise ImageTooLargeError(f"图像大小超过上限 {max_bytes // 1024 // 1024}MB")
+    data = base64.b64decode(image_base64)
+    if len(data) > max_bytes:
+        raise ImageTooLargeError(f"图像大小超过上限 {max_bytes // 1024 // 1024}MB")
+    return BytesIO(data), hash_bytes(data)
+
+
+def _read_file(file, max_bytes):
+    """
+    读取上传的图像文件，返回(文件对象, 内容哈希)
+
+    文件按块计算哈希后回到开头直接交给Image.open，不再复制一份字节；
+    哈希与Base64方式相同，两种上传方式共用响应缓存和视觉编码缓存。
+    """
+    size = getattr(file, 'size', None)
+    if size is None:
+        size = file.seek(0, 2)
+    if size > max_bytes:
+        raise ImageTooLargeError(f"图像大小超过上限 {max_bytes // 1024 // 1024}MB")
+
+    digest = hashlib.sha256()
+    file.seek(0)
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks():
+            digest.update(chunk)
+    else:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+def decode_image(source, max_side=None, max_pixels=None, max_bytes=None, timer=None):
+    """
+    解码单张图像并缩小到不超过max_side的尺寸
+
+    Args:
+        source: Base64编码的图像(可带"data:image/...;base64,"前缀)、图像原始字节，
+            或可seek的二进制文件对象(如Django的UploadedFile)
+        max_side: 解码后图像的最长边，为空时使用IMAGE_PREPROCESS_MAX_SIDE
+        max_pixels: 原始图像允许的最大像素数，为空时使用IMAGE_MAX_PIXELS
+        max_bytes: 原始图像允许的最大字节数，为空时使用IMAGE_MAX_BYTES
+        timer: StageTimer，记录base64_decode(二进制输入时为read)、image_decode和preprocess阶段耗时
+
+    Returns:
+        tuple: (RGB模式的PIL图像, 原始图像字节的哈希)，图像的info['original_size']为缩小前的尺寸
+
+    Raises:
+        ImageTooLargeError: 图像超过上限
+    """
+    max_side = max_side or getattr(settings, 'IMAGE_PREPROCESS_MAX_SIDE', 1344)
+    max_pixels = max_pixels or getattr(settings, 'IMAGE_MAX_PIXELS', 40000000)
+    max_bytes = max_bytes or getattr(settings, 'IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+    timer = timer or StageTimer()
+
+    if isinstance(source, str):
+        with timer.stage('base64_decode'):
+            file, image_hash = _read_base64(source, max_bytes)
+    else:
+        with timer.stage('read'):
+            if isinstance(source, (bytes, bytearray)):
+                if len(source) > max_bytes:
+                    raise ImageTooLargeError(f"图像大小超过上限 {max_bytes // 1024 // 1024}MB")
+                file, image_hash = BytesIO(source), hash_bytes(source)
+            else:
+                file, image_hash = _read_file(source, max_bytes)
+
+    with timer.stage('image_decode'):
+        # Image.open只读取文件头，此时还未解码像素
+        image = Image.open(file)
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ImageTooLargeError(f"图像像素数 {width}x{height} 超过上限 {max_pixels}")
+
+        # JPEG在解码阶段按1/2、1/4、1/8缩放，其他格式在thumbnail中先用reduce整数倍缩小
+        image.draft('RGB', (max_side, max_side))
+        image.load()
+
+    with timer.stage('preprocess'):
+        image.thumbnail((max_side, max_side), reducing_gap=2.0)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+    image.info['original_size'] = (width, height)
+    return image, image_hash
+
+
+def perceptual_hash(image, hash_size=16):
+    """
+    计算图像的差值哈希(dHash)
+
+    重新编码、缩放或轻微压缩后的同一图像得到相同的哈希，用于持久化的分析结果缓存。
+    默认16x16比较位(256位)，比常用的8x8更能区分版式相近但内容不同的截图。
+
+    Args:
+        image: PIL图像
+        hash_size: 每行比较位数
+
+    Returns:
+        str: 十六进制哈希字符串
+    """
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def get_executor():
+    """获取图像预处理线程池，Pillow解码时会释放GIL"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'IMAGE_PREPROCESS_WORKERS', 4),
+                    thread_name_prefix='image-preprocess'
+                )
+    return _executor
+
+
+def preprocess_images(payloads, timer=None):
+    """
+    在线程池中并行解码图像
+
+    单张图像同样交给线程池，线程数同时限制了并发解码占用的内存。
+
+    Args:
+        payloads: 图像列表，元素可以是Base64字符串、原始字节或文件对象，见decode_image
+        timer: StageTimer，多张图像的各阶段耗时相加
+
+    Returns:
+        list: 与输入顺序一致的(PIL图像, 内容哈希)列表
+
+    Raises:
+        ImageTooLargeError: 任一图像超过上限
+    """
+    return list(get_executor().map(partial(decode_image, timer=timer), payloads))
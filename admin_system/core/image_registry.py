@@ -0,0 +1,238 @@
+"""
+图像注册表模块 - 在内存中把已解码的图像交给视觉编码器
+
+Qwen-VL的tokenizer只接受图像路径，视觉编码器在前向计算时才按路径打开图像。
+这里把内存中的PIL图像登记为"mem://<键>"形式的虚拟路径，并替换视觉编码器的
+encode方法，使其直接从注册表取图，省去临时文件的编码、写盘、读盘和删除。
+以图像内容哈希为键登记的图像，其视觉编码结果会缓存下来，同一图像的后续提问
+只需执行语言模型部分。
+"""
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 虚拟路径前缀
+MEMORY_SCHEME = 'mem://'
+
+_images = {}  # 键 -> [图像, 引用计数, 是否为内容哈希键]
+_lock = threading.Lock()
+
+
+class EmbeddingCache:
+    """视觉编码结果缓存，按LRU淘汰并限制总内存"""
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: 缓存张量的总字节数上限
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # 图像内容哈希 -> 编码结果
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取编码结果，未命中时返回None"""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        """写入编码结果，超出内存上限时淘汰最久未使用的条目"""
+        nbytes = embedding.element_size() * embedding.nelement()
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            while self._entries and self.total_bytes + nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.element_size() * evicted.nelement()
+            self._entries[key] = embedding
+            self.total_bytes += nbytes
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_mb': self.total_bytes / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def register_image(image, key=None):
+    """
+    登记内存中的图像
+
+    相同键的图像可以被多个请求同时登记，使用引用计数管理。
+
+    Args:
+        image: PIL图像或已经过image_transform预处理的张量
+        key: 图像内容哈希，为空时随机生成且不缓存视觉编码结果
+
+    Returns:
+        str: 可传给tokenizer.from_list_format的虚拟路径
+    """
+    cacheable = key is not None
+    key = key or uuid.uuid4().hex
+    with _lock:
+        entry = _images.get(key)
+        if entry is None:
+            _images[key] = [image, 1, cacheable]
+        else:
+            entry[1] += 1
+    return f"{MEMORY_SCHEME}{key}"
+
+
+def release_images(paths):
+    """
+    释放登记的图像
+
+    Args:
+        paths: register_image返回的虚拟路径列表
+    """
+    with _lock:
+        for path in paths:
+            key = path[len(MEMORY_SCHEME):]
+            entry = _images.get(key)
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del _images[key]
+
+
+def get_image(path):
+    """
+    按虚拟路径获取图像
+
+    Returns:
+        tuple: (PIL图像或张量, 缓存键)，图像不是以内容哈希登记时缓存键为None；
+            不存在时抛出KeyError
+    """
+    key = path[len(MEMORY_SCHEME):]
+    with _lock:
+        image, _, cacheable = _images[key]
+    return image, (key if cacheable else None)
+
+
+def get_embedding_cache(model):
+    """
+    获取模型的视觉编码结果缓存
+
+    Returns:
+        EmbeddingCache: 缓存实例，未安装内存图像支持时返回None
+    """
+    visual = getattr(getattr(model, 'transformer', None), 'visual', None)
+    return getattr(visual, '_embedding_cache', None)
+
+
+def register_query(query):
+    """
+    将列表格式查询中的内存图像登记为虚拟路径
+
+    列表元素形如{'image': PIL图像, 'image_hash': 内容哈希}，image为字符串时保持不变。
+
+    Args:
+        query: 查询文本或from_list_format列表
+
+    Returns:
+        tuple: (替换后的查询, 登记的虚拟路径列表)
+    """
+    if not isinstance(query, list):
+        return query, []
+
+    items, paths = [], []
+    for item in query:
+        image = item.get('image') if isinstance(item, dict) else None
+        if image is not None and not isinstance(image, str):
+            path = register_image(image, item.get('image_hash'))
+            paths.append(path)
+            item = {'image': path}
+        items.append(item)
+    return items, paths
+
+
+def install_visual_hook(model):
+    """
+    替换视觉编码器的encode方法，使其支持mem://虚拟路径
+
+    其他路径仍按原方式打开。视觉编码结果缓存挂在模型上，模型释放时随之释放。
+    模型没有视觉编码器或已安装时不做任何操作。
+
+    Args:
+        model: Qwen-VL模型
+
+    Returns:
+        bool: 模型是否支持内存图像
+    """
+    visual = getattr(getattr(model, 'transformer', None), 'visual', None)
+    if visual is None or not hasattr(visual, 'encode'):
+        return False
+    if getattr(visual, '_memory_images', False):
+        return True
+
+    import torch
+    from PIL import Image
+
+    original_encode = visual.encode
+    cache = EmbeddingCache(getattr(settings, 'VISUAL_EMBEDDING_CACHE_MB', 512) * 1024 * 1024)
+
+    def encode(image_paths):
+        if not any(isinstance(p, str) and p.startswith(MEMORY_SCHEME) for p in image_paths):
+            return original_encode(image_paths)
+
+        outputs = [None] * len(image_paths)
+        pending, pending_keys, images = [], [], []
+        for i, path in enumerate(image_paths):
+            key = None
+            if path.startswith(MEMORY_SCHEME):
+                image, key = get_image(path)
+                if key is not None:
+                    outputs[i] = cache.get(key)
+                    if outputs[i] is not None:
+                        continue
+            else:
+                image = Image.open(path)
+
+            if isinstance(image, torch.Tensor):
+                # 已预处理的张量直接使用
+                images.append(image)
+            else:
+                images.append(visual.image_transform(image.convert('RGB')))
+            pending.append(i)
+            pending_keys.append(key)
+
+        # 只对未命中缓存的图像执行视觉编码
+        if images:
+            encoded = visual(torch.stack(images, dim=0))
+            for j, (i, key) in enumerate(zip(pending, pending_keys)):
+                outputs[i] = encoded[j]
+                if key is not None:
+                    # clone使缓存条目不引用整个批次的输出
+                    cache.put(key, encoded[j].clone())
+
+        return torch.stack(outputs, dim=0)
+
+    visual.encode = encode
+    visual._memory_images = True
+    visual._embedding_cache = cache
+    logger.info("视觉编码器已支持内存图像输入")
+    return True
@@ -0,0 +1,166 @@
+"""
+推理执行器模块 - 在有界线程池中执行推理类请求
+
+异步视图把推理请求交给固定大小的线程池执行，等待中的请求不再占用Web服务器的
+工作线程。排队请求数超过上限时立即拒绝并估算重试等待时间，模型满载时/api/status
+和管理后台等其他请求仍能及时响应。流式响应在内容发送完毕前继续占用名额(见acquire)，
+与普通请求共用同一个上限。
+"""
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 估算Retry-After时参考的最近完成请求数
+SERVICE_TIME_WINDOW = 50
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class InferenceQueueFullError(Exception):
+    """推理队列已满"""
+
+    def __init__(self, retry_after):
+        """
+        Args:
+            retry_after: 建议的重试等待时间(秒)
+        """
+        super().__init__(f"推理队列已满，请{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """有界推理线程池，统计排队深度和最近的服务时间"""
+
+    def __init__(self, workers, max_queue_depth):
+        """
+        Args:
+            workers: 同时执行的请求数
+            max_queue_depth: 所有线程都忙时允许排队的请求数
+        """
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self.pending = 0  # 已提交未完成的请求数，包括执行中的请求和未结束的流式响应
+        self.completed = 0
+        self.rejected = 0
+        self._service_times = deque(maxlen=SERVICE_TIME_WINDOW)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        """等待空闲线程的请求数"""
+        return max(0, self.pending - self.workers)
+
+    def estimate_wait(self):
+        """
+        按最近的平均服务时间估算新请求需要等待的秒数
+
+        Returns:
+            int: 至少为1的整数秒
+        """
+        with self._lock:
+            average = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+            rounds = self.queue_depth / self.workers + 1
+        return max(1, math.ceil(average * rounds))
+
+    def acquire(self, force=False):
+        """
+        占用一个名额，不经过线程池执行的推理(如流式响应的生成过程)用它计入排队深度
+
+        Args:
+            force: 是否忽略排队上限，用于把已占用的名额转交给流式响应
+
+        Returns:
+            float: 占用开始时间，结束时传给release
+
+        Raises:
+            InferenceQueueFullError: 排队请求数已达上限
+        """
+        with self._lock:
+            full = not force and self.pending - self.workers >= self.max_queue_depth
+            if full:
+                self.rejected += 1
+            else:
+                self.pending += 1
+        if full:
+            raise InferenceQueueFullError(self.estimate_wait())
+        return time.time()
+
+    def release(self, started_at):
+        """释放acquire占用的名额，并记录服务时间"""
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self._service_times.append(time.time() - started_at)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        提交请求
+
+        Returns:
+            concurrent.futures.Future: 请求的执行结果
+
+        Raises:
+            InferenceQueueFullError: 排队请求数已达上限
+        """
+        self.acquire()
+
+        def job():
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # 线程池中的线程不经过Django的请求结束信号，需要自行清理数据库连接
+                close_old_connections()
+                self.release(start)
+
+        try:
+            return self._pool.submit(job)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+    async def run(self, fn, *args, **kwargs):
+        """在线程池中执行请求并异步等待结果，参数和异常同submit"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def get_stats(self):
+        """获取执行器统计信息"""
+        with self._lock:
+            service_times = list(self._service_times)
+            stats = {
+                'workers': self.workers,
+                'max_queue_depth': self.max_queue_depth,
+                'running': min(self.pending, self.workers),
+                'queue_depth': self.queue_depth,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+        stats['avg_service_time'] = sum(service_times) / len(service_times) if service_times else None
+        return stats
+
+
+def get_inference_executor():
+    """获取推理执行器"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = InferenceExecutor(
+                    getattr(settings, 'INFERENCE_EXECUTOR_WORKERS', 8),
+                    getattr(settings, 'INFERENCE_MAX_QUEUE_DEPTH', 32)
+                )
+    return _executor
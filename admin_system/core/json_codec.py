@@ -0,0 +1,99 @@
+"""
+JSON编解码模块 - API请求体解析和响应序列化
+
+安装了orjson时使用orjson编解码，否则回退到标准库json。图像分析请求体中的
+base64图像可达数十MB，标准库解析和序列化的耗时在这类请求中占比明显。
+
+请求体只解析一次：get_json_body把解析结果缓存在request上，日志中间件和视图
+共用同一份结果。
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse as DjangoJsonResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 请求对象上缓存解析结果的属性名
+_BODY_ATTR = '_json_body'
+_MISSING = object()
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def _default(obj):
+    """orjson不支持的类型(Decimal、惰性翻译字符串等)按DjangoJSONEncoder转换"""
+    return _django_encoder.default(obj)
+
+
+def loads(data):
+    """
+    解析JSON
+
+    Args:
+        data: bytes或str
+
+    Raises:
+        json.JSONDecodeError: 不是有效的JSON(orjson.JSONDecodeError是它的子类)
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    序列化为UTF-8编码的JSON(非ASCII字符不转义)
+
+    Returns:
+        bytes: JSON文本
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8')
+
+
+def get_json_body(request):
+    """
+    解析请求体JSON，结果缓存在request上，同一请求后续调用直接返回缓存
+
+    Returns:
+        解析后的对象
+
+    Raises:
+        json.JSONDecodeError: 请求体不是有效的JSON，后续调用抛出同一异常
+    """
+    body = getattr(request, _BODY_ATTR, _MISSING)
+    if body is _MISSING:
+        try:
+            body = loads(request.body)
+        except json.JSONDecodeError as e:
+            body = e
+        setattr(request, _BODY_ATTR, body)
+    if isinstance(body, json.JSONDecodeError):
+        raise body
+    return body
+
+
+class JsonResponse(DjangoJsonResponse):
+    """
+    使用快速编码器序列化的JsonResponse，参数与django.http.JsonResponse一致
+
+    指定了自定义encoder或json_dumps_params时按Django原有方式序列化。
+    """
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        if encoder is DjangoJSONEncoder and not json_dumps_params:
+            content = dumps(data)
+        else:
+            content = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        kwargs.setdefault('content_type', 'application/json')
+        HttpResponse.__init__(self, content=content, **kwargs)
@@ -0,0 +1,524 @@
+"""
+模型宿主模块 - 在独立进程中托管模型并通过本地socket提供推理服务
+
+模型宿主进程持有ModelWrapper和推理调度器，Web进程通过RemoteModelClient提交
+对话和图像分析请求，因此Web层可以运行多个轻量工作进程而只加载一份模型。
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """
+    解析"host:port"格式的地址
+
+    Args:
+        address: 地址字符串或(host, port)元组
+
+    Returns:
+        tuple: (host, port)
+    """
+    if isinstance(address, (tuple, list)):
+        return address[0], int(address[1])
+    host, _, port = str(address).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class ModelHostServer:
+    """
+    模型宿主服务端
+
+    每个连接处理一个请求，连接在独立线程中处理；所有请求都提交到本进程的
+    推理调度器，因此来自不同Web进程的并发请求同样可以合并批处理。
+    """
+
+    def __init__(self, address, authkey):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.active_connections = 0
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        """开始监听并处理请求，不会返回"""
+        from . import model_service
+
+        # 宿主进程自身始终使用本地模型
+        model_service.set_local_mode()
+
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"模型宿主进程已启动，监听地址: {self.address[0]}:{self.address[1]}")
+
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logger.warning("拒绝了认证失败的连接")
+                continue
+            except OSError as e:
+                logger.error(f"接受连接时出错: {str(e)}")
+                continue
+
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        """处理单个连接上的请求"""
+        from . import model_service
+
+        with self._lock:
+            self.active_connections += 1
+        try:
+            message = conn.recv()
+            op = message.get('op')
+
+            if op == 'chat':
+                response, history = model_service.model_chat(
+                    message.get('query'),
+                    history=message.get('history'),
+                    **message.get('options', {})
+                )
+                conn.send({'status': 'ok', 'response': response, 'history': history})
+
+            elif op == 'stream':
+                request = model_service.submit_chat_stream(
+                    message.get('query'),
+                    history=message.get('history'),
+                    **message.get('options', {})
+                )
+                try:
+                    for delta in request:
+                        conn.send({'delta': delta})
+                except (OSError, EOFError):
+                    # 客户端已断开，停止生成
+                    request.cancel()
+                    return
+                response, history = request.result()
+                conn.send({'status': 'ok', 'response': response, 'history': history})
+
+            elif op == 'batch':
+                requests = model_service.submit_chat_batch(
+                    message.get('queries', []),
+                    history=message.get('history'),
+                    max_batch=message.get('max_batch'),
+                    **message.get('options', {})
+                )
+                results = []
+                for request in requests:
+                    try:
+                        response, history = request.result()
+                        results.append({'status': 'ok', 'response': response, 'history': history})
+                    except Exception as e:
+                        results.append({'status': 'error', 'message': str(e)})
+                conn.send({'status': 'ok', 'results': results})
+            
+            elif op == 'status':
+                status = model_service.get_service_status()
+                status['active_connections'] = self.active_connections
+                conn.send({'status': 'ok', 'service_status': status})
+
+            elif op == 'reload':
+                # 在本进程内蓝绿切换模型，切换期间继续处理其他连接上的请求
+                result = model_service.reload_model(
+                    message.get('model_id'),
+                    load_args=message.get('load_args')
+                )
+                conn.send({'status': 'ok', 'result': result})
+
+            elif op == 'ping':
+                conn.send({'status': 'ok'})
+
+            else:
+                conn.send({'status': 'error', 'message': f'未知操作: {op}'})
+
+        except (OSError, EOFError):
+            pass
+        except Exception as e:
+            logger.exception(f"处理模型宿主请求时出错: {str(e)}")
+            try:
+                conn.send({'status': 'error', 'message': str(e)})
+            except (OSError, EOFError):
+                pass
+        finally:
+            with self._lock:
+                self.active_connections -= 1
+            conn.close()
+
+
+class RemoteRequest:
+    """远程推理请求，接口与调度器的InferenceRequest一致"""
+
+    def __init__(self):
+        self.future = Future()
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def queue_wait(self):
+        """排队等待时间(秒)，远程请求在宿主进程排队，此处无法区分"""
+        return None
+
+    def result(self, timeout=None):
+        """等待推理结果，返回(回复文本, 新的历史记录)"""
+        return self.future.result(timeout)
+
+
+class RemoteStreamRequest(RemoteRequest):
+    """远程流式推理请求，可迭代获取增量文本"""
+
+    def __init__(self, client, message):
+        super().__init__()
+        self._client = client
+        self._address = None
+        self._message = message
+        self._conn = None
+        self.cancelled = False
+
+    def cancel(self):
+        """关闭连接，宿主进程会停止生成"""
+        self.cancelled = True
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+
+    def __iter__(self):
+        self.started_at = time.time()
+        self._address, self._conn = self._client._open()
+
+        try:
+            self._conn.send(self._message)
+            while True:
+                reply = self._conn.recv()
+                if 'delta' in reply:
+                    yield reply['delta']
+                    continue
+                if reply.get('status') != 'ok':
+                    error = RuntimeError(reply.get('message', '模型宿主返回错误'))
+                    self.future.set_exception(error)
+                    raise error
+                self.future.set_result((reply['response'], reply['history']))
+                return
+        finally:
+            self.finished_at = time.time()
+            self._client._release(self._address)
+            self._conn.close()
+
+
+class RemoteModelClient:
+    """
+    模型宿主客户端
+
+    提供与InferenceScheduler相同的submit/submit_stream/chat接口。存在多个宿主
+    进程时选择当前未完成请求最少的一个，连接失败时自动尝试其他宿主。
+    """
+
+    def __init__(self, addresses, authkey, max_workers=32):
+        self.addresses = [parse_address(address) for address in addresses]
+        self.authkey = authkey
+        self.batch_size = None  # 批处理由宿主进程负责，保留该属性以兼容调度器接口
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model-host-client')
+        self._in_flight = {address: 0 for address in self.addresses}
+        self._lock = threading.Lock()
+        self._ready_lock = threading.Lock()
+        self.model_ready = False  # 已确认宿主加载了模型
+        self._signature = None  # 各宿主的模型签名，见get_model_signature
+        self._signature_at = 0
+        self._signature_lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0}  # 在请求线程和客户端线程池中更新，见_count
+
+    def _count(self, name, count=1):
+        """累加统计计数"""
+        with self._lock:
+            self.stats[name] += count
+
+    def _pick(self, exclude=()):
+        """选择未完成请求最少的宿主"""
+        with self._lock:
+            candidates = [a for a in self.addresses if a not in exclude]
+            if not candidates:
+                return None
+            address = min(candidates, key=lambda a: self._in_flight[a])
+            self._in_flight[address] += 1
+            return address
+
+    def _release(self, address):
+        with self._lock:
+            self._in_flight[address] -= 1
+
+    def _open(self):
+        """
+        连接一个可用的宿主，连接失败时依次尝试其他宿主
+
+        调用方使用完连接后需要调用_release释放计数。
+
+        Returns:
+            tuple: (宿主地址, 连接对象)
+        """
+        tried = []
+        while True:
+            address = self._pick(exclude=tried)
+            if address is None:
+                raise ConnectionError(f"所有模型宿主进程均不可用: {tried}")
+            try:
+                return address, Client(address, authkey=self.authkey)
+            except (OSError, AuthenticationError) as e:
+                logger.warning(f"连接模型宿主 {address[0]}:{address[1]} 失败: {str(e)}")
+                self._release(address)
+                tried.append(address)
+
+    def _call(self, message):
+        """
+        发送请求并等待回复
+
+        Returns:
+            dict: 宿主回复
+        """
+        address, conn = self._open()
+        try:
+            conn.send(message)
+            reply = conn.recv()
+        finally:
+            conn.close()
+            self._release(address)
+
+        if reply.get('status') != 'ok':
+            raise RuntimeError(reply.get('message', '模型宿主返回错误'))
+        return reply
+
+    def _call_address(self, address, message):
+        """向指定宿主发送请求并等待回复，不做故障转移"""
+        conn = Client(address, authkey=self.authkey)
+        try:
+            conn.send(message)
+            reply = conn.recv()
+        finally:
+            conn.close()
+
+        if reply.get('status') != 'ok':
+            raise RuntimeError(reply.get('message', '模型宿主返回错误'))
+        return reply
+
+    def reload(self, model_id=None, load_args=None, timeout=None):
+        """
+        通知所有宿主进程重新加载模型
+
+        各宿主并行执行蓝绿切换，切换期间继续处理推理请求。
+
+        Args:
+            model_id: 模型配置ID，为空时宿主加载当前活动的模型配置
+            load_args: 未指定model_id时使用的加载参数(model_path、device、precision、batch_size)
+            timeout: 等待所有宿主加载完成的超时时间(秒)，None表示一直等待
+
+        Returns:
+            dict: "host:port" -> 该宿主reload_model的返回结果
+        """
+        message = {'op': 'reload', 'model_id': model_id, 'load_args': load_args}
+        futures = {
+            address: self._executor.submit(self._call_address, address, message)
+            for address in self.addresses
+        }
+
+        deadline = None if timeout is None else time.time() + timeout
+        results = {}
+        for address, future in futures.items():
+            name = f"{address[0]}:{address[1]}"
+            try:
+                remaining = None if deadline is None else max(0, deadline - time.time())
+                results[name] = future.result(remaining)['result']
+            except FutureTimeoutError:
+                results[name] = {'status': 'loading', 'message': f'等待宿主加载模型超时({timeout}秒)'}
+            except Exception as e:
+                logger.warning(f"通知模型宿主 {name} 重新加载失败: {str(e)}")
+                results[name] = {'status': 'error', 'message': str(e)}
+
+        self.model_ready = all(r.get('status') == 'success' for r in results.values())
+        self._signature = None  # 下次获取签名时重新查询宿主
+        return results
+
+    def get_model_signature(self, max_age=5):
+        """
+        获取所有宿主进程的模型签名，作为响应缓存键的一部分
+
+        签名按max_age缓存，其他Web进程通知宿主切换模型后，本进程最多max_age秒后
+        使用新签名。刷新期间其他线程继续使用上一次的签名，不会阻塞在查询上。
+
+        Args:
+            max_age: 签名的缓存时间(秒)
+
+        Returns:
+            tuple: 与addresses顺序一致的各宿主签名，宿主不可用时对应位置为None
+        """
+        signature = self._signature
+        if signature is not None and time.time() - self._signature_at < max_age:
+            return signature
+        if not self._signature_lock.acquire(blocking=signature is None):
+            return signature
+
+        try:
+            if self._signature is not None and time.time() - self._signature_at < max_age:
+                return self._signature
+            signatures = []
+            for address in self.addresses:
+                try:
+                    status = self._call_address(address, {'op': 'status'})['service_status']
+                    signature = status.get('model_signature')
+                    signatures.append(tuple(signature) if signature else None)
+                except Exception as e:
+                    logger.warning(f"获取模型宿主 {address[0]}:{address[1]} 的模型签名失败: {str(e)}")
+                    signatures.append(None)
+            self._signature = tuple(signatures)
+            self._signature_at = time.time()
+            return self._signature
+        finally:
+            self._signature_lock.release()
+
+    def ensure_loaded(self, timeout=None):
+        """
+        确认宿主进程已加载模型
+
+        宿主报告模型未加载时通知所有宿主加载，宿主正在加载时等待加载完成。
+        确认一次后不再查询，之后的错误在推理请求时返回。
+
+        Args:
+            timeout: 等待模型加载的超时时间(秒)，None表示一直等待
+
+        Returns:
+            bool: 模型是否可用
+        """
+        if self.model_ready:
+            return True
+
+        with self._ready_lock:
+            if self.model_ready:
+                return True
+
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                status = self.get_host_status()
+                if status is None:
+                    return False
+                if status.get('model_loaded'):
+                    self.model_ready = True
+                    return True
+                if status.get('status') != 'loading':
+                    remaining = None if deadline is None else max(0, deadline - time.time())
+                    self.reload(timeout=remaining)
+                    return self.model_ready
+                if deadline is not None and time.time() >= deadline:
+                    logger.warning(f"等待模型宿主加载模型超时({timeout}秒)")
+                    return False
+                time.sleep(1)
+
+    def submit(self, query, history=None, **options):
+        """
+        提交对话请求到宿主进程
+
+        Returns:
+            RemoteRequest: 可通过result()等待结果的请求对象
+        """
+        request = RemoteRequest()
+        message = {'op': 'chat', 'query': query, 'history': list(history or []), 'options': options}
+        self._count('requests')
+
+        def run():
+            request.started_at = time.time()
+            try:
+                reply = self._call(message)
+                request.future.set_result((reply['response'], reply['history']))
+            except Exception as e:
+                self._count('errors')
+                request.future.set_exception(e)
+            finally:
+                request.finished_at = time.time()
+
+        self._executor.submit(run)
+        return request
+
+    def submit_batch(self, queries, history=None, max_batch=None, **options):
+        """
+        一次提交多条请求到同一个宿主进程，由宿主按分组批量执行
+        
+        Returns:
+            list: 与queries顺序一致的RemoteRequest列表
+        """
+        requests = [RemoteRequest() for _ in queries]
+        message = {
+            'op': 'batch',
+            'queries': list(queries),
+            'history': list(history or []),
+            'max_batch': max_batch,
+            'options': options
+        }
+        self._count('requests', len(requests))
+        
+        def run():
+            started_at = time.time()
+            for request in requests:
+                request.started_at = started_at
+            try:
+                results = self._call(message)['results']
+                for request, result in zip(requests, results):
+                    if result['status'] == 'ok':
+                        request.future.set_result((result['response'], result['history']))
+                    else:
+                        request.future.set_exception(RuntimeError(result['message']))
+            except Exception as e:
+                self._count('errors')
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            finally:
+                finished_at = time.time()
+                for request in requests:
+                    request.finished_at = finished_at
+        
+        self._executor.submit(run)
+        return requests
+    
+    def submit_stream(self, query, history=None, **options):
+        """
+        提交流式对话请求到宿主进程
+
+        Returns:
+            RemoteStreamRequest: 可迭代获取增量文本的请求对象
+        """
+        self._count('requests')
+        message = {'op': 'stream', 'query': query, 'history': list(history or []), 'options': options}
+        return RemoteStreamRequest(self, message)
+
+    def chat(self, query, history=None, timeout=None, **options):
+        """提交请求并等待结果，接口与model.chat一致"""
+        return self.submit(query, history, **options).result(timeout)
+
+    def qsize(self):
+        """当前未完成的远程请求数"""
+        with self._lock:
+            return sum(self._in_flight.values())
+
+    def get_host_status(self):
+        """
+        获取宿主进程的服务状态
+
+        Returns:
+            dict: 宿主进程的get_service_status结果，宿主不可用时返回None
+        """
+        try:
+            return self._call({'op': 'status'})['service_status']
+        except Exception as e:
+            logger.warning(f"获取模型宿主状态失败: {str(e)}")
+            return None
+
+    def get_stats(self):
+        """获取客户端统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = {f"{a[0]}:{a[1]}": n for a, n in self._in_flight.items()}
+        stats['queue_depth'] = sum(stats['in_flight'].values())
+        return stats
@@ -6,11 +6,20 @@
 import os
 import time
 import torch
+import asyncio
 import logging
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from django.conf import settings
 from pathlib import Path
 
-from .wrappers.model_wrapper import ModelWrapper
+from .wrappers.model_wrapper import ModelWrapper, CPU_ONLY_PRECISIONS
+from .scheduler import InferenceScheduler
+from .prefix_cache import PrefixCache
+from .response_cache import get_response_cache
+from .image_registry import get_embedding_cache
+from .utils import load_json_file, save_json_file
+from .model_host import RemoteModelClient
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -22,139 +31,249 @@ tokenizer = None
 model_wrapper = None
 model_load_time = None
 model_config = None
-_is_loading = False  # 新增标志，防止并发加载
+_load_future = None  # 当前加载任务，所有等待者阻塞在该Future上
+_scheduler = None  # 推理调度器，负责请求排队和动态批处理
+_local_mode = False  # 为True时忽略MODEL_HOST_ADDRESSES，始终使用本地模型（模型宿主进程）
+_model_generation = 0  # 每次加载或切换模型后递增，用于使响应缓存失效
 
 # 用于同步的锁对象
 import threading
 _model_lock = threading.Lock()
+_model_cond = threading.Condition(_model_lock)  # 用于模型租用计数和热切换排空
+_swap_lock = threading.Lock()  # 保证同一时间只有一个热切换
+_scheduler_lock = threading.Lock()
+_in_flight = {}  # 模型实例id -> 正在进行的推理数
 
-def init_model(model_path=None, device=None, precision=None):
+def _resolve_model_args(model_path=None, device=None, precision=None, batch_size=None):
+    """
+    解析模型加载参数
+    
+    未提供模型路径时从激活的ModelConfig或settings获取，并根据CUDA可用性回退到CPU。
+    
+    Returns:
+        tuple: (model_path, device, precision, batch_size, 对应的ModelConfig或None)
+    """
+    config = None
+    
+    # 详细检查CUDA是否可用
+    cuda_available = torch.cuda.is_available()
+    logger.info(f"CUDA是否可用: {cuda_available}")
+    if cuda_available:
+        try:
+            cuda_device_count = torch.cuda.device_count()
+            cuda_device_name = torch.cuda.get_device_name(0) if cuda_device_count > 0 else "未知"
+            logger.info(f"CUDA设备数量: {cuda_device_count}, 设备名称: {cuda_device_name}")
+        except Exception as e:
+            logger.warning(f"获取CUDA设备信息时出错: {str(e)}")
+    
+    # 如果没有提供配置，则使用默认值或从数据库获取
+    if not model_path:
+        from management.models import ModelConfig
+        try:
+            config = ModelConfig.objects.get(is_active=True)
+            model_path = config.model_path
+            device = config.device
+            precision = config.precision
+            batch_size = config.batch_size
+        except ModelConfig.DoesNotExist:
+            # 使用默认值
+            model_path = getattr(settings, 'DEFAULT_MODEL_PATH', 'D:/AI-DEV/models/Qwen-VL-Chat-Int4')
+            device = getattr(settings, 'DEFAULT_DEVICE', 'cuda')
+            precision = getattr(settings, 'DEFAULT_PRECISION', 'float16')
+    
+    # 检查CUDA是否可用，如果不可用则回退到CPU
+    if device == 'cuda' and not cuda_available:
+        logger.warning("CUDA不可用，回退到CPU模式运行")
+        device = 'cpu'
+        precision = _cpu_precision(precision)
+    
+    # 动态int8量化只支持CPU
+    if precision in CPU_ONLY_PRECISIONS and device != 'cpu':
+        logger.warning(f"精度 {precision} 只支持CPU，改为在CPU上运行")
+        device = 'cpu'
+    
+    # 尝试查找非量化模型路径
+    if device == 'cpu' and ('Int4' in model_path or 'Int8' in model_path):
+        non_quantized_path = model_path.replace("-Int4", "").replace("-Int8", "")
+        if os.path.exists(non_quantized_path):
+            logger.info(f"在CPU模式下使用非量化模型: {non_quantized_path}")
+            model_path = non_quantized_path
+    
+    return model_path, device, precision, batch_size, config
+
+def _cpu_precision(precision):
+    """
+    回退到CPU时选择精度
+    
+    CPU不支持高效的float16推理，此时改用CPU_FALLBACK_PRECISION(float32/bfloat16/int8_dynamic)。
+    """
+    if precision == 'float16':
+        precision = getattr(settings, 'CPU_FALLBACK_PRECISION', 'float32')
+        logger.warning(f"CPU模式下改用精度: {precision}")
+    return precision
+
+def init_model(model_path=None, device=None, precision=None, batch_size=None):
     """
     初始化并加载模型
     
     Args:
         model_path: 模型路径
         device: 设备 ('cuda' 或 'cpu')
-        precision: 精度 ('float16' 或 'float32')
+        precision: 精度 ('float16'、'bfloat16'、'float32' 或 CPU专用的 'int8_dynamic')
+        batch_size: 推理批大小，为空时使用模型配置或默认值
     
     Returns:
         dict: 包含加载状态和时间的字典
     """
-    global model, tokenizer, model_wrapper, model_load_time, model_config, _is_loading
+    global model, tokenizer, model_wrapper, model_load_time, model_config, _model_generation
     
-    # 使用锁确保并发安全
-    with _model_lock:
-        # 如果正在加载中，则返回
-        if _is_loading:
-            return {
-                'status': 'loading',
-                'message': '模型正在加载中，请稍候'
-            }
-            
-        _is_loading = True
+    # 远程模式下由模型宿主进程加载，Web进程内不加载模型
+    if is_remote_mode():
+        load_args = {
+            'model_path': model_path,
+            'device': device,
+            'precision': precision,
+            'batch_size': batch_size
+        }
+        return _reload_remote(load_args={k: v for k, v in load_args.items() if v is not None})
+    
+    # 获取加载权，保证同一时间只有一个加载者
+    load_future, is_loader = _begin_load()
+    if not is_loader:
+        return {
+            'status': 'loading',
+            'message': '模型正在加载中，请稍候'
+        }
+    
+    try:
+        model_path, device, precision, batch_size, config = _resolve_model_args(
+            model_path, device, precision, batch_size
+        )
+        if config is not None:
+            model_config = config
+                
+        logger.info(f"开始加载模型: {model_path}")
+        logger.info(f"设备: {device}, 精度: {precision}")
         
-        try:
-            # 详细检查CUDA是否可用
-            cuda_available = torch.cuda.is_available()
-            logger.info(f"CUDA是否可用: {cuda_available}")
-            if cuda_available:
-                try:
-                    cuda_device_count = torch.cuda.device_count()
-                    cuda_device_name = torch.cuda.get_device_name(0) if cuda_device_count > 0 else "未知"
-                    logger.info(f"CUDA设备数量: {cuda_device_count}, 设备名称: {cuda_device_name}")
-                except Exception as e:
-                    logger.warning(f"获取CUDA设备信息时出错: {str(e)}")
-            
-            # 如果没有提供配置，则使用默认值或从数据库获取
-            if not model_path:
-                from management.models import ModelConfig
-                try:
-                    active_config = ModelConfig.objects.get(is_active=True)
-                    model_path = active_config.model_path
-                    device = active_config.device
-                    precision = active_config.precision
-                    model_config = active_config
-                except ModelConfig.DoesNotExist:
-                    # 使用默认值
-                    model_path = getattr(settings, 'DEFAULT_MODEL_PATH', 'D:/AI-DEV/models/Qwen-VL-Chat-Int4')
-                    device = getattr(settings, 'DEFAULT_DEVICE', 'cuda')
-                    precision = getattr(settings, 'DEFAULT_PRECISION', 'float16')
-            
-            # 检查CUDA是否可用，如果不可用则回退到CPU
-            if device == 'cuda' and not cuda_available:
-                logger.warning("CUDA不可用，回退到CPU模式运行")
-                device = 'cpu'
-                    
-            logger.info(f"开始加载模型: {model_path}")
-            logger.info(f"设备: {device}, 精度: {precision}")
-            
-            # 尝试查找非量化模型路径
-            if device == 'cpu' and ('Int4' in model_path or 'Int8' in model_path):
-                non_quantized_path = model_path.replace("-Int4", "").replace("-Int8", "")
-                if os.path.exists(non_quantized_path):
-                    logger.info(f"在CPU模式下使用非量化模型: {non_quantized_path}")
-                    model_path = non_quantized_path
+        # 记录加载开始时间
+        load_start = time.time()
+        
+        # 创建模型包装器实例
+        model_wrapper = ModelWrapper(model_path, device, precision)
+        
+        # 加载模型
+        load_result = model_wrapper.load()
+        
+        if load_result.get('status') == 'success':
+            # 设置全局变量
+            model = model_wrapper.model
+            tokenizer = model_wrapper.tokenizer
+            _model_generation += 1
+            _clear_response_cache()
             
-            # 记录加载开始时间
-            load_start = time.time()
+            # 计算加载时间
+            model_load_time = time.time() - load_start
             
-            # 创建模型包装器实例
-            model_wrapper = ModelWrapper(model_path, device, precision)
+            logger.info(f"模型加载成功，耗时: {model_load_time:.2f}秒")
             
-            # 加载模型
-            load_result = model_wrapper.load()
+            # 更新调度器批大小
+            set_batch_size(batch_size)
             
-            if load_result.get('status') == 'success':
-                # 设置全局变量
-                model = model_wrapper.model
-                tokenizer = model_wrapper.tokenizer
-                
-                # 计算加载时间
-                model_load_time = time.time() - load_start
-                
-                logger.info(f"模型加载成功，耗时: {model_load_time:.2f}秒")
-                
-                # 测试模型是否可用
-                test_result = test_model()
-                if not test_result['success']:
-                    logger.error(f"模型加载成功但测试失败: {test_result['message']}")
-                    return {
-                        'status': 'error',
-                        'message': f'模型加载成功但测试失败: {test_result["message"]}'
-                    }
-                
-                return {
-                    'status': 'success',
-                    'message': f'模型加载成功，耗时: {model_load_time:.2f}秒',
-                    'model_path': model_path,
-                    'device': device,
-                    'precision': precision
-                }
-            else:
-                logger.error(f"模型加载失败: {load_result.get('message', '未知错误')}")
+            # 预热并测试模型是否可用
+            test_result = _warmup(model_wrapper, validate=False)
+            if not test_result['success']:
+                logger.error(f"模型加载成功但测试失败: {test_result['message']}")
                 return {
                     'status': 'error',
-                    'message': load_result.get('message', '模型加载失败，请查看日志获取详细信息')
+                    'message': f'模型加载成功但测试失败: {test_result["message"]}'
                 }
-        except Exception as e:
-            logger.exception(f"模型加载异常: {str(e)}")
+            
+            return {
+                'status': 'success',
+                'message': f'模型加载成功，耗时: {model_load_time:.2f}秒',
+                'model_path': model_path,
+                'device': device,
+                'precision': precision
+            }
+        else:
+            _save_load_report(model_wrapper.load_report)
+            logger.error(f"模型加载失败: {load_result.get('message', '未知错误')}")
             return {
                 'status': 'error',
-                'message': f'模型加载失败: {str(e)}'
+                'message': load_result.get('message', '模型加载失败，请查看日志获取详细信息')
             }
-        finally:
-            _is_loading = False
+    except Exception as e:
+        logger.exception(f"模型加载异常: {str(e)}")
+        return {
+            'status': 'error',
+            'message': f'模型加载失败: {str(e)}'
+        }
+    finally:
+        # 唤醒所有等待加载完成的请求
+        _finish_load(load_future)
+
+def _load_report_path():
+    """加载报告保存路径"""
+    return str(getattr(settings, 'MODEL_LOAD_REPORT_PATH', Path(settings.BASE_DIR) / 'logs' / 'model_load_report.json'))
+
+def _save_load_report(report):
+    """保存最近一次模型加载报告"""
+    if report:
+        save_json_file(_load_report_path(), report)
+
+def get_load_report():
+    """
+    获取最近一次模型加载报告
+    
+    Returns:
+        dict: 各加载阶段耗时，当前进程未加载过模型时读取上次保存的报告
+    """
+    if model_wrapper is not None and model_wrapper.load_report:
+        return model_wrapper.load_report
+    return load_json_file(_load_report_path())
 
-def test_model():
+def _warmup(wrapper, validate=False):
+    """
+    预热模型，记录warmup阶段耗时并保存加载报告
+    
+    Args:
+        wrapper: 已加载的ModelWrapper
+        validate: 是否必须执行一次生成来验证模型，热切换时为True
+    
+    Returns:
+        dict: 测试结果
+    """
+    max_new_tokens = getattr(settings, 'MODEL_WARMUP_MAX_NEW_TOKENS', 8)
+    if max_new_tokens <= 0 and not validate:
+        logger.info("已按配置跳过模型预热")
+        _save_load_report(wrapper.load_report)
+        return {
+            'success': True,
+            'message': '已跳过预热'
+        }
+    
+    with wrapper.phase('warmup'):
+        test_result = test_model(wrapper.model, wrapper.tokenizer, max_new_tokens=max(1, max_new_tokens))
+    wrapper.load_report['warmup_ok'] = test_result['success']
+    _save_load_report(wrapper.load_report)
+    return test_result
+
+def test_model(target_model=None, target_tokenizer=None, max_new_tokens=None):
     """
     简单测试模型是否可用
     
+    Args:
+        target_model: 要测试的模型，为空时测试当前模型
+        target_tokenizer: 要测试的分词器，为空时使用当前分词器
+        max_new_tokens: 生成的最大token数，为空时使用模型默认配置
+    
     Returns:
         dict: 测试结果
     """
-    global model, tokenizer
+    target_model = target_model if target_model is not None else model
+    target_tokenizer = target_tokenizer if target_tokenizer is not None else tokenizer
     
-    if model is None or tokenizer is None:
+    if target_model is None or target_tokenizer is None:
         return {
             'success': False,
             'message': '模型或分词器为空'
@@ -162,7 +281,8 @@ def test_model():
         
     try:
         # 简单的模型测试，尝试生成一个短文本
-        result, _ = model.chat(tokenizer, "你好", history=[])
+        options = {'max_new_tokens': max_new_tokens} if max_new_tokens else {}
+        result, _ = target_model.chat(target_tokenizer, "你好", history=[], **options)
         
         if result and isinstance(result, str):
             return {
@@ -180,26 +300,58 @@ def test_model():
             'message': f'模型测试时出错: {str(e)}'
         }
 
-def reload_model(model_id=None):
+@contextmanager
+def lease_model(timeout=None):
     """
-    重新加载模型
+    租用当前模型实例
+    
+    租用期间该实例不会被热切换回收；热切换会等待旧实例的所有租用释放后再释放显存。
     
     Args:
-        model_id: 模型配置ID
+        timeout: 等待模型加载的超时时间(秒)
     
-    Returns:
-        dict: 加载状态
+    Yields:
+        tuple: (model, tokenizer)，模型不可用时为(None, None)
     """
-    global model, tokenizer
+    get_model(timeout)
+    
+    with _model_cond:
+        leased_model, leased_tokenizer = model, tokenizer
+        key = id(leased_model)
+        if leased_model is not None:
+            _in_flight[key] = _in_flight.get(key, 0) + 1
+    
+    try:
+        yield leased_model, leased_tokenizer
+    finally:
+        if leased_model is not None:
+            with _model_cond:
+                _in_flight[key] -= 1
+                if _in_flight[key] <= 0:
+                    del _in_flight[key]
+                    _model_cond.notify_all()
+
+def _release_model(old_model, old_tokenizer):
+    """
+    等待旧模型实例上的推理全部结束后释放资源
     
-    # 释放现有模型资源
-    if model is not None:
-        del model
-        model = None
+    Args:
+        old_model: 被替换下来的模型
+        old_tokenizer: 被替换下来的分词器
+    """
+    drain_timeout = getattr(settings, 'MODEL_RELOAD_DRAIN_TIMEOUT', 300)
+    key = id(old_model)
     
-    if tokenizer is not None:
-        del tokenizer
-        tokenizer = None
+    with _model_cond:
+        drained = _model_cond.wait_for(lambda: _in_flight.get(key, 0) == 0, timeout=drain_timeout)
+    if not drained:
+        logger.warning(f"旧模型仍有推理未完成，等待{drain_timeout}秒后强制释放")
+    
+    # 前缀缓存中的KV张量属于旧模型，需要一并释放
+    if isinstance(_scheduler, InferenceScheduler) and _scheduler.prefix_cache is not None:
+        _scheduler.prefix_cache.clear()
+    
+    del old_model, old_tokenizer
     
     # 强制执行垃圾回收
     import gc
@@ -209,29 +361,194 @@ def reload_model(model_id=None):
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
     
+    logger.info("旧模型资源已释放")
+
+def _swap_model(model_path=None, device=None, precision=None, batch_size=None, config=None):
+    """
+    蓝绿切换模型
+    
+    在当前模型继续服务的同时加载并预热新模型，然后原子替换全局引用，
+    最后等待旧模型上的推理结束再释放。当前没有已加载的模型时直接冷启动加载。
+    
+    Returns:
+        dict: 加载状态
+    """
+    global model, tokenizer, model_wrapper, model_load_time, model_config, _model_generation
+    
+    if not _swap_lock.acquire(blocking=False):
+        return {
+            'status': 'loading',
+            'message': '模型正在切换中，请稍候'
+        }
+    
+    try:
+        if model is None or tokenizer is None:
+            result = init_model(model_path, device, precision, batch_size)
+            if config is not None and result.get('status') == 'success':
+                model_config = config
+            return result
+        
+        model_path, device, precision, batch_size, active_config = _resolve_model_args(
+            model_path, device, precision, batch_size
+        )
+        config = config or active_config
+        
+        logger.info(f"开始后台加载新模型: {model_path}，当前模型继续提供服务")
+        logger.info(f"设备: {device}, 精度: {precision}")
+        
+        load_start = time.time()
+        new_wrapper = ModelWrapper(model_path, device, precision)
+        load_result = new_wrapper.load()
+        if load_result.get('status') != 'success':
+            _save_load_report(new_wrapper.load_report)
+            logger.error(f"新模型加载失败，继续使用当前模型: {load_result.get('message', '未知错误')}")
+            return {
+                'status': 'error',
+                'message': load_result.get('message', '模型加载失败，请查看日志获取详细信息')
+            }
+        
+        # 预热新模型，失败时保留当前模型
+        test_result = _warmup(new_wrapper, validate=True)
+        if not test_result['success']:
+            logger.error(f"新模型预热失败，继续使用当前模型: {test_result['message']}")
+            del new_wrapper
+            return {
+                'status': 'error',
+                'message': f'模型加载成功但测试失败: {test_result["message"]}'
+            }
+        
+        # 原子替换全局引用，此后新请求都会租用新模型
+        with _model_cond:
+            old_model, old_tokenizer = model, tokenizer
+            model = new_wrapper.model
+            tokenizer = new_wrapper.tokenizer
+            model_wrapper = new_wrapper
+            model_config = config
+            model_load_time = time.time() - load_start
+            _model_generation += 1
+        
+        # 旧模型生成的回复不再有效
+        _clear_response_cache()
+        set_batch_size(batch_size)
+        logger.info(f"模型切换完成，耗时: {model_load_time:.2f}秒")
+        
+        _release_model(old_model, old_tokenizer)
+        
+        return {
+            'status': 'success',
+            'message': f'模型加载成功，耗时: {model_load_time:.2f}秒',
+            'model_path': model_path,
+            'device': device,
+            'precision': precision
+        }
+    except Exception as e:
+        logger.exception(f"模型切换异常: {str(e)}")
+        return {
+            'status': 'error',
+            'message': f'模型加载失败: {str(e)}'
+        }
+    finally:
+        _swap_lock.release()
+
+def reload_model(model_id=None, background=False, load_args=None):
+    """
+    重新加载模型
+    
+    采用蓝绿切换，新模型加载和预热期间旧模型继续处理请求，不会出现服务中断。
+    远程模式下通知所有模型宿主进程切换，Web进程内不加载模型。
+    
+    Args:
+        model_id: 模型配置ID
+        background: 是否在后台线程中加载，为True时立即返回
+        load_args: 未指定model_id时使用的加载参数(model_path、device、precision、batch_size)
+    
+    Returns:
+        dict: 加载状态
+    """
+    load_args = dict(load_args or {})
+    
     # 如果指定了model_id，加载指定的模型配置
     if model_id:
         from management.models import ModelConfig
         try:
-            model_config = ModelConfig.objects.get(id=model_id)
-            # 将其设为活动状态，并将其他模型设为非活动
-            ModelConfig.objects.all().update(is_active=False)
-            model_config.is_active = True
-            model_config.save()
-            
-            return init_model(
-                model_config.model_path,
-                model_config.device,
-                model_config.precision
-            )
+            config = ModelConfig.objects.get(id=model_id)
         except ModelConfig.DoesNotExist:
             return {
                 'status': 'error',
                 'message': f'模型配置不存在，ID: {model_id}'
             }
-    else:
-        # 加载当前活动的模型配置
-        return init_model()
+        
+        # 将其设为活动状态，并将其他模型设为非活动
+        ModelConfig.objects.all().update(is_active=False)
+        config.is_active = True
+        config.save()
+        
+        load_args = {
+            'model_path': config.model_path,
+            'device': config.device,
+            'precision': config.precision,
+            'batch_size': config.batch_size,
+            'config': config
+        }
+    
+    if is_remote_mode():
+        # 活动配置已写入数据库，宿主进程按model_id重新读取
+        remote_args = {} if model_id else load_args
+        if background:
+            threading.Thread(
+                target=_reload_remote,
+                args=(model_id, remote_args),
+                name='model-reload',
+                daemon=True
+            ).start()
+            return {
+                'status': 'loading',
+                'message': '模型宿主进程正在后台加载新模型，加载完成前继续使用当前模型'
+            }
+        return _reload_remote(model_id, remote_args)
+    
+    if background:
+        threading.Thread(
+            target=_swap_model,
+            kwargs=load_args,
+            name='model-reload',
+            daemon=True
+        ).start()
+        return {
+            'status': 'loading',
+            'message': '新模型正在后台加载，加载完成前继续使用当前模型'
+        }
+    
+    # 未指定时加载当前活动的模型配置
+    return _swap_model(**load_args)
+
+def _reload_remote(model_id=None, load_args=None, timeout=None):
+    """
+    通知所有模型宿主进程重新加载模型
+    
+    Returns:
+        dict: 加载状态，hosts中为各宿主的结果
+    """
+    results = get_scheduler().reload(model_id, load_args or None, timeout=timeout)
+    # 部分宿主切换成功时缓存的回复也可能来自旧模型，无论结果如何都清空
+    _clear_response_cache()
+    failed = {name: r for name, r in results.items() if r.get('status') != 'success'}
+    
+    if failed:
+        messages = '; '.join(f"{name}: {r.get('message', '未知错误')}" for name, r in failed.items())
+        logger.error(f"模型宿主重新加载失败: {messages}")
+        return {
+            'status': 'error',
+            'message': f'{len(failed)}/{len(results)}个模型宿主加载失败: {messages}',
+            'hosts': results
+        }
+    
+    logger.info(f"{len(results)}个模型宿主已完成模型加载")
+    return {
+        'status': 'success',
+        'message': f'{len(results)}个模型宿主已完成模型加载',
+        'hosts': results
+    }
 
 def get_service_status():
     """
@@ -240,10 +557,26 @@ def get_service_status():
     Returns:
         dict: 包含服务状态信息的字典
     """
-    global _is_loading, model, tokenizer, model_wrapper
+    global model, tokenizer, model_wrapper
+    
+    # 远程模式下返回模型宿主进程的状态
+    if is_remote_mode():
+        client = get_scheduler()
+        status = client.get_host_status()
+        if status is None:
+            status = {
+                'status': 'stopped',
+                'message': '模型宿主进程不可用',
+                'gpu_available': False,
+                'model_loaded': False
+            }
+        status['model_host'] = client.get_stats()
+        cache = get_response_cache()
+        status['response_cache'] = cache.get_stats() if cache else None
+        return status
     
     # 如果正在加载，返回加载中状态
-    if _is_loading:
+    if is_model_loading():
         return {
             'status': 'loading',
             'message': '模型正在加载中，请稍候',
@@ -257,9 +590,13 @@ def get_service_status():
             'status': 'stopped',
             'message': '模型未加载',
             'gpu_available': torch.cuda.is_available(),
-            'model_loaded': False
+            'model_loaded': False,
+            'load_report': get_load_report()
         }
     
+    cache = get_response_cache()
+    visual_cache = get_embedding_cache(model)
+    
     # 获取设备信息
     device = next(model.parameters()).device
     device_name = str(device)
@@ -282,6 +619,11 @@ def get_service_status():
         'load_time': model_load_time,
         'gpu_available': torch.cuda.is_available(),
         'gpu_info': gpu_info,
+        'load_report': get_load_report(),
+        'scheduler': get_scheduler().get_stats(),
+        'model_signature': get_model_signature(),
+        'response_cache': cache.get_stats() if cache else None,
+        'visual_cache': visual_cache.get_stats() if visual_cache else None,
         'model_config': {
             'path': model_config.model_path if model_config else 'unknown',
             'device': model_config.device if model_config else device_name,
@@ -289,29 +631,104 @@ def get_service_status():
         } if model_config else {}
     }
 
-def get_model():
+def get_model_signature():
+    """
+    获取当前模型签名，作为响应缓存键的一部分
+    
+    远程模式下使用各模型宿主报告的签名，宿主切换模型后缓存键随之改变。
+    
+    Returns:
+        tuple: (模型配置ID, 模型路径, 精度, 模型代数)，远程模式下为各宿主签名组成的元组
+    """
+    if is_remote_mode():
+        return get_scheduler().get_model_signature(getattr(settings, 'MODEL_HOST_SIGNATURE_TTL', 5))
+    if model_config is not None:
+        return (model_config.id, model_config.model_path, model_config.precision, _model_generation)
+    return (None, None, None, _model_generation)
+
+def _clear_response_cache():
+    """清空响应缓存"""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.clear()
+
+def _begin_load():
+    """
+    申请加载权
+    
+    在锁内检查并创建加载任务，保证同一时间只有一个加载者。
+    
+    Returns:
+        tuple: (加载任务Future, 当前调用方是否为加载者)
+    """
+    global _load_future
+    
+    with _model_lock:
+        if _load_future is not None and not _load_future.done():
+            return _load_future, False
+        _load_future = Future()
+        return _load_future, True
+
+def _finish_load(load_future):
+    """
+    结束加载任务并唤醒所有等待者
+    
+    Args:
+        load_future: _begin_load返回的加载任务
+    """
+    if not load_future.done():
+        load_future.set_result(model is not None and tokenizer is not None)
+
+def is_model_loading():
+    """
+    判断模型是否正在加载
+    
+    Returns:
+        bool: 是否正在加载
+    """
+    load_future = _load_future
+    return load_future is not None and not load_future.done()
+
+def get_model(timeout=None):
     """
     获取模型实例，如果模型未加载则先加载模型
     
+    并发的首次请求中只有一个会执行加载，其余请求阻塞等待同一个加载任务。
+    
+    Args:
+        timeout: 等待其他请求加载完成的超时时间(秒)，None表示一直等待
+    
     Returns:
-        tuple: (model, tokenizer)
+        tuple: (model, tokenizer)，加载失败或等待超时时为(None, None)
     """
-    global _is_loading, model, tokenizer
+    global model, tokenizer
     
     # 如果模型已加载，直接返回
     if model is not None and tokenizer is not None:
         return model, tokenizer
     
-    # 如果模型正在加载中，等待加载完成
-    if _is_loading:
+    # 远程模式下模型只存在于宿主进程中
+    if is_remote_mode():
+        logger.warning("远程模式下模型由模型宿主进程持有，Web进程内不加载模型")
+        return None, None
+    
+    load_future, is_loader = _begin_load()
+    
+    # 如果模型正在由其他请求加载，等待加载完成
+    if not is_loader:
         logger.info("模型正在加载中，等待加载完成...")
-        while _is_loading:
-            time.sleep(0.5)
+        try:
+            load_future.result(timeout)
+        except FutureTimeoutError:
+            logger.warning(f"等待模型加载超时({timeout}秒)")
         return model, tokenizer
     
     # 开始加载模型
-    _is_loading = True
     try:
+        # 获得加载权前模型可能已由上一个加载者加载完成
+        if model is not None and tokenizer is not None:
+            return model, tokenizer
+        
         logger.info("模型未加载，开始加载...")
         
         # 获取配置
@@ -323,6 +740,7 @@ def get_model():
         if device == 'cuda' and not torch.cuda.is_available():
             logger.warning("CUDA不可用，回退到CPU模式运行")
             device = 'cpu'
+            precision = _cpu_precision(precision)
             
         logger.info(f"开始加载模型: {model_path}")
         logger.info(f"设备: {device}, 精度: {precision}")
@@ -343,10 +761,215 @@ def get_model():
     except Exception as e:
         logger.exception(f"加载模型时出错: {str(e)}")
     finally:
-        _is_loading = False
+        _finish_load(load_future)
     
     if model is None:
         logger.error("模型加载失败，无法获取模型实例")
     
     return model, tokenizer
- 
\ No newline at end of file
+
+async def aget_model(timeout=None):
+    """
+    get_model的异步版本，供ASGI/WebSocket路径使用
+    
+    等待其他请求加载时不占用事件循环和线程；需要自己加载时在线程池中执行。
+    
+    Args:
+        timeout: 等待超时时间(秒)，None表示一直等待
+    
+    Returns:
+        tuple: (model, tokenizer)，加载失败或等待超时时为(None, None)
+    """
+    if model is not None and tokenizer is not None:
+        return model, tokenizer
+    
+    load_future = _load_future
+    if load_future is None or load_future.done():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, get_model, timeout)
+    
+    logger.info("模型正在加载中，等待加载完成...")
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(load_future)), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"等待模型加载超时({timeout}秒)")
+    return model, tokenizer
+
+def set_local_mode():
+    """
+    强制使用本进程内的模型
+    
+    模型宿主进程调用此函数，避免把请求再转发给其他宿主。
+    """
+    global _local_mode
+    _local_mode = True
+
+def get_model_host_addresses():
+    """
+    获取模型宿主进程地址列表
+    
+    Returns:
+        list: "host:port"地址列表，为空表示在本进程内加载模型
+    """
+    if _local_mode:
+        return []
+    return list(getattr(settings, 'MODEL_HOST_ADDRESSES', None) or [])
+
+def get_model_host_authkey():
+    """获取模型宿主进程的连接认证密钥"""
+    authkey = getattr(settings, 'MODEL_HOST_AUTHKEY', None) or settings.SECRET_KEY
+    return authkey.encode('utf-8') if isinstance(authkey, str) else authkey
+
+def is_remote_mode():
+    """
+    判断是否通过模型宿主进程推理
+    
+    Returns:
+        bool: 是否为远程模式
+    """
+    return bool(get_model_host_addresses())
+
+def ensure_model(timeout=None):
+    """
+    确认模型可用于推理
+    
+    本地模式下按需加载模型；远程模式下确认宿主进程已加载模型，未加载时通知宿主加载。
+    
+    Args:
+        timeout: 等待模型加载的超时时间(秒)
+    
+    Returns:
+        bool: 模型是否可用
+    """
+    if is_remote_mode():
+        return get_scheduler().ensure_loaded(timeout)
+    loaded_model, loaded_tokenizer = get_model(timeout)
+    return loaded_model is not None and loaded_tokenizer is not None
+
+async def aensure_model(timeout=None):
+    """
+    ensure_model的异步版本
+    
+    Returns:
+        bool: 模型是否可用
+    """
+    if is_remote_mode():
+        client = get_scheduler()
+        if client.model_ready:
+            return True
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, client.ensure_loaded, timeout)
+    loaded_model, loaded_tokenizer = await aget_model(timeout)
+    return loaded_model is not None and loaded_tokenizer is not None
+
+def get_scheduler():
+    """
+    获取推理调度器，首次调用时创建并启动调度线程
+    
+    配置了MODEL_HOST_ADDRESSES时返回连接模型宿主进程的RemoteModelClient，
+    其接口与本地调度器一致。
+    
+    Returns:
+        InferenceScheduler | RemoteModelClient: 推理调度器实例
+    """
+    global _scheduler
+    
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                addresses = get_model_host_addresses()
+                if addresses:
+                    _scheduler = RemoteModelClient(
+                        addresses,
+                        get_model_host_authkey(),
+                        max_workers=getattr(settings, 'MODEL_HOST_CLIENT_THREADS', 32)
+                    )
+                    logger.info(f"使用模型宿主进程推理: {', '.join(addresses)}")
+                else:
+                    batch_size = model_config.batch_size if model_config else getattr(settings, 'DEFAULT_BATCH_SIZE', 1)
+                    max_wait = getattr(settings, 'INFERENCE_BATCH_MAX_WAIT_MS', 10) / 1000
+                    prefix_cache = None
+                    if getattr(settings, 'PREFIX_CACHE_ENABLED', True):
+                        prefix_cache = PrefixCache(
+                            max_bytes=getattr(settings, 'PREFIX_CACHE_MAX_MB', 1024) * 1024 * 1024,
+                            max_entries=getattr(settings, 'PREFIX_CACHE_MAX_ENTRIES', 64)
+                        )
+                    _scheduler = InferenceScheduler(
+                        lease_model,
+                        batch_size=batch_size,
+                        max_wait=max_wait,
+                        prefix_cache=prefix_cache
+                    )
+                    _scheduler.start()
+    return _scheduler
+
+def set_batch_size(batch_size=None):
+    """
+    更新调度器的批大小
+    
+    Args:
+        batch_size: 批大小，为空时使用默认值
+    """
+    if not batch_size:
+        batch_size = getattr(settings, 'DEFAULT_BATCH_SIZE', 1)
+    scheduler = get_scheduler()
+    scheduler.batch_size = max(1, int(batch_size))
+    logger.info(f"推理批大小设置为: {scheduler.batch_size}")
+
+def submit_chat(query, history=None, **options):
+    """
+    提交对话请求到推理调度器，不等待结果
+    
+    Args:
+        query: 查询文本或from_list_format列表
+        history: 对话历史记录
+        **options: 生成参数
+    
+    Returns:
+        InferenceRequest: 推理请求对象
+    """
+    return get_scheduler().submit(query, history, **options)
+
+def submit_chat_stream(query, history=None, **options):
+    """
+    提交流式对话请求到推理调度器
+    
+    Args:
+        query: 查询文本或from_list_format列表
+        history: 对话历史记录
+        **options: 生成参数
+    
+    Returns:
+        StreamRequest: 可迭代获取增量文本的请求对象
+    """
+    return get_scheduler().submit_stream(query, history, **options)
+
+def submit_chat_batch(queries, history=None, max_batch=None, **options):
+    """
+    一次提交多条相互独立的对话请求，按max_batch分组批量生成
+    
+    Args:
+        queries: 查询列表
+        history: 各请求共用的对话历史记录
+        max_batch: 单批次最大请求数，为空时全部请求合为一批
+        **options: 生成参数
+    
+    Returns:
+        list: 与queries顺序一致的推理请求对象列表
+    """
+    return get_scheduler().submit_batch(queries, history, max_batch=max_batch, **options)
+
+def model_chat(query, history=None, timeout=None, **options):
+    """
+    通过推理调度器执行对话，接口与model.chat一致
+    
+    Args:
+        query: 查询文本或from_list_format列表
+        history: 对话历史记录
+        timeout: 等待超时时间(秒)
+        **options: 生成参数
+    
+    Returns:
+        tuple: (回复文本, 新的历史记录)
+    """
+    return get_scheduler().chat(query, history, timeout=timeout, **options)
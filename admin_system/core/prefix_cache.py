@@ -0,0 +1,149 @@
+"""
+前缀缓存模块 - 在多轮对话之间复用已计算的KV缓存
+
+缓存以上下文token序列前缀的哈希为键，保存该前缀对应的past_key_values。
+新一轮对话只需对缓存前缀之后的新增token做prefill。缓存按LRU淘汰并限制总内存。
+"""
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def _tensor_nbytes(obj):
+    """递归计算past_key_values中所有张量占用的字节数"""
+    if hasattr(obj, 'element_size') and hasattr(obj, 'nelement'):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, (tuple, list)):
+        return sum(_tensor_nbytes(item) for item in obj)
+    return 0
+
+
+class PrefixCache:
+    """
+    KV前缀缓存
+
+    缓存只对同一个模型实例有效，模型切换后需要调用clear()。
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, max_entries=64):
+        """
+        Args:
+            max_bytes: 缓存张量的总字节数上限
+            max_entries: 最大缓存条目数
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()  # 前缀哈希 -> (前缀长度, past_key_values, 字节数)
+        self._lengths = {}  # 前缀长度 -> 该长度的条目数，用于确定查找时需要计算哈希的位置
+        self._lock = threading.Lock()
+
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def _digests(tokens, lengths):
+        """
+        一次遍历计算tokens在各个长度处的前缀哈希
+
+        Args:
+            tokens: token id列表
+            lengths: 需要计算哈希的前缀长度(升序)
+
+        Returns:
+            dict: 前缀长度 -> 哈希值
+        """
+        digests = {}
+        hasher = hashlib.sha1()
+        position = 0
+        for length in lengths:
+            hasher.update(array('l', tokens[position:length]).tobytes())
+            position = length
+            digests[length] = hasher.hexdigest()
+        return digests
+
+    def lookup(self, tokens):
+        """
+        查找tokens的最长已缓存前缀
+
+        Args:
+            tokens: 当前上下文的token id列表
+
+        Returns:
+            tuple: (前缀长度, past_key_values)，未命中时为(0, None)
+        """
+        with self._lock:
+            lengths = sorted(length for length in self._lengths if length <= len(tokens))
+            if lengths:
+                digests = self._digests(tokens, lengths)
+                for length in reversed(lengths):
+                    entry = self._entries.get(digests[length])
+                    if entry is not None:
+                        self._entries.move_to_end(digests[length])
+                        self.hits += 1
+                        self.reused_tokens += length
+                        return length, entry[1]
+            self.misses += 1
+            return 0, None
+
+    def put(self, tokens, past_key_values):
+        """
+        缓存tokens对应的past_key_values
+
+        Args:
+            tokens: 已完成prefill的token id列表
+            past_key_values: 对应的KV缓存
+        """
+        nbytes = _tensor_nbytes(past_key_values)
+        if not tokens or nbytes > self.max_bytes:
+            return
+
+        key = self._digests(tokens, [len(tokens)])[len(tokens)]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            # 按LRU淘汰直到满足内存和条目数限制
+            while self._entries and (
+                self.total_bytes + nbytes > self.max_bytes or len(self._entries) >= self.max_entries
+            ):
+                self._evict_oldest()
+
+            self._entries[key] = (len(tokens), past_key_values, nbytes)
+            self._lengths[len(tokens)] = self._lengths.get(len(tokens), 0) + 1
+            self.total_bytes += nbytes
+
+    def _evict_oldest(self):
+        """淘汰最久未使用的条目，调用方需持有锁"""
+        _, (length, _, nbytes) = self._entries.popitem(last=False)
+        self.total_bytes -= nbytes
+        self._lengths[length] -= 1
+        if self._lengths[length] <= 0:
+            del self._lengths[length]
+
+    def clear(self):
+        """清空缓存，模型切换时调用"""
+        with self._lock:
+            self._entries.clear()
+            self._lengths.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_mb': self.total_bytes / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reused_tokens': self.reused_tokens,
+            }
@@ -0,0 +1,150 @@
+"""
+响应缓存模块 - 对完全相同的对话和图像分析请求复用模型输出
+
+缓存键由当前模型签名、生成参数、提示词、历史记录和图像内容哈希组成，
+缓存按LRU淘汰并带有过期时间。模型切换后签名变化，旧条目自然失效。
+显式开启采样的请求不使用缓存，见is_cacheable。
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def hash_bytes(data):
+    """计算图像等二进制内容的哈希值"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_cacheable(options):
+    """
+    判断请求的输出能否被缓存或与相同请求共用
+
+    显式开启采样(temperature大于0或do_sample为True)的请求每次都应得到新的采样结果，
+    不读写响应缓存，也不与执行中的相同请求合并。未指定temperature的请求使用模型
+    默认的生成配置，视为可复用的请求，缓存的回复是该配置下的一次输出；需要重新
+    采样的调用方应显式传入temperature。
+
+    Args:
+        options: 生成参数，见core.utils.build_generation_options
+
+    Returns:
+        bool: 可以使用响应缓存和请求合并时为True
+    """
+    options = options or {}
+    return not options.get('do_sample') and not options.get('temperature')
+
+
+def make_cache_key(signature, query, history=None, options=None, image_hashes=()):
+    """
+    生成缓存键
+
+    Args:
+        signature: 模型签名，见model_service.get_model_signature
+        query: 提示词文本
+        history: 对话历史记录
+        options: 生成参数
+        image_hashes: 请求中图像的内容哈希
+
+    Returns:
+        str: 缓存键
+    """
+    payload = json.dumps(
+        [signature, query, history or [], sorted((options or {}).items()), list(image_hashes)],
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL响应缓存"""
+
+    def __init__(self, max_entries=1024, ttl=600):
+        """
+        Args:
+            max_entries: 最大缓存条目数
+            ttl: 条目有效期(秒)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 缓存键 -> (写入时间, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        读取缓存
+
+        Returns:
+            缓存的值，未命中或已过期时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0,
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    获取全局响应缓存
+
+    Returns:
+        ResponseCache: 缓存实例，RESPONSE_CACHE_ENABLED为False时返回None
+    """
+    global _response_cache
+
+    if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 1024),
+                    ttl=getattr(settings, 'RESPONSE_CACHE_TTL', 600)
+                )
+    return _response_cache
@@ -0,0 +1,150 @@
+"""
+分析结果存储模块 - 在数据库中持久保存图像分析结果
+
+以(图像感知哈希, 规范化的查询文本, 模型配置, 生成参数)为键，保存模型回复和
+解析出的边界框。同一商品图像以相同提示词重复分析时直接返回保存的结果，并用
+保存的边界框渲染图像，不需要等待模型加载和推理。结果超过有效期后失效，可在
+管理后台的"分析结果缓存"中查看。
+"""
+import json
+import hashlib
+import logging
+import itertools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 每保存这么多条结果清理一次过期记录
+PURGE_INTERVAL = 100
+
+_store_counter = itertools.count(1)
+
+
+def is_enabled():
+    """分析结果存储是否启用"""
+    return getattr(settings, 'ANALYSIS_RESULT_STORE_ENABLED', True)
+
+
+def normalize_query(query):
+    """规范化查询文本：去掉首尾空白并合并连续空白"""
+    return ' '.join(query.split())
+
+
+def get_model_identity():
+    """
+    获取激活模型配置的标识
+
+    内存中的模型签名包含每次加载递增的代数，跨进程和重启后不稳定，这里只使用
+    模型路径和精度；没有激活配置时使用settings中的默认值。
+    """
+    from management.models import ModelConfig
+
+    config = ModelConfig.objects.filter(is_active=True).values_list('model_path', 'precision').first()
+    if config is None:
+        config = (
+            getattr(settings, 'DEFAULT_MODEL_PATH', ''),
+            getattr(settings, 'DEFAULT_PRECISION', 'float16')
+        )
+    return f"{config[0]}|{config[1]}"
+
+
+def make_result_key(image_phash, query, model_identity, options=None):
+    """
+    生成分析结果的缓存键
+
+    Args:
+        image_phash: 图像感知哈希，见image_preprocess.perceptual_hash
+        query: 规范化的查询文本
+        model_identity: 模型标识，见get_model_identity
+        options: 生成参数
+
+    Returns:
+        str: SHA-256十六进制字符串
+    """
+    payload = json.dumps([image_phash, query, model_identity, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def lookup_results(image_phashes, queries, options=None):
+    """
+    批量查询未过期的分析结果，命中的记录累加命中次数
+
+    Args:
+        image_phashes: 图像感知哈希列表
+        queries: 与图像一一对应的查询文本
+        options: 生成参数
+
+    Returns:
+        list: 与输入顺序一致的(模型回复, 边界框)，未命中的位置为None
+    """
+    from management.models import AnalysisResult
+
+    model_identity = get_model_identity()
+    keys = [
+        make_result_key(phash, normalize_query(query), model_identity, options)
+        for phash, query in zip(image_phashes, queries)
+    ]
+    now = timezone.now()
+    found = {
+        key: (response, [(label, tuple(coords)) for label, coords in boxes])
+        for key, response, boxes in AnalysisResult.objects.filter(
+            key__in=keys, expires_at__gt=now
+        ).values_list('key', 'response', 'boxes')
+    }
+    if found:
+        AnalysisResult.objects.filter(key__in=list(found)).update(hit_count=F('hit_count') + 1, last_hit_at=now)
+    return [found.get(key) for key in keys]
+
+
+def store_result(image_phash, query, options, response, boxes):
+    """
+    保存分析结果，已有相同键的记录(包括已过期的)会被覆盖，并定期清理过期记录
+
+    Args:
+        image_phash: 图像感知哈希
+        query: 查询文本
+        options: 生成参数
+        response: 模型回复
+        boxes: [(标签, (x1, y1, x2, y2)), ...]
+    """
+    from management.models import AnalysisResult
+
+    model_identity = get_model_identity()
+    query = normalize_query(query)
+    ttl = getattr(settings, 'ANALYSIS_RESULT_STORE_TTL', 7 * 24 * 3600)
+    AnalysisResult.objects.update_or_create(
+        key=make_result_key(image_phash, query, model_identity, options),
+        defaults={
+            'image_phash': image_phash,
+            'query': query,
+            'model_identity': model_identity,
+            'options': options or {},
+            'response': response,
+            'boxes': [[label, list(coords)] for label, coords in boxes],
+            'hit_count': 0,
+            'last_hit_at': None,
+            'expires_at': timezone.now() + timedelta(seconds=ttl),
+        }
+    )
+    if next(_store_counter) % PURGE_INTERVAL == 0:
+        purge_expired()
+
+
+def purge_expired():
+    """
+    删除已过期的分析结果
+
+    Returns:
+        int: 删除的记录数
+    """
+    from management.models import AnalysisResult
+
+    count, _ = AnalysisResult.objects.filter(expires_at__lte=timezone.now()).delete()
+    if count:
+        logger.info(f"删除过期的分析结果 {count} 条")
+    return count
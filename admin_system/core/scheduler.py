@@ -0,0 +1,624 @@
+"""
+推理调度模块 - 负责推理请求排队和动态批处理
+
+此模块维护一个推理请求队列，由单个后台线程独占模型。同一时刻等待中的请求
+会被合并为一次填充(padding)后的批量generate调用，批大小受ModelConfig.batch_size限制。
+"""
+import time
+import queue
+import logging
+import threading
+import importlib
+from concurrent.futures import Future
+
+import torch
+
+from .image_registry import register_query, release_images, install_visual_hook
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# Qwen chat方法使用的默认系统提示词
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+class InferenceRequest:
+    """
+    推理请求 - 队列中的单个对话请求
+
+    query可以是字符串，也可以是tokenizer.from_list_format接受的列表格式，
+    后者会在调度线程中转换为模型输入。列表中的image可以是内存中的PIL图像，
+    见image_registry.register_query。
+    """
+
+    def __init__(self, query, history=None, options=None):
+        self.query = query
+        self.history = list(history or [])
+        self.options = dict(options or {})
+        self.exclusive = False  # 为True时单独执行，不参与批处理
+        self.future = Future()
+
+        # 时间戳，用于统计排队等待和推理耗时
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def batch_key(self):
+        """只有生成参数完全相同的请求才能合并到同一批次"""
+        if self.exclusive:
+            return f"exclusive-{id(self)}"
+        return repr(sorted(self.options.items()))
+
+    @property
+    def queue_wait(self):
+        """排队等待时间(秒)"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.enqueued_at
+
+    def result(self, timeout=None):
+        """
+        等待推理结果
+
+        Args:
+            timeout: 超时时间(秒)，None表示一直等待
+
+        Returns:
+            tuple: (回复文本, 新的历史记录)
+        """
+        return self.future.result(timeout)
+
+
+class StreamRequest(InferenceRequest):
+    """
+    流式推理请求 - 调度线程逐段写入增量文本，请求线程迭代读取
+
+    流式请求总是单独执行，不参与批处理。
+    """
+
+    _DONE = object()
+
+    def __init__(self, query, history=None, options=None):
+        super().__init__(query, history, options)
+        self._chunks = queue.Queue()
+        self.cancelled = False
+
+    @property
+    def batch_key(self):
+        """流式请求不与其他请求合并"""
+        return f"stream-{id(self)}"
+
+    def put(self, delta):
+        """写入一段增量文本"""
+        self._chunks.put(delta)
+
+    def close(self, error=None):
+        """结束输出，error不为空时迭代方会收到该异常"""
+        if error is not None:
+            self._chunks.put(error)
+        self._chunks.put(self._DONE)
+
+    def cancel(self):
+        """客户端断开时取消生成，调度线程会在下一段输出前停止"""
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            item = self._chunks.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class InferenceScheduler:
+    """
+    推理调度器 - 动态批处理
+
+    所有模型调用都在调度线程中执行，请求线程只负责提交和等待结果。
+    """
+
+    def __init__(self, model_provider, batch_size=1, max_wait=0.01, prefix_cache=None):
+        """
+        Args:
+            model_provider: 返回上下文管理器的可调用对象，进入时得到(model, tokenizer)，
+                执行期间该模型实例不会被热切换释放
+            batch_size: 单批次最大请求数
+            max_wait: 凑批的最长等待时间(秒)
+            prefix_cache: 多轮对话KV前缀缓存(PrefixCache)，为None时不复用KV缓存
+        """
+        self._model_provider = model_provider
+        self.batch_size = max(1, int(batch_size or 1))
+        self.max_wait = max_wait
+        self.prefix_cache = prefix_cache
+        self._cache_model_id = None  # 前缀缓存所属的模型实例
+
+        self._queue = queue.Queue()
+        self._carry = None  # 与上一批次参数不一致、留到下一批处理的请求
+        self._pending = 0  # 已提交、尚未开始执行的请求数(分组批次按请求条数计)
+        self._pending_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # 统计信息在请求线程和调度线程中更新，读写都持有_stats_lock
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'batches': 0,
+            'batched_requests': 0,
+            'max_batch': 0,
+        }
+
+    def start(self):
+        """启动调度线程"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run_loop,
+                name='inference-scheduler',
+                daemon=True
+            )
+            self._thread.start()
+            logger.info(f"推理调度线程已启动，批大小: {self.batch_size}, 最长等待: {self.max_wait * 1000:.0f}毫秒")
+
+    def submit(self, query, history=None, **options):
+        """
+        提交推理请求
+
+        Args:
+            query: 查询文本或from_list_format列表
+            history: 对话历史记录
+            **options: 传递给generate的生成参数
+
+        Returns:
+            InferenceRequest: 可通过result()等待结果的请求对象
+        """
+        self.start()
+        request = InferenceRequest(query, history, options)
+        # 带历史的纯文本对话单独执行，以便复用上一轮的KV缓存
+        request.exclusive = self._is_prefix_cacheable(request)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        self._add_pending(1)
+        self._queue.put(request)
+        return request
+
+    def submit_stream(self, query, history=None, **options):
+        """
+        提交流式推理请求
+
+        Args:
+            query: 查询文本或from_list_format列表
+            history: 对话历史记录
+            **options: 传递给generate的生成参数
+
+        Returns:
+            StreamRequest: 可迭代获取增量文本的请求对象
+        """
+        self.start()
+        request = StreamRequest(query, history, options)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        self._add_pending(1)
+        self._queue.put(request)
+        return request
+
+    def submit_batch(self, queries, history=None, max_batch=None, **options):
+        """
+        一次提交多条相互独立的请求，按max_batch分组后每组作为一个批次执行
+        
+        与逐条submit不同，分组批次不受batch_size和凑批等待时间限制，适用于
+        调用方一次性给出多张图像等场景。
+        
+        Args:
+            queries: 查询列表
+            history: 各请求共用的对话历史记录
+            max_batch: 单批次最大请求数，为空时全部请求合为一批
+            **options: 传递给generate的生成参数
+        
+        Returns:
+            list: 与queries顺序一致的InferenceRequest列表
+        """
+        self.start()
+        requests = [InferenceRequest(query, history, options) for query in queries]
+        with self._stats_lock:
+            self.stats['requests'] += len(requests)
+        self._add_pending(len(requests))
+        
+        step = max(1, int(max_batch or len(requests) or 1))
+        for i in range(0, len(requests), step):
+            self._queue.put(requests[i:i + step])
+        return requests
+    
+    def chat(self, query, history=None, timeout=None, **options):
+        """
+        提交请求并等待结果，接口与model.chat一致
+
+        Returns:
+            tuple: (回复文本, 新的历史记录)
+        """
+        return self.submit(query, history, **options).result(timeout)
+
+    def qsize(self):
+        """当前排队中的请求数，分组批次中的每条请求单独计数"""
+        return self._pending
+
+    def _add_pending(self, count):
+        """调整排队中的请求数，入队时为正、开始执行时为负"""
+        with self._pending_lock:
+            self._pending += count
+
+    def get_stats(self):
+        """获取调度统计信息"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['batch_size'] = self.batch_size
+        stats['max_wait_ms'] = self.max_wait * 1000
+        stats['queue_depth'] = self.qsize()
+        stats['avg_batch'] = (stats['batched_requests'] / stats['batches']) if stats['batches'] else 0
+        if self.prefix_cache is not None:
+            stats['prefix_cache'] = self.prefix_cache.get_stats()
+        return stats
+
+    def _is_prefix_cacheable(self, request):
+        """判断请求能否使用KV前缀缓存"""
+        return self.prefix_cache is not None and bool(request.history) and isinstance(request.query, str)
+
+    def _collect_batch(self):
+        """从队列中收集一个批次，等待时间不超过max_wait"""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+
+        # submit_batch提交的分组直接作为一个批次
+        if isinstance(first, list):
+            return first
+
+        batch = [first]
+        deadline = time.time() + self.max_wait
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(request, list) or request.batch_key != first.batch_key:
+                # 分组批次或生成参数不同，留到下一批次
+                self._carry = request
+                break
+            batch.append(request)
+
+        return batch
+
+    def _run_loop(self):
+        """调度线程主循环"""
+        while True:
+            batch = self._collect_batch()
+            self._add_pending(-len(batch))
+            started_at = time.time()
+            for request in batch:
+                request.started_at = started_at
+
+            try:
+                self._execute(batch)
+            except Exception as e:
+                logger.exception(f"推理批次执行出错: {str(e)}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                    if isinstance(request, StreamRequest):
+                        request.close(e)
+            finally:
+                finished_at = time.time()
+                for request in batch:
+                    request.finished_at = finished_at
+
+            with self._stats_lock:
+                self.stats['batches'] += 1
+                self.stats['batched_requests'] += len(batch)
+                self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+
+    def _execute(self, batch):
+        """执行一个批次，执行期间持有模型租用"""
+        with self._model_provider() as (model, tokenizer):
+            if model is None or tokenizer is None:
+                raise RuntimeError("模型未正确加载，请检查服务日志")
+            
+            # 查询中的内存图像登记为虚拟路径，由视觉编码器直接读取
+            image_paths = []
+            for request in batch:
+                request.query, paths = register_query(request.query)
+                image_paths.extend(paths)
+            try:
+                if image_paths and not install_visual_hook(model):
+                    raise RuntimeError("当前模型不支持内存图像输入")
+                self._dispatch(model, tokenizer, batch)
+            finally:
+                release_images(image_paths)
+
+    def _dispatch(self, model, tokenizer, batch):
+        """根据请求类型选择流式、单条或批量执行"""
+        if isinstance(batch[0], StreamRequest):
+            self._run_stream(model, tokenizer, batch[0])
+            return
+
+        if len(batch) == 1:
+            self._run_single(model, tokenizer, batch[0])
+            return
+
+        try:
+            self._run_batch(model, tokenizer, batch)
+        except Exception as e:
+            # 批量生成失败时逐条回退，保证请求仍能得到结果
+            logger.warning(f"批量生成失败，回退为逐条生成: {str(e)}")
+            for request in batch:
+                if not request.future.done():
+                    self._run_single(model, tokenizer, request)
+
+    def _format_query(self, tokenizer, query):
+        """将列表格式的查询转换为模型输入文本"""
+        if isinstance(query, list):
+            return tokenizer.from_list_format(query)
+        return query
+
+    def _run_single(self, model, tokenizer, request):
+        """使用model.chat执行单条请求"""
+        if self._is_prefix_cacheable(request):
+            try:
+                self._run_cached(model, tokenizer, request)
+                return
+            except Exception as e:
+                logger.warning(f"前缀缓存生成失败，回退为model.chat: {str(e)}")
+
+        try:
+            query = self._format_query(tokenizer, request.query)
+            options, stop = _split_stop_options(tokenizer, request.options)
+            response, new_history = model.chat(
+                tokenizer,
+                query,
+                history=request.history,
+                **options
+            )
+            if stop:
+                response, _ = _truncate_at_stop(response, stop)
+                new_history = request.history + [(query, response)]
+            request.future.set_result((response, new_history))
+        except Exception as e:
+            logger.exception(f"推理请求执行出错: {str(e)}")
+            request.future.set_exception(e)
+
+    def _run_cached(self, model, tokenizer, request):
+        """
+        复用KV前缀缓存执行多轮对话请求
+
+        上一轮请求结束时缓存了其上下文的KV，本轮只需对上一轮回复和新问题做prefill。
+        本轮上下文(除最后一个token外)的KV同样写入缓存，供下一轮使用；最后一个token
+        交给generate，Qwen在存在past_key_values时只会输入该token。
+        """
+        utils = _load_generation_utils(model)
+        if utils is None:
+            raise RuntimeError("未找到qwen_generation_utils，无法使用前缀缓存")
+
+        generation_config = model.generation_config
+        chat_format = generation_config.chat_format
+        raw_text, context_tokens = utils.make_context(
+            tokenizer,
+            request.query,
+            history=request.history,
+            system=DEFAULT_SYSTEM_PROMPT,
+            max_window_size=generation_config.max_window_size,
+            chat_format=chat_format
+        )
+        if chat_format != 'chatml' or '<img>' in raw_text:
+            # 视觉编码只在没有past_key_values时执行，含图片的上下文不能复用缓存
+            raise RuntimeError("当前上下文不支持前缀缓存")
+
+        # 缓存只对产生它的模型实例有效，模型热切换后清空
+        if self._cache_model_id != id(model):
+            self.prefix_cache.clear()
+            self._cache_model_id = id(model)
+
+        options, stop = _split_stop_options(tokenizer, request.options)
+        stop_words_ids = utils.get_stop_words_ids(chat_format, tokenizer) + options.pop('stop_words_ids', [])
+        
+        prefill_len = len(context_tokens) - 1
+        cached_len, past_key_values = self.prefix_cache.lookup(context_tokens[:prefill_len])
+
+        with torch.no_grad():
+            if cached_len < prefill_len:
+                outputs = model(
+                    input_ids=torch.tensor([context_tokens[cached_len:prefill_len]], dtype=torch.long, device=model.device),
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                past_key_values = outputs.past_key_values
+                if not isinstance(past_key_values, tuple):
+                    raise RuntimeError(f"不支持的KV缓存类型: {type(past_key_values).__name__}")
+                self.prefix_cache.put(context_tokens[:prefill_len], past_key_values)
+
+            logger.debug(f"前缀缓存复用 {cached_len} 个token，prefill {prefill_len - cached_len} 个token")
+            outputs = model.generate(
+                torch.tensor([context_tokens], dtype=torch.long, device=model.device),
+                past_key_values=past_key_values,
+                stop_words_ids=stop_words_ids,
+                return_dict_in_generate=False,
+                generation_config=generation_config,
+                **options
+            )
+
+        response = utils.decode_tokens(
+            outputs[0],
+            tokenizer,
+            raw_text_len=len(raw_text),
+            context_length=len(context_tokens),
+            chat_format=chat_format,
+            verbose=False,
+            errors='replace'
+        )
+        if stop:
+            response, _ = _truncate_at_stop(response, stop)
+        request.future.set_result((response, request.history + [(request.query, response)]))
+
+    def _run_stream(self, model, tokenizer, request):
+        """
+        使用model.chat_stream逐段生成
+
+        chat_stream每次返回截至当前的完整回复，这里只写入新增部分。
+        模型不支持chat_stream时退化为一次性输出完整回复。
+        """
+        query = self._format_query(tokenizer, request.query)
+        try:
+            options, stop = _split_stop_options(tokenizer, request.options)
+            if not hasattr(model, 'chat_stream'):
+                response, new_history = model.chat(tokenizer, query, history=request.history, **options)
+                response, _ = _truncate_at_stop(response, stop)
+                request.put(response)
+            else:
+                # 有停止字符串时保留末尾可能构成停止字符串前缀的部分，确认后再输出
+                holdback = max((len(s) for s in stop), default=1) - 1
+                response = ''
+                partial = ''
+                hit = False
+                for partial in model.chat_stream(tokenizer, query, history=request.history, **options):
+                    if request.cancelled:
+                        logger.info("流式请求已取消，停止生成")
+                        break
+                    partial, hit = _truncate_at_stop(partial, stop)
+                    visible = partial if hit else partial[:max(0, len(partial) - holdback)]
+                    if len(visible) > len(response):
+                        request.put(visible[len(response):])
+                        response = visible
+                    if hit:
+                        break
+                if not request.cancelled and len(partial) > len(response):
+                    request.put(partial[len(response):])
+                    response = partial
+            new_history = request.history + [(query, response)]
+            request.future.set_result((response, new_history))
+            request.close()
+        except Exception as e:
+            logger.exception(f"流式推理出错: {str(e)}")
+            request.future.set_exception(e)
+            request.close(e)
+
+    def _run_batch(self, model, tokenizer, batch):
+        """
+        将多条请求左填充后合并为一次generate调用
+
+        构造上下文和解码的方式与Qwen的model.chat保持一致。
+        """
+        utils = _load_generation_utils(model)
+        if utils is None:
+            raise RuntimeError("未找到qwen_generation_utils，无法批量生成")
+
+        generation_config = model.generation_config
+        chat_format = generation_config.chat_format
+
+        queries, raw_texts, contexts = [], [], []
+        for request in batch:
+            query = self._format_query(tokenizer, request.query)
+            raw_text, context_tokens = utils.make_context(
+                tokenizer,
+                query,
+                history=request.history,
+                system=DEFAULT_SYSTEM_PROMPT,
+                max_window_size=generation_config.max_window_size,
+                chat_format=chat_format
+            )
+            queries.append(query)
+            raw_texts.append(raw_text)
+            contexts.append(context_tokens)
+
+        pad_id = tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = getattr(tokenizer, 'eod_id', 0)
+
+        max_len = max(len(tokens) for tokens in contexts)
+        input_ids = [[pad_id] * (max_len - len(tokens)) + list(tokens) for tokens in contexts]
+        attention_mask = [[0] * (max_len - len(tokens)) + [1] * len(tokens) for tokens in contexts]
+
+        options, stop = _split_stop_options(tokenizer, batch[0].options)
+        stop_words_ids = utils.get_stop_words_ids(chat_format, tokenizer) + options.pop('stop_words_ids', [])
+        
+        logger.info(f"执行批量生成，批大小: {len(batch)}, 最大上下文长度: {max_len}")
+        with torch.no_grad():
+            outputs = model.generate(
+                torch.tensor(input_ids, dtype=torch.long, device=model.device),
+                attention_mask=torch.tensor(attention_mask, dtype=torch.long, device=model.device),
+                stop_words_ids=stop_words_ids,
+                return_dict_in_generate=False,
+                generation_config=generation_config,
+                pad_token_id=pad_id,
+                **options
+            )
+
+        for i, request in enumerate(batch):
+            pad_len = max_len - len(contexts[i])
+            response = utils.decode_tokens(
+                outputs[i][pad_len:],
+                tokenizer,
+                raw_text_len=len(raw_texts[i]),
+                context_length=len(contexts[i]),
+                chat_format=chat_format,
+                verbose=False,
+                errors='replace'
+            )
+            if stop:
+                response, _ = _truncate_at_stop(response, stop)
+            request.future.set_result((response, request.history + [(queries[i], response)]))
+
+
+def _split_stop_options(tokenizer, options):
+    """
+    将请求中的stop字符串转换为generate使用的stop_words_ids
+    
+    Args:
+        tokenizer: 分词器
+        options: 请求的生成参数
+    
+    Returns:
+        tuple: (传给模型的生成参数, 停止字符串列表)
+    """
+    options = dict(options)
+    stop = list(options.pop('stop', None) or [])
+    if stop:
+        options['stop_words_ids'] = [tokenizer.encode(text) for text in stop]
+    return options, stop
+
+
+def _truncate_at_stop(text, stop):
+    """
+    在第一个停止字符串处截断文本
+    
+    Returns:
+        tuple: (截断后的文本, 是否遇到停止字符串)
+    """
+    positions = [text.find(s) for s in stop if s in text]
+    if positions:
+        return text[:min(positions)], True
+    return text, False
+
+
+def _load_generation_utils(model):
+    """
+    加载模型远程代码中的qwen_generation_utils模块
+
+    Returns:
+        module: 模块对象，找不到时返回None
+    """
+    package = type(model).__module__.rpartition('.')[0]
+    if not package:
+        return None
+    try:
+        return importlib.import_module(f"{package}.qwen_generation_utils")
+    except ImportError:
+        return None
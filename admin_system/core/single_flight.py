@@ -0,0 +1,111 @@
+"""
+请求合并模块 - 相同的请求在执行期间只执行一次
+
+第一个请求(leader)负责执行，执行期间到达的相同请求(follower)等待同一个结果，
+不再重复提交到模型。执行结束后键即被移除，之后的相同请求由响应缓存处理。
+适用于前端重试和多个用户同时提交同一问题的情况。
+"""
+import logging
+import threading
+from concurrent.futures import Future, CancelledError
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """按键合并执行中的请求"""
+
+    def __init__(self):
+        self._flights = {}  # 键 -> Future
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def claim(self, key):
+        """
+        登记请求
+
+        Returns:
+            tuple: (Future, 是否为leader)。leader必须在执行结束后调用settle或bind，
+            否则等待同一个键的请求会一直阻塞
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def settle(self, key, result=None, error=None):
+        """leader设置执行结果并移除键"""
+        with self._lock:
+            future = self._flights.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def bind(self, key, source, on_result=None):
+        """
+        source(concurrent.futures.Future)完成时用其结果settle
+
+        Args:
+            on_result: 成功时在settle之前以结果调用，如写入响应缓存；键移除后到达的
+                相同请求因此总能命中缓存，不会重复执行
+        """
+        def done(source):
+            if source.cancelled():
+                self.settle(key, error=CancelledError())
+            elif source.exception() is not None:
+                self.settle(key, error=source.exception())
+            else:
+                result = source.result()
+                if on_result is not None:
+                    try:
+                        on_result(result)
+                    except Exception as e:
+                        logger.warning(f"处理合并请求的结果出错: {str(e)}")
+                self.settle(key, result=result)
+        source.add_done_callback(done)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行fn，执行期间相同键的调用等待并共享同一结果
+
+        Returns:
+            tuple: (fn的返回值, 是否共享了其他调用的结果)
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.settle(key, error=e)
+            raise
+        self.settle(key, result=result)
+        return result, False
+
+    def get_stats(self):
+        """获取统计信息"""
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+            }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """获取全局请求合并实例"""
+    return _single_flight
@@ -0,0 +1,597 @@
+"""
+核心模块测试 - 测试缓存、调度和图像处理等不依赖模型权重的部分
+
+需要模型推理的部分用替身代替，不加载真实模型。
+"""
+from django.test import TestCase
+
+
+class FakeTensor:
+    """只提供EmbeddingCache用到的element_size和nelement"""
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return self.nbytes
+
+class ImageRegistryTests(TestCase):
+    """图像注册表和视觉编码缓存测试"""
+
+    def test_embedding_cache_lru(self):
+        """超出内存上限时淘汰最久未使用的编码结果，超过上限的单个结果不缓存"""
+        from core.image_registry import EmbeddingCache
+
+        cache = EmbeddingCache(max_bytes=100)
+        cache.put('a', FakeTensor(40))
+        cache.put('b', FakeTensor(40))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', FakeTensor(40))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        cache.put('d', FakeTensor(200))
+        self.assertIsNone(cache.get('d'))
+
+        stats = cache.get_stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (2, 3, 2))
+        self.assertEqual(cache.total_bytes, 80)
+
+    def test_register_release(self):
+        """相同内容哈希的图像按引用计数登记，只有内容哈希键返回缓存键"""
+        from core.image_registry import register_image, release_images, get_image
+
+        path = register_image('image', key='hash-1')
+        self.assertEqual(register_image('image', key='hash-1'), path)
+        self.assertEqual(get_image(path), ('image', 'hash-1'))
+        release_images([path])
+        self.assertEqual(get_image(path), ('image', 'hash-1'))
+        release_images([path])
+        with self.assertRaises(KeyError):
+            get_image(path)
+
+        path = register_image('image')
+        self.assertEqual(get_image(path), ('image', None))
+        release_images([path])
+
+class BoxImageStoreTests(TestCase):
+    """边界框图像存储测试"""
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_prune_by_access_time(self):
+        """超出磁盘上限时按最近访问时间淘汰到低水位，读取会刷新访问时间"""
+        import os
+        from core.box_images import BoxImageStore
+
+        store = BoxImageStore(self.directory, max_bytes=1000, hot_max_bytes=0)
+        for i, name in enumerate(['box_a.jpg', 'box_b.jpg', 'box_c.jpg']):
+            store.put(name, b'x' * 300)
+            os.utime(store.path(name), (1000 + i, 1000 + i))
+        # 读取最旧的图像后它变为最近访问
+        self.assertEqual(store.get('box_a.jpg'), b'x' * 300)
+
+        store.put('box_d.jpg', b'x' * 300)
+        self.assertEqual(sorted(name for name, _, _ in store.scan()), ['box_a.jpg', 'box_c.jpg', 'box_d.jpg'])
+        self.assertFalse(store.exists('box_b.jpg'))
+        self.assertIsNone(store.get('box_b.jpg'))
+
+        stats = store.get_stats()
+        self.assertEqual((stats['files'], stats['evictions'], stats['disk_hits'], stats['misses']), (3, 1, 1, 1))
+        # 淘汰到上限的PRUNE_LOW_WATERMARK: 700 * 0.9 = 630，只需删除最旧的box_c
+        self.assertEqual(store.prune(max_bytes=700), (1, 300))
+        self.assertEqual(sorted(name for name, _, _ in store.scan()), ['box_a.jpg', 'box_d.jpg'])
+
+    def test_hot_cache_lru(self):
+        """内存缓存超出上限时淘汰最久未使用的图像，被淘汰的图像从磁盘读取"""
+        from core.box_images import BoxImageStore
+
+        store = BoxImageStore(self.directory, max_bytes=10000, hot_max_bytes=250)
+        store.put('box_a.jpg', b'a' * 100)
+        store.put('box_b.jpg', b'b' * 100)
+        store.get('box_a.jpg')
+        store.put('box_c.jpg', b'c' * 100)
+
+        self.assertEqual(list(store._hot), ['box_a.jpg', 'box_c.jpg'])
+        self.assertEqual(store.get('box_b.jpg'), b'b' * 100)
+        stats = store.get_stats()
+        self.assertEqual((stats['hot_hits'], stats['disk_hits'], stats['hot_entries']), (1, 1, 2))
+
+    def test_box_image_name(self):
+        """相同图像、边界框和格式得到相同的文件名，且符合访问接口的校验"""
+        from core.box_images import box_image_name, BOX_IMAGE_NAME_RE
+
+        boxes = [('按钮', (1, 2, 3, 4))]
+        name = box_image_name('hash', boxes, 'WEBP')
+        self.assertEqual(name, box_image_name('hash', boxes, 'WEBP'))
+        self.assertNotEqual(name, box_image_name('hash', boxes, 'JPEG'))
+        self.assertRegex(name, BOX_IMAGE_NAME_RE)
+
+class TimingTests(TestCase):
+    """阶段计时和直方图测试"""
+
+    def test_stage_histogram(self):
+        """按桶上界估算分位数，结果不超过观测到的最大值"""
+        from core.timing import StageHistogram
+
+        histogram = StageHistogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        for ms in [3, 4, 8, 15, 15, 40, 90, 150, 700, 1500]:
+            histogram.observe(ms)
+
+        self.assertEqual(histogram.percentile(0.5), 20)
+        self.assertEqual(histogram.percentile(0.95), 1500)
+        stats = histogram.get_stats()
+        self.assertEqual(stats['count'], 10)
+        self.assertAlmostEqual(stats['avg_ms'], 252.5)
+        self.assertEqual(stats['buckets'], {
+            'le_5': 2, 'le_10': 1, 'le_20': 2, 'le_50': 1, 'le_100': 1,
+            'le_200': 1, 'le_1000': 1, 'le_2000': 1,
+        })
+
+        histogram = StageHistogram()
+        histogram.observe(3)
+        histogram.observe(100000)
+        self.assertEqual(histogram.percentile(0.5), 5)
+        self.assertEqual(histogram.get_stats()['buckets'], {'le_5': 1, 'inf': 1})
+        self.assertEqual(histogram.percentile(0.99), 100000)
+
+    def test_record_timings(self):
+        """StageTimer累加同一阶段的耗时，record_timings按流水线和阶段计入直方图"""
+        from core.timing import StageTimer, record_timings, get_timing_stats
+
+        timer = StageTimer()
+        timer.add('decode', 0.002)
+        timer.add('decode', 0.003)
+        timings = timer.as_dict()
+        self.assertEqual(timings['decode_ms'], 5.0)
+        self.assertIn('total_ms', timings)
+
+        record_timings('timing_test', {'decode_ms': 5.0})
+        record_timings('timing_test', {'decode_ms': 7.0})
+        stats = get_timing_stats()['timing_test']['decode']
+        self.assertEqual((stats['count'], stats['max_ms'], stats['avg_ms']), (2, 7.0, 6.0))
+
+def make_image_bytes(size=(64, 48), color=(200, 30, 30), fmt='PNG'):
+    """生成测试用的图像字节，左半部分为指定颜色，右半部分为白色"""
+    from io import BytesIO
+    from PIL import Image
+
+    image = Image.new('RGB', size, 'white')
+    image.paste(color, (0, 0, size[0] // 2, size[1]))
+    buffer = BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+class ImagePreprocessTests(TestCase):
+    """图像解码和感知哈希测试"""
+
+    def test_decode_image_limits(self):
+        """超过字节数或像素数上限时抛出ImageTooLargeError，缩小后保留原始尺寸"""
+        import base64
+        from core.image_preprocess import decode_image, ImageTooLargeError
+
+        data = make_image_bytes(size=(400, 200))
+        with self.assertRaises(ImageTooLargeError):
+            decode_image(data, max_bytes=len(data) - 1)
+        with self.assertRaises(ImageTooLargeError):
+            decode_image(base64.b64encode(data).decode('ascii'), max_bytes=len(data) // 2)
+        with self.assertRaises(ImageTooLargeError):
+            decode_image(data, max_pixels=400 * 200 - 1)
+
+        image, image_hash = decode_image(data, max_side=100)
+        self.assertEqual(image.size, (100, 50))
+        self.assertEqual(image.info['original_size'], (400, 200))
+        self.assertEqual(image.mode, 'RGB')
+        # Base64和原始字节得到相同的内容哈希
+        encoded = 'data:image/png;base64,' + base64.b64encode(data).decode('ascii')
+        self.assertEqual(decode_image(encoded, max_side=100)[1], image_hash)
+
+    def test_perceptual_hash(self):
+        """重新编码和缩放后哈希不变，内容不同的图像哈希不同"""
+        from io import BytesIO
+        from PIL import Image
+        from core.image_preprocess import perceptual_hash
+
+        def load(data):
+            return Image.open(BytesIO(data)).convert('RGB')
+
+        phash = perceptual_hash(load(make_image_bytes(size=(256, 192))))
+        self.assertEqual(len(phash), 64)
+        self.assertEqual(perceptual_hash(load(make_image_bytes(size=(128, 96), fmt='JPEG'))), phash)
+        mirrored = load(make_image_bytes(size=(256, 192))).transpose(Image.FLIP_LEFT_RIGHT)
+        self.assertNotEqual(perceptual_hash(mirrored), phash)
+
+class ResultStoreTests(TestCase):
+    """分析结果存储测试"""
+
+    def test_lookup_results(self):
+        """按感知哈希、规范化的问题和生成参数查询，命中时累加命中次数，过期结果不返回"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from management.models import AnalysisResult
+        from core import result_store
+
+        boxes = [('按钮', (10, 20, 30, 40))]
+        result_store.store_result('phash-1', ' 页面 布局 ', {'max_new_tokens': 64}, '回复', boxes)
+
+        results = result_store.lookup_results(
+            ['phash-1', 'phash-1', 'phash-2'], ['页面  布局', '页面 布局', '页面 布局'], {'max_new_tokens': 64}
+        )
+        self.assertEqual(results, [('回复', boxes), ('回复', boxes), None])
+        self.assertEqual(result_store.lookup_results(['phash-1'], ['页面 布局'], {'max_new_tokens': 32}), [None])
+        self.assertEqual(AnalysisResult.objects.get().hit_count, 1)
+
+        AnalysisResult.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(result_store.lookup_results(['phash-1'], ['页面 布局'], {'max_new_tokens': 64}), [None])
+        self.assertEqual(result_store.purge_expired(), 1)
+
+    def test_separate_mode_key(self):
+        """分别回答多张图像时以不带图像序号的问题保存，同一图像换位置上传仍然命中"""
+        from unittest import mock
+        from management.models import AnalysisResult
+        from core import image_analysis
+
+        red, blue = make_image_bytes(color=(200, 30, 30)), make_image_bytes(color=(30, 30, 200))
+        ask = mock.Mock(side_effect=lambda groups, texts, options, timer: [f"回复{len(texts)}"] * len(texts))
+        with mock.patch.object(image_analysis, '_ask', ask), \
+                mock.patch.object(image_analysis, 'ensure_model', return_value=True), \
+                mock.patch.object(image_analysis, 'save_boxed_image', return_value=None):
+            result = image_analysis.analyze_image([red, blue], '页面布局')
+            self.assertEqual(result['stored_results'], 0)
+            self.assertEqual(ask.call_args[0][1], ['图片1: 页面布局', '图片2: 页面布局'])
+            self.assertEqual(set(AnalysisResult.objects.values_list('query', flat=True)), {'页面布局'})
+
+            result = image_analysis.analyze_image([blue], '页面布局')
+            self.assertEqual(result['stored_results'], 1)
+            self.assertEqual(result['result'], '回复2')
+            self.assertEqual(ask.call_count, 1)
+
+class JointAnalysisTests(TestCase):
+    """联合模式边界框归属测试"""
+
+    def test_parse_boxes_by_image(self):
+        """边界框归属于之前最近提到的图像序号，序号在<ref>内时保留完整标签"""
+        from core.image_analysis import parse_boxes_by_image
+
+        text = (
+            "<ref>按钮</ref><box>(1,1),(2,2)</box>"
+            "图片2中有<ref>标题</ref><box>(3,3),(4,4)</box>"
+            "<ref>第3张的图标</ref><box>(5,5),(6,6)</box>"
+            "Picture 9 <ref>链接</ref><box>(7,7),(8,8)</box>"
+        )
+        self.assertEqual(parse_boxes_by_image(text, 3), [
+            [('按钮', (1, 1, 2, 2))],
+            [('标题', (3, 3, 4, 4))],
+            [('第3张的图标', (5, 5, 6, 6)), ('链接', (7, 7, 8, 8))],
+        ])
+        self.assertEqual(parse_boxes_by_image("没有边界框", 2), [[], []])
+
+    def test_joint_boxes_on_original_image(self):
+        """联合模式返回的边界框从0-1000归一化坐标换算为原图上的像素坐标"""
+        from unittest import mock
+        from core import image_analysis
+
+        response = "图片1<ref>按钮</ref><box>(0,0),(500,500)</box>图片2<ref>标题</ref><box>(100,200),(1000,1000)</box>"
+        with mock.patch.object(image_analysis, '_ask', return_value=[response]) as ask, \
+                mock.patch.object(image_analysis, 'ensure_model', return_value=True), \
+                mock.patch.object(image_analysis, 'save_boxed_image', return_value=None), \
+                self.settings(ANALYSIS_RESULT_STORE_ENABLED=False, IMAGE_PREPROCESS_MAX_SIDE=100):
+            result = image_analysis.analyze_image(
+                [make_image_bytes(size=(400, 200)), make_image_bytes(size=(300, 600))], '找出控件', mode='joint'
+            )
+
+        self.assertEqual(ask.call_args[0][1], ['找出控件'])
+        self.assertEqual(result['mode'], 'joint')
+        self.assertEqual(result['boxes'], [
+            [{'label': '按钮', 'box': [0, 0, 200, 100]}],
+            [{'label': '标题', 'box': [30, 120, 300, 600]}],
+        ])
+
+class ResponseCacheTests(TestCase):
+    """响应缓存测试"""
+
+    def test_make_cache_key(self):
+        """缓存键与生成参数的顺序无关，模型签名、历史记录和图像哈希不同时键不同"""
+        from core.response_cache import make_cache_key
+
+        key = make_cache_key('sig-1', '你好', [['问', '答']], {'max_new_tokens': 64, 'stop': ['#']}, ['h1'])
+        self.assertEqual(key, make_cache_key('sig-1', '你好', [['问', '答']], {'stop': ['#'], 'max_new_tokens': 64}, ['h1']))
+        self.assertNotEqual(key, make_cache_key('sig-2', '你好', [['问', '答']], {'max_new_tokens': 64, 'stop': ['#']}, ['h1']))
+        self.assertNotEqual(key, make_cache_key('sig-1', '你好', [], {'max_new_tokens': 64, 'stop': ['#']}, ['h1']))
+        self.assertNotEqual(key, make_cache_key('sig-1', '你好', [['问', '答']], {'max_new_tokens': 64, 'stop': ['#']}, ['h2']))
+        self.assertEqual(make_cache_key('sig-1', '你好'), make_cache_key('sig-1', '你好', [], {}, ()))
+
+    def test_lru_and_ttl(self):
+        """超出容量时淘汰最久未使用的条目，过期条目视为未命中"""
+        from unittest import mock
+        from core.response_cache import ResponseCache
+
+        cache = ResponseCache(max_entries=2, ttl=10)
+        with mock.patch('core.response_cache.time.time', return_value=1000.0) as now:
+            cache.set('a', 1)
+            cache.set('b', 2)
+            self.assertEqual(cache.get('a'), 1)
+            cache.set('c', 3)
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('c'), 3)
+
+            now.return_value = 1011.0
+            self.assertIsNone(cache.get('a'))
+        stats = cache.get_stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (1, 2, 2))
+
+    def test_is_cacheable(self):
+        """显式开启采样的请求不缓存，贪心解码和使用默认配置的请求可以缓存"""
+        from core.response_cache import is_cacheable
+        from core.utils import build_generation_options
+
+        self.assertTrue(is_cacheable(None))
+        self.assertTrue(is_cacheable(build_generation_options(max_tokens=16)))
+        self.assertTrue(is_cacheable(build_generation_options(temperature=0)))
+        self.assertFalse(is_cacheable(build_generation_options(temperature=0.7)))
+        self.assertFalse(is_cacheable({'do_sample': True}))
+
+    def test_sampled_chat_not_cached(self):
+        """开启采样的对话每次都提交模型，贪心解码的相同对话命中缓存"""
+        from unittest import mock
+        from core import text_processing
+        from core.response_cache import ResponseCache
+
+        cache = ResponseCache()
+        model_chat = mock.Mock(side_effect=lambda prompt, history, **options: (f"回复{model_chat.call_count}", []))
+        messages = [{'role': 'user', 'content': '你好'}]
+        with mock.patch.object(text_processing, 'ensure_model', return_value=True), \
+                mock.patch.object(text_processing, 'get_model_signature', return_value='sig'), \
+                mock.patch.object(text_processing, 'get_response_cache', return_value=cache), \
+                mock.patch.object(text_processing, 'model_chat', model_chat):
+            sampled = [text_processing.chat_completion(messages, options={'temperature': 0.7}) for _ in range(2)]
+            self.assertEqual([r['choices'][0]['message']['content'] for r in sampled], ['回复1', '回复2'])
+            self.assertEqual(cache.get_stats()['entries'], 0)
+
+            greedy = [text_processing.chat_completion(messages, options={'do_sample': False}) for _ in range(2)]
+            self.assertEqual([r['choices'][0]['message']['content'] for r in greedy], ['回复3', '回复3'])
+            self.assertEqual(model_chat.call_count, 3)
+
+class FakeRequest:
+    """submit_chat返回的推理请求替身，测试中手动设置结果"""
+
+    def __init__(self):
+        from concurrent.futures import Future
+
+        self.future = Future()
+
+class BatchChatTests(TestCase):
+    """批量对话的分组、请求合并和错误分发测试"""
+
+    def setUp(self):
+        from unittest import mock
+        from core import text_processing
+        from core.response_cache import ResponseCache
+        from core.single_flight import SingleFlight
+
+        self.cache = ResponseCache()
+        self.flights = SingleFlight()
+        self.requests = []  # [(提示词, FakeRequest), ...]
+        self.batches = []  # 每次提交的提示词列表
+
+        def submit_chat(prompt, history=None, **options):
+            return submit_chat_batch([prompt], history=history, **options)[0]
+
+        def submit_chat_batch(prompts, history=None, max_batch=None, **options):
+            if options.get('max_new_tokens') == 1:
+                raise RuntimeError('队列已满')
+            self.batches.append(list(prompts))
+            requests = [FakeRequest() for _ in prompts]
+            self.requests.extend(zip(prompts, requests))
+            return requests
+
+        patches = [
+            mock.patch.object(text_processing, 'ensure_model', return_value=True),
+            mock.patch.object(text_processing, 'get_model_signature', return_value='sig'),
+            mock.patch.object(text_processing, 'get_response_cache', return_value=self.cache),
+            mock.patch.object(text_processing, 'get_single_flight', return_value=self.flights),
+            mock.patch.object(text_processing, 'submit_chat', side_effect=submit_chat),
+            mock.patch.object(text_processing, 'submit_chat_batch', side_effect=submit_chat_batch),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @staticmethod
+    def conversation(prompt, history=(), **options):
+        """构造(消息列表, 生成参数)"""
+        messages = []
+        for user_msg, ai_msg in history:
+            messages += [{'role': 'user', 'content': user_msg}, {'role': 'assistant', 'content': ai_msg}]
+        return messages + [{'role': 'user', 'content': prompt}], options
+
+    def run_batch(self, conversations, results):
+        """
+        提交批量对话，提交完成后按results设置各提示词的结果，返回各条对话的回复或错误
+
+        Args:
+            conversations: [(消息列表, 生成参数), ...]，至少有一条无需推理(参数错误或
+                命中缓存)，以便在设置结果之前取得第一条输出
+            results: {提示词: 回复或异常}
+        """
+        from core.text_processing import iter_chat_completions
+
+        iterator = iter_chat_completions(conversations)
+        # 第一次next时完成提交，无需推理的结果(如参数错误)先返回
+        outputs = dict([next(iterator)])
+        for prompt, request in self.requests:
+            if request.future.done() or prompt not in results:
+                continue
+            if isinstance(results[prompt], Exception):
+                request.future.set_exception(results[prompt])
+            else:
+                request.future.set_result((results[prompt], []))
+        outputs.update(iterator)
+        return {
+            index: output['choices'][0]['message']['content'] if 'choices' in output else output['error']
+            for index, output in outputs.items()
+        }
+
+    def test_grouping_and_coalescing(self):
+        """历史和参数相同的对话同批提交，相同对话只提交一次并共用结果"""
+        outputs = self.run_batch([
+            ([], {}),
+            self.conversation('a', max_new_tokens=16),
+            self.conversation('b', max_new_tokens=16),
+            self.conversation('a', max_new_tokens=16),
+            self.conversation('c', history=[('问', '答')], max_new_tokens=16),
+            self.conversation('d', max_new_tokens=32),
+        ], {'a': '回复a', 'b': '回复b', 'c': '回复c', 'd': '回复d'})
+
+        self.assertEqual(sorted(self.batches), [['a', 'b'], ['c'], ['d']])
+        self.assertEqual(outputs, {0: '消息列表为空', 1: '回复a', 2: '回复b', 3: '回复a', 4: '回复c', 5: '回复d'})
+        self.assertEqual(self.flights.get_stats(), {'in_flight': 0, 'leaders': 4, 'followers': 1})
+
+        # 完成的对话已写入缓存，再次提交时不推理
+        outputs = self.run_batch([self.conversation('a', max_new_tokens=16)], {})
+        self.assertEqual(outputs, {0: '回复a'})
+        self.assertEqual(len(self.batches), 3)
+
+    def test_sampled_not_coalesced(self):
+        """开启采样的相同对话分别生成，不合并也不写入缓存"""
+        outputs = self.run_batch([self.conversation('x', temperature=0.7)] * 2 + [([], {})], {'x': '回复x'})
+
+        self.assertEqual(self.batches, [['x', 'x']])
+        self.assertEqual(outputs, {0: '回复x', 1: '回复x', 2: '消息列表为空'})
+        self.assertEqual(self.flights.get_stats()['leaders'], 0)
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+
+    def test_error_fan_out(self):
+        """生成出错时共用结果的对话都返回错误，提交失败只影响该组，出错的结果不写入缓存"""
+        outputs = self.run_batch([
+            self.conversation('a'),
+            self.conversation('a'),
+            self.conversation('b'),
+            self.conversation('c', max_new_tokens=1),
+        ], {'a': RuntimeError('显存不足'), 'b': '回复b'})
+
+        self.assertEqual(outputs, {
+            0: '标准响应生成出错: 显存不足',
+            1: '标准响应生成出错: 显存不足',
+            2: '回复b',
+            3: '标准响应生成出错: 队列已满',
+        })
+        self.assertEqual(self.flights.get_stats()['in_flight'], 0)
+        self.assertEqual(self.cache.get_stats()['entries'], 1)
+
+class SingleFlightTests(TestCase):
+    """请求合并测试"""
+
+    def test_bind_sets_cache_before_settle(self):
+        """bind在结束合并之前调用on_result，键移除时缓存已写入"""
+        from concurrent.futures import Future
+        from core.single_flight import SingleFlight
+
+        flights = SingleFlight()
+        seen = []
+
+        def on_result(result):
+            # 此时键仍在合并中，相同请求会成为follower
+            seen.append((result, flights.claim('k')[1]))
+
+        future, leader = flights.claim('k')
+        source = Future()
+        flights.bind('k', source, on_result)
+        source.set_result('结果')
+
+        self.assertTrue(leader)
+        self.assertEqual(seen, [('结果', False)])
+        self.assertEqual(future.result(), '结果')
+        self.assertEqual(flights.get_stats(), {'in_flight': 0, 'leaders': 1, 'followers': 1})
+
+        error_future, _ = flights.claim('k')
+        source = Future()
+        flights.bind('k', source, on_result)
+        source.set_exception(RuntimeError('出错'))
+        self.assertIsInstance(error_future.exception(), RuntimeError)
+        self.assertEqual(len(seen), 1)
+
+class FakeTokenizer:
+    """只提供encode的分词器替身"""
+
+    def encode(self, text):
+        return [ord(c) for c in text]
+
+class FakeModel:
+    """model.chat替身，回复中带有停止字符串"""
+
+    def chat(self, tokenizer, query, history=None, **options):
+        response = f"{query}的回复###多余内容"
+        return response, list(history or []) + [(query, response)]
+
+class SchedulerTests(TestCase):
+    """推理调度器测试"""
+
+    @staticmethod
+    def make_scheduler(**kwargs):
+        from contextlib import contextmanager
+        from core.scheduler import InferenceScheduler
+
+        @contextmanager
+        def model_provider():
+            yield FakeModel(), FakeTokenizer()
+
+        return InferenceScheduler(model_provider, **kwargs)
+
+    def test_collect_batch(self):
+        """参数相同的请求合为一批，参数不同的请求和分组批次留到下一批"""
+        from core.scheduler import InferenceRequest
+
+        scheduler = self.make_scheduler(batch_size=3, max_wait=0.01)
+        a1, a2, a3 = (InferenceRequest(f"a{i}", options={'max_new_tokens': 16}) for i in range(3))
+        b1 = InferenceRequest('b', options={'max_new_tokens': 32})
+        group = [InferenceRequest('g1'), InferenceRequest('g2')]
+        exclusive = InferenceRequest('e', options={'max_new_tokens': 16})
+        exclusive.exclusive = True
+        for item in [a1, a2, b1, a3, group, exclusive, InferenceRequest('c', options={'max_new_tokens': 16})]:
+            scheduler._queue.put(item)
+
+        batches = [scheduler._collect_batch() for _ in range(6)]
+        self.assertEqual(batches[:4], [[a1, a2], [b1], [a3], group])
+        self.assertEqual([len(batch) for batch in batches[4:]], [1, 1])
+        self.assertIs(batches[4][0], exclusive)
+
+    def test_stop_options(self):
+        """stop转换为stop_words_ids，回复在第一个停止字符串处截断"""
+        from core.scheduler import _split_stop_options, _truncate_at_stop
+
+        options, stop = _split_stop_options(FakeTokenizer(), {'max_new_tokens': 8, 'stop': ['##', 'E']})
+        self.assertEqual(options, {'max_new_tokens': 8, 'stop_words_ids': [[35, 35], [69]]})
+        self.assertEqual(stop, ['##', 'E'])
+        self.assertEqual(_split_stop_options(FakeTokenizer(), {'max_new_tokens': 8}), ({'max_new_tokens': 8}, []))
+
+        self.assertEqual(_truncate_at_stop('abcE##d', stop), ('abc', True))
+        self.assertEqual(_truncate_at_stop('abc', stop), ('abc', False))
+
+    def test_submit_and_stats(self):
+        """多个线程同时提交，结果按stop截断，统计的请求数准确"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        scheduler = self.make_scheduler(batch_size=1, max_wait=0)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            requests = list(executor.map(lambda i: scheduler.submit(f"问题{i}", stop=['###']), range(64)))
+        results = [request.result(timeout=10) for request in requests]
+
+        self.assertEqual(results[3], ('问题3的回复', [('问题3', '问题3的回复')]))
+        stats = scheduler.get_stats()
+        # 批次统计在结果返回之后更新，这里只检查提交时的计数
+        self.assertEqual((stats['requests'], stats['max_batch']), (64, 1))
+        self.assertEqual(stats['queue_depth'], 0)
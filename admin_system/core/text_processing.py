@@ -3,20 +3,103 @@
 
 此模块提供文本对话、聊天历史管理等功能，支持与大模型的文本交互。
 """
+import json
 import time
 import logging
-from .model_service import get_model
+from functools import partial
+from concurrent.futures import as_completed
+from django.conf import settings
+from .model_service import (
+    ensure_model, model_chat, submit_chat, submit_chat_stream, submit_chat_batch, get_model_signature
+)
+from .response_cache import get_response_cache, make_cache_key, is_cacheable
+from .single_flight import get_single_flight
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
-def chat_completion(messages, stream=False):
+def parse_messages(messages):
+    """
+    从OpenAI格式的消息列表中取出当前查询和对话历史
+    
+    Args:
+        messages: 聊天消息列表
+    
+    Returns:
+        tuple: (最后一条用户消息, [[用户消息, 助手回复], ...])
+    
+    Raises:
+        ValueError: 消息列表为空、格式不正确或没有用户消息
+    """
+    if not messages:
+        raise ValueError("消息列表为空")
+    
+    if not isinstance(messages, list) or not all(isinstance(msg, dict) for msg in messages):
+        raise ValueError("消息列表格式不正确")
+    
+    # 取最后一条用户消息作为当前查询
+    prompt = None
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            prompt = msg.get("content", "")
+            break
+    
+    if not prompt:
+        raise ValueError("未找到用户消息")
+    
+    # 构建历史消息
+    history = []
+    for i in range(0, len(messages) - 1, 2):
+        if i + 1 < len(messages):
+            if messages[i].get("role") == "user" and messages[i+1].get("role") == "assistant":
+                user_msg = messages[i].get("content", "")
+                ai_msg = messages[i+1].get("content", "")
+                history.append([user_msg, ai_msg])
+    
+    return prompt, history
+
+def build_completion(response, processing_time):
+    """
+    构建OpenAI格式的chat.completion响应
+    
+    Args:
+        response: 回复文本
+        processing_time: 处理时间(秒)
+    
+    Returns:
+        dict: 响应字典
+    """
+    return {
+        "id": f"chatcmpl-{int(time.time()*1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "qwen-vl-chat",
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": response
+                },
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 0,  # 暂不计算具体token
+            "completion_tokens": 0,
+            "total_tokens": 0
+        },
+        "processing_time": f"{processing_time:.2f}秒"
+    }
+
+def chat_completion(messages, stream=False, options=None):
     """
     生成聊天响应
     
     Args:
         messages: 聊天消息列表
         stream: 是否使用流式响应
+        options: 生成参数，见core.utils.build_generation_options
     
     Returns:
         dict: 包含响应内容的字典
@@ -25,11 +108,8 @@ def chat_completion(messages, stream=False):
         # 获取开始时间
         start_time = time.time()
         
-        # 获取模型和tokenizer
-        model, tokenizer = get_model()
-        
-        # 如果模型或tokenizer为None，表示加载失败
-        if model is None or tokenizer is None:
+        # 确认模型可用，未加载时按需加载
+        if not ensure_model(getattr(settings, 'MODEL_LOAD_WAIT_TIMEOUT', None)):
             logger.error("无法获取模型或分词器")
             return {
                 "error": "模型未正确加载，请检查服务日志",
@@ -37,56 +117,41 @@ def chat_completion(messages, stream=False):
             }
         
         # 处理历史消息
-        history = []
-        prompt = ""
-        
-        if messages:
-            # 取最后一条用户消息作为当前查询
-            current_msg = None
-            for msg in reversed(messages):
-                if msg.get("role") == "user":
-                    current_msg = msg.get("content", "")
-                    break
-            
-            if not current_msg:
-                return {
-                    "error": "未找到用户消息",
-                    "processing_time": "N/A"
-                }
-            
-            # 构建历史消息
-            for i in range(0, len(messages) - 1, 2):
-                if i + 1 < len(messages):
-                    if messages[i].get("role") == "user" and messages[i+1].get("role") == "assistant":
-                        user_msg = messages[i].get("content", "")
-                        ai_msg = messages[i+1].get("content", "")
-                        history.append([user_msg, ai_msg])
-            
-            prompt = current_msg
-        else:
+        try:
+            prompt, history = parse_messages(messages)
+        except ValueError as e:
             return {
-                "error": "消息列表为空",
+                "error": str(e),
                 "processing_time": "N/A"
             }
         
+        # 完全相同的请求直接使用缓存的回复，开启采样的请求每次重新生成
+        options = options or {}
+        cacheable = is_cacheable(options)
+        cache = get_response_cache() if cacheable else None
+        cache_key = make_cache_key(get_model_signature(), prompt, history, options)
+        cached = cache.get(cache_key) if cache else None
+        
         # 流式响应处理
         if stream:
-            # 这里使用生成器实现流式响应
+            # 这里使用生成器实现流式响应，逐段产出模型新生成的文本
             def generate_stream():
+                if cached is not None:
+                    yield cached[0]
+                    return
+                
+                request = submit_chat_stream(prompt, history=history, **options)
                 try:
-                    if model is None:
-                        yield "模型未加载"
-                        return
-                    
-                    if not hasattr(model, 'chat'):
-                        yield "模型不支持chat方法"
-                        return
-                    
-                    response, _ = model.chat(tokenizer, prompt, history=history)
-                    yield response
+                    for delta in request:
+                        yield delta
+                    if cache and not request.cancelled:
+                        cache.set(cache_key, request.result())
                 except Exception as e:
                     logger.exception(f"生成流式响应时出错: {str(e)}")
                     yield f"生成流式响应时出错: {str(e)}"
+                finally:
+                    # 客户端提前断开时停止生成，释放模型
+                    request.cancel()
                 
             return {
                 "stream": generate_stream(),
@@ -95,49 +160,31 @@ def chat_completion(messages, stream=False):
         else:
             # 标准响应
             try:
-                if model is None:
-                    logger.error("模型未加载")
-                    return {
-                        "error": "模型未加载",
-                        "processing_time": "N/A"
-                    }
-                
-                if not hasattr(model, 'chat'):
-                    logger.error("模型不支持chat方法")
-                    return {
-                        "error": "模型不支持chat方法",
-                        "processing_time": "N/A"
-                    }
-                
-                logger.info(f"开始生成回复，提示词长度: {len(prompt)}")
-                response, new_history = model.chat(tokenizer, prompt, history=history)
+                if cached is not None:
+                    logger.info("命中响应缓存")
+                    response, new_history = cached
+                else:
+                    def generate():
+                        logger.info(f"开始生成回复，提示词长度: {len(prompt)}")
+                        result = model_chat(prompt, history=history, **options)
+                        # 先写入缓存再结束合并，之后到达的相同请求直接命中缓存
+                        if cache:
+                            cache.set(cache_key, result)
+                        return result
+                    
+                    # 相同请求正在生成时等待它的结果，不重复提交到模型
+                    if cacheable:
+                        (response, new_history), shared = get_single_flight().do(cache_key, generate)
+                        if shared:
+                            logger.info("合并到进行中的相同请求")
+                    else:
+                        response, new_history = generate()
                 
                 # 计算处理时间
                 processing_time = time.time() - start_time
                 logger.info(f"回复生成完成，耗时: {processing_time:.2f}秒")
                 
-                return {
-                    "id": f"chatcmpl-{int(time.time()*1000)}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": "qwen-vl-chat",
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": response
-                            },
-                            "finish_reason": "stop"
-                        }
-                    ],
-                    "usage": {
-                        "prompt_tokens": 0,  # 暂不计算具体token
-                        "completion_tokens": 0,
-                        "total_tokens": 0
-                    },
-                    "processing_time": f"{processing_time:.2f}秒"
-                }
+                return build_completion(response, processing_time)
             except Exception as e:
                 logger.exception(f"标准响应生成出错: {str(e)}")
                 return {
@@ -149,4 +196,108 @@ def chat_completion(messages, stream=False):
         return {
             "error": f"处理过程中出错: {str(e)}",
             "processing_time": "N/A"
-        } 
\ No newline at end of file
+        } 
+
+def iter_chat_completions(conversations):
+    """
+    批量生成聊天响应，按完成顺序逐条返回
+    
+    对话历史和生成参数都相同的对话分为一组，每组通过submit_chat_batch一次提交，
+    按CHAT_BATCH_GENERATE_SIZE分批同时生成；只有一条的组单独提交，仍可复用多轮
+    对话的KV前缀缓存。开启采样的对话不使用响应缓存，也不与相同的对话合并。
+    结果按完成先后返回，单条对话出错只影响该条结果。
+    
+    Args:
+        conversations: [(消息列表, 生成参数), ...]
+    
+    Yields:
+        tuple: (对话在conversations中的序号, 与chat_completion相同格式的结果字典)
+    """
+    start_time = time.time()
+    
+    # 确认模型可用，未加载时按需加载
+    if not ensure_model(getattr(settings, 'MODEL_LOAD_WAIT_TIMEOUT', None)):
+        logger.error("无法获取模型或分词器")
+        for index in range(len(conversations)):
+            yield index, {
+                "error": "模型未正确加载，请检查服务日志",
+                "processing_time": "N/A"
+            }
+        return
+    
+    cache = get_response_cache()
+    flights = get_single_flight()
+    signature = get_model_signature()
+    finished = []  # 无需推理的结果(参数错误、命中缓存、提交失败)
+    pending = {}  # future -> [序号, ...]，相同的对话共用一个future
+    groups = {}  # (对话历史, 生成参数) -> (对话历史, 生成参数, [(序号, 提示词, 缓存键), ...])
+    
+    for index, (messages, options) in enumerate(conversations):
+        try:
+            prompt, history = parse_messages(messages)
+            options = options or {}
+            # 开启采样的对话不使用缓存，也不与相同的对话合并，缓存键为None
+            cache_key = None
+            if is_cacheable(options):
+                cache_key = make_cache_key(signature, prompt, history, options)
+                cached = cache.get(cache_key) if cache else None
+                if cached is not None:
+                    finished.append((index, build_completion(cached[0], time.time() - start_time)))
+                    continue
+                # 批次内或其他请求中相同的对话正在生成时共用其结果
+                future, leader = flights.claim(cache_key)
+                pending.setdefault(future, []).append(index)
+                if not leader:
+                    continue
+            group_key = json.dumps([history, options], sort_keys=True, ensure_ascii=False, default=str)
+            groups.setdefault(group_key, (history, options, []))[2].append((index, prompt, cache_key))
+        except Exception as e:
+            finished.append((index, {
+                "error": str(e),
+                "processing_time": "N/A"
+            }))
+    
+    # 每组一次提交，组内请求在同一批次中生成
+    group_size = getattr(settings, 'CHAT_BATCH_GENERATE_SIZE', 8)
+    for history, options, items in groups.values():
+        prompts = [prompt for _, prompt, _ in items]
+        try:
+            if len(items) == 1:
+                requests = [submit_chat(prompts[0], history=history, **options)]
+            else:
+                requests = submit_chat_batch(prompts, history=history, max_batch=group_size, **options)
+        except Exception as e:
+            for index, _, cache_key in items:
+                if cache_key is not None:
+                    flights.settle(cache_key, error=e)
+                else:
+                    finished.append((index, {
+                        "error": f"标准响应生成出错: {str(e)}",
+                        "processing_time": "N/A"
+                    }))
+            continue
+        for (index, _, cache_key), request in zip(items, requests):
+            if cache_key is not None:
+                # 先写入缓存再结束合并，之后到达的相同对话直接命中缓存
+                flights.bind(cache_key, request.future, partial(cache.set, cache_key) if cache else None)
+            else:
+                pending[request.future] = [index]
+    
+    logger.info(f"批量对话已提交: 共{len(conversations)}条，需推理{len(pending)}条，分为{len(groups)}组")
+    yield from finished
+    
+    for future in as_completed(pending):
+        indices = pending[future]
+        try:
+            response, _ = future.result()
+        except Exception as e:
+            logger.exception(f"批量对话第{indices[0]}条生成出错: {str(e)}")
+            for index in indices:
+                yield index, {
+                    "error": f"标准响应生成出错: {str(e)}",
+                    "processing_time": "N/A"
+                }
+            continue
+        
+        for index in indices:
+            yield index, build_completion(response, time.time() - start_time)
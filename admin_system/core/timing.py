@@ -0,0 +1,147 @@
+"""
+阶段计时模块 - 记录单次请求各处理阶段的耗时并汇总为直方图
+
+StageTimer记录一次请求中各阶段的耗时(毫秒)，随响应返回；请求结束后调用
+record_timings把结果计入按流水线和阶段划分的直方图，服务状态接口中可查看
+各阶段的次数、平均值和分位数，用于判断慢请求耗在模型推理还是I/O上。
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 直方图桶的上界(毫秒)，最后一个桶收集所有更大的值
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+_histograms = {}  # (流水线, 阶段) -> StageHistogram
+_lock = threading.Lock()
+
+
+class StageTimer:
+    """单次请求的阶段计时，多个线程可同时向同一计时器累加"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._stages = {}  # 阶段 -> 累计耗时(秒)，保持首次出现的顺序
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """累加阶段耗时，同一阶段多次出现(如多张图像)时耗时相加"""
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """计时上下文: with timer.stage('decode'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def as_dict(self):
+        """
+        获取各阶段耗时
+
+        Returns:
+            dict: {阶段_ms: 毫秒}，另含从创建计时器起的总耗时total_ms
+        """
+        with self._lock:
+            timings = {f"{stage}_ms": round(seconds * 1000, 2) for stage, seconds in self._stages.items()}
+        timings['total_ms'] = round((time.time() - self.started_at) * 1000, 2)
+        return timings
+
+
+class StageHistogram:
+    """单个阶段的耗时直方图"""
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        """记录一次耗时(毫秒)"""
+        with self._lock:
+            self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        """按桶上界估算分位数，结果不超过观测到的最大值"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return min(HISTOGRAM_BUCKETS_MS[i], self.max_ms) if i < len(HISTOGRAM_BUCKETS_MS) else self.max_ms
+            return self.max_ms
+
+    def get_stats(self):
+        """获取直方图统计信息"""
+        with self._lock:
+            count, total_ms, max_ms = self.count, self.total_ms, self.max_ms
+            buckets = {
+                (f"le_{bound}" if i < len(HISTOGRAM_BUCKETS_MS) else 'inf'): self.counts[i]
+                for i, bound in enumerate(HISTOGRAM_BUCKETS_MS + (None,))
+                if self.counts[i]
+            }
+        return {
+            'count': count,
+            'avg_ms': total_ms / count if count else 0,
+            'max_ms': max_ms,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': buckets,
+        }
+
+
+def observe_stage(pipeline, stage, ms):
+    """
+    把单个阶段的耗时计入直方图
+
+    Args:
+        pipeline: 流水线名称，如image_analysis
+        stage: 阶段名称
+        ms: 耗时(毫秒)
+    """
+    key = (pipeline, stage)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, StageHistogram())
+    histogram.observe(ms)
+
+
+def record_timings(pipeline, timings):
+    """
+    把StageTimer.as_dict()的结果计入直方图
+
+    Args:
+        pipeline: 流水线名称
+        timings: {阶段_ms: 毫秒}
+    """
+    for name, ms in timings.items():
+        observe_stage(pipeline, name[:-3] if name.endswith('_ms') else name, ms)
+
+
+def get_timing_stats():
+    """
+    获取所有阶段的直方图统计
+
+    Returns:
+        dict: {流水线: {阶段: 统计信息}}
+    """
+    with _lock:
+        items = list(_histograms.items())
+    stats = {}
+    for (pipeline, stage), histogram in items:
+        stats.setdefault(pipeline, {})[stage] = histogram.get_stats()
+    return stats
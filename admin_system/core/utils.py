@@ -8,6 +8,46 @@ import json
 from django.conf import settings
 from pathlib import Path
 
+def build_generation_options(max_tokens=None, temperature=None, stop=None, max_tokens_limit=None):
+    """
+    根据请求参数构造生成参数
+    
+    Args:
+        max_tokens: 请求的最大生成token数
+        temperature: 采样温度，0表示贪心解码
+        stop: 停止字符串或字符串列表
+        max_tokens_limit: 服务端允许的最大生成token数，为空时使用MAX_NEW_TOKENS_LIMIT
+        
+    Returns:
+        dict: 传递给推理调度器的生成参数
+    
+    Raises:
+        ValueError: 参数不合法
+    """
+    limit = max_tokens_limit or getattr(settings, 'MAX_NEW_TOKENS_LIMIT', 512)
+    options = {}
+    
+    if max_tokens is not None:
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+            raise ValueError('max_tokens必须是正整数')
+    options['max_new_tokens'] = min(max_tokens or limit, limit)
+    
+    if temperature is not None:
+        if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or not 0 <= temperature <= 2:
+            raise ValueError('temperature必须在0到2之间')
+        if temperature == 0:
+            options['do_sample'] = False
+        else:
+            options['temperature'] = float(temperature)
+    
+    if stop:
+        stop = [stop] if isinstance(stop, str) else stop
+        if not isinstance(stop, list) or len(stop) > 4 or not all(isinstance(s, str) and s for s in stop):
+            raise ValueError('stop必须是非空字符串或最多4个非空字符串的列表')
+        options['stop'] = stop
+    
+    return options
+
 def get_static_dir():
     """获取静态文件目录"""
     static_dir = os.path.join(settings.BASE_DIR, 'static')
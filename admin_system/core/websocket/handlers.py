@@ -7,12 +7,34 @@ import json
 import asyncio
 import time
 from typing import Dict, Any, Optional
+from django.conf import settings
 
 # 导入核心功能模块
-from ..image_analysis import analyze_image
+from ..image_analysis import analyze_image, ANALYSIS_MODES
 from ..text_processing import chat_completion
+from ..model_service import aensure_model
+from ..utils import build_generation_options
 from .managers import manager
 
+async def ensure_model_ready(client_id: str) -> bool:
+    """
+    等待模型就绪，不阻塞事件循环
+    
+    Args:
+        client_id: 客户端ID
+    
+    Returns:
+        bool: 模型是否可用
+    """
+    timeout = getattr(settings, 'MODEL_LOAD_WAIT_TIMEOUT', None)
+    if not await aensure_model(timeout):
+        await manager.send_json(client_id, {
+            "status": "error",
+            "message": "模型未正确加载，请检查服务日志"
+        })
+        return False
+    return True
+
 async def handle_chat_message(client_id: str, message: Dict[str, Any]):
     """
     处理聊天消息
@@ -39,8 +61,23 @@ async def handle_chat_message(client_id: str, message: Dict[str, Any]):
         # 提取聊天消息
         messages = message.get('messages', [])
         
-        # 调用聊天完成函数
-        result = chat_completion(messages)
+        # 生成参数，受全局最大生成token数限制
+        try:
+            options = build_generation_options(message.get('max_tokens'), message.get('temperature'), message.get('stop'))
+        except ValueError as e:
+            await manager.send_json(client_id, {
+                "status": "error",
+                "message": str(e)
+            })
+            return
+        
+        # 等待模型就绪
+        if not await ensure_model_ready(client_id):
+            return
+        
+        # 在线程池中调用聊天完成函数，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, chat_completion, messages, False, options)
         
         # 检查是否有错误
         if 'error' in result:
@@ -93,8 +130,31 @@ async def handle_analyze_message(client_id: str, message: Dict[str, Any]):
         image_base64 = message.get('image_base64')
         query = message.get('query')
         
-        # 调用图像分析函数
-        result = analyze_image(image_base64, query)
+        # 生成参数，受全局最大生成token数限制
+        try:
+            options = build_generation_options(message.get('max_tokens'), message.get('temperature'), message.get('stop'))
+        except ValueError as e:
+            await manager.send_json(client_id, {
+                "status": "error",
+                "message": str(e)
+            })
+            return
+        
+        mode = message.get('mode', 'separate')
+        if mode not in ANALYSIS_MODES:
+            await manager.send_json(client_id, {
+                "status": "error",
+                "message": f"mode必须是{'或'.join(ANALYSIS_MODES)}"
+            })
+            return
+        
+        # 等待模型就绪
+        if not await ensure_model_ready(client_id):
+            return
+        
+        # 在线程池中调用图像分析函数，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, analyze_image, image_base64, query, options, mode)
         
         # 发送结果
         await manager.send_json(client_id, {
@@ -102,7 +162,8 @@ async def handle_analyze_message(client_id: str, message: Dict[str, Any]):
             "result": result.get('result'),
             "processing_time": result.get('processing_time'),
             "boxed_image_url": result.get('boxed_image_url'),
-            "boxed_image_urls": result.get('boxed_image_urls')
+            "boxed_image_urls": result.get('boxed_image_urls'),
+            "boxes": result.get('boxes')
         })
         
     except Exception as e:
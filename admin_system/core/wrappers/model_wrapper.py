@@ -6,14 +6,61 @@
 """
 
 import torch
+import time
+import glob
 import logging
 import traceback
+from contextlib import contextmanager
 from transformers import AutoModelForCausalLM, AutoTokenizer, GenerationConfig
 import os
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
+# 精度选项对应的权重数据类型，int8_dynamic先以float32加载再对线性层做动态量化
+PRECISION_DTYPES = {
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'float32': torch.float32,
+    'int8_dynamic': torch.float32,
+}
+
+# 只在CPU上可用的精度
+CPU_ONLY_PRECISIONS = ('int8_dynamic',)
+
+
+def quantize_language_model(model):
+    """
+    对语言模型部分的线性层做动态int8量化
+    
+    权重离线量化为int8，激活在推理时动态量化，只支持CPU。视觉编码器保持float32，
+    以免影响图像特征精度。
+    
+    Args:
+        model: 已加载到CPU上的Qwen模型
+    
+    Returns:
+        model: 量化后的模型(原地修改)
+    """
+    targets = set()
+    for name in ('transformer.h', 'lm_head'):
+        try:
+            model.get_submodule(name)
+            targets.add(name)
+        except AttributeError:
+            pass
+    if not targets:
+        # 非Qwen结构时量化全部线性层
+        targets = {torch.nn.Linear}
+    
+    return torch.ao.quantization.quantize_dynamic(
+        model,
+        qconfig_spec=targets,
+        dtype=torch.qint8,
+        inplace=True
+    )
+
+
 class ModelWrapper:
     """
     模型包装器类 - 用于加载和使用量化模型
@@ -26,29 +73,70 @@ class ModelWrapper:
         self.model_path = model_path
         self.device = device if device else "cuda" if torch.cuda.is_available() else "cpu"
         self.precision = precision
-        self.torch_dtype = torch.float16 if precision == "float16" else torch.float32
+        self.torch_dtype = PRECISION_DTYPES.get(precision, torch.float32)
         
         self.model = None
         self.tokenizer = None
         self.is_loaded = False
+        self.load_report = None  # 各加载阶段的耗时报告
         
         logger.info(f"创建ModelWrapper实例: 路径={model_path}, 设备={self.device}, 精度={precision}")
     
+    @contextmanager
+    def phase(self, name):
+        """
+        记录一个加载阶段的耗时，结果写入load_report['phases']
+        
+        Args:
+            name: 阶段名称
+        """
+        start = time.time()
+        logger.info(f"加载阶段开始: {name}")
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.load_report['phases'][name] = round(elapsed, 3)
+            self.load_report['total'] = round(sum(self.load_report['phases'].values()), 3)
+            logger.info(f"加载阶段完成: {name}, 耗时: {elapsed:.2f}秒")
+    
+    def _weight_kwargs(self):
+        """
+        权重加载参数
+        
+        模型目录中存在safetensors文件时通过内存映射加载，并避免在CPU上额外构造一份随机初始化的权重。
+        """
+        kwargs = {'low_cpu_mem_usage': True}
+        if glob.glob(os.path.join(self.model_path, '*.safetensors')):
+            kwargs['use_safetensors'] = True
+        return kwargs
+    
     def load(self):
         """
         加载模型和tokenizer
         
+        加载过程分为tokenizer、weights、device_placement、generation_config几个阶段，
+        每个阶段的耗时记录在load_report中。
+        
         Returns:
             dict: 加载状态
         """
+        self.load_report = {
+            'model_path': self.model_path,
+            'device': self.device,
+            'precision': self.precision,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'phases': {},
+            'total': 0
+        }
+        
         try:
             # 加载tokenizer
-            logger.info("加载tokenizer...")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_path, 
-                trust_remote_code=True
-            )
-            logger.info("tokenizer加载成功")
+            with self.phase('tokenizer'):
+                self.tokenizer = AutoTokenizer.from_pretrained(
+                    self.model_path, 
+                    trust_remote_code=True
+                )
             
             # 加载model
             logger.info("加载model...")
@@ -57,6 +145,11 @@ class ModelWrapper:
             is_int4_model = "Int4" in self.model_path
             is_int8_model = "Int8" in self.model_path
             
+            if self.precision in CPU_ONLY_PRECISIONS and self.device != 'cpu':
+                logger.warning(f"精度 {self.precision} 只支持CPU，改为在CPU上加载")
+                self.device = 'cpu'
+                self.load_report['device'] = self.device
+            
             # 检查是否是量化模型但CUDA不可用
             if (is_int4_model or is_int8_model) and self.device == 'cpu':
                 logger.warning("检测到尝试在CPU上加载量化模型，量化模型需要GPU支持")
@@ -74,14 +167,17 @@ class ModelWrapper:
                     }
             
             try:
-                # 尝试加载模型
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_path,
-                    device_map=self.device,
-                    trust_remote_code=True,
-                    bf16=(self.precision == 'bfloat16'),
-                    fp16=(self.precision == 'float16')
-                ).eval()
+                # 尝试加载模型，权重通过device_map直接放到目标设备
+                with self.phase('weights'):
+                    self.model = AutoModelForCausalLM.from_pretrained(
+                        self.model_path,
+                        device_map=self.device,
+                        trust_remote_code=True,
+                        bf16=(self.precision == 'bfloat16'),
+                        fp16=(self.precision == 'float16'),
+                        fp32=(self.torch_dtype == torch.float32),
+                        **self._weight_kwargs()
+                    )
                 logger.info("model加载成功")
             except RuntimeError as e:
                 if "GPU is required" in str(e) and self.device == 'cuda':
@@ -102,22 +198,41 @@ class ModelWrapper:
                             raise RuntimeError("量化模型需要GPU支持，且未找到对应的非量化模型")
                     
                     # 重新尝试用CPU加载
-                    self.model = AutoModelForCausalLM.from_pretrained(
-                        self.model_path,
-                        device_map=self.device,
-                        trust_remote_code=True
-                    ).eval()
+                    self.load_report['device'] = self.device
+                    with self.phase('weights_cpu_fallback'):
+                        self.model = AutoModelForCausalLM.from_pretrained(
+                            self.model_path,
+                            device_map=self.device,
+                            trust_remote_code=True,
+                            **self._weight_kwargs()
+                        )
                     logger.info("model已在CPU上加载成功")
                 else:
                     # 其他错误，重新抛出
                     raise
             
+            # 确认权重都在目标设备上，并等待异步拷贝完成
+            with self.phase('device_placement'):
+                self.model = self.model.eval()
+                target_type = self.device.split(':')[0]
+                if target_type in ('cuda', 'cpu') and next(self.model.parameters()).device.type != target_type:
+                    self.model = self.model.to(self.device)
+                if target_type == 'cuda':
+                    torch.cuda.synchronize()
+            
+            # CPU动态int8量化
+            if self.precision == 'int8_dynamic':
+                with self.phase('quantization'):
+                    self.model = quantize_language_model(self.model)
+            
             # 配置生成参数
-            self.model.generation_config = GenerationConfig.from_pretrained(
-                self.model_path, 
-                trust_remote_code=True
-            )
+            with self.phase('generation_config'):
+                self.model.generation_config = GenerationConfig.from_pretrained(
+                    self.model_path, 
+                    trust_remote_code=True
+                )
             
+            self.load_report['status'] = 'success'
             return {
                 'status': 'success',
                 'message': f'模型加载成功: {self.model_path}'
@@ -125,6 +240,8 @@ class ModelWrapper:
             
         except Exception as e:
             logger.error(f"model加载失败: {str(e)}")
+            self.load_report['status'] = 'error'
+            self.load_report['error'] = str(e)
             # 记录详细错误堆栈
             import traceback
             logger.error(traceback.format_exc())
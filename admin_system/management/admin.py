@@ -1,9 +1,10 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from django.utils import timezone
 from django.shortcuts import redirect
 import subprocess
 import os
-from .models import ServiceControl, PromptTemplate, KnowledgeBase, ModelConfig, KnowledgeChunk
+from .models import ServiceControl, PromptTemplate, KnowledgeBase, ModelConfig, KnowledgeChunk, AnalysisResult
 from django.urls import reverse, path
 from django.contrib.admin import AdminSite
 from django.urls import reverse
@@ -272,6 +273,62 @@ class KnowledgeChunkAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(AnalysisResult)
+class AnalysisResultAdmin(admin.ModelAdmin):
+    """分析结果缓存的管理配置"""
+    list_display = ('image_phash_short', 'query_preview', 'box_count', 'hit_count', 'expired_tag', 'created_at', 'last_hit_at')
+    list_filter = ('model_identity', 'created_at', 'expires_at')
+    search_fields = ('image_phash', 'query', 'response')
+    readonly_fields = ('key', 'image_phash', 'query', 'model_identity', 'options', 'response', 'boxes',
+                       'hit_count', 'created_at', 'last_hit_at', 'expires_at')
+    actions = ['delete_expired']
+    
+    def has_add_permission(self, request):
+        """分析结果只由图像分析接口写入"""
+        return False
+    
+    def image_phash_short(self, obj):
+        """感知哈希前缀"""
+        return obj.image_phash[:16]
+    image_phash_short.short_description = '图像感知哈希'
+    
+    def query_preview(self, obj):
+        """查询文本预览"""
+        return obj.query[:50] + '...' if len(obj.query) > 50 else obj.query
+    query_preview.short_description = '查询文本'
+    
+    def box_count(self, obj):
+        """边界框数量"""
+        return len(obj.boxes or [])
+    box_count.short_description = '边界框数'
+    
+    def expired_tag(self, obj):
+        """将过期状态显示为彩色标签"""
+        if obj.is_expired:
+            return format_html('<span style="background-color:#6c757d; color:white; padding:2px 8px; border-radius:4px;">已过期</span>')
+        else:
+            return format_html('<span style="background-color:#28a745; color:white; padding:2px 8px; border-radius:4px;">有效</span>')
+    expired_tag.short_description = '状态'
+    
+    def delete_expired(self, request, queryset):
+        """删除所选记录中已过期的分析结果"""
+        count, _ = queryset.filter(expires_at__lte=timezone.now()).delete()
+        self.message_user(request, f"已删除 {count} 条过期的分析结果")
+    delete_expired.short_description = "删除所选记录中已过期的结果"
+    
+    fieldsets = (
+        ('缓存键', {
+            'fields': ('key', 'image_phash', 'query', 'model_identity', 'options')
+        }),
+        ('分析结果', {
+            'fields': ('response', 'boxes'),
+            'classes': ('wide',)
+        }),
+        ('命中统计', {
+            'fields': ('hit_count', 'created_at', 'last_hit_at', 'expires_at')
+        }),
+    )
+
 # 自定义Admin站点标题和页脚
 admin.site.site_header = 'AI助手管理系统'
 admin.site.site_title = 'AI助手管理'
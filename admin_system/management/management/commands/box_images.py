@@ -0,0 +1,39 @@
+"""
+边界框图像存储命令 - 查看边界框图像目录的占用情况
+
+使用--prune按BOX_IMAGE_STORE_MAX_MB(或--max-mb)立即淘汰最久未访问的图像。
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from core.box_images import get_box_image_store
+
+
+class Command(BaseCommand):
+    help = '查看边界框图像存储的占用情况，并可按磁盘上限淘汰旧图像'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='按磁盘上限淘汰最久未访问的图像')
+        parser.add_argument('--max-mb', type=float, help='淘汰时使用的磁盘上限(MB)，默认使用BOX_IMAGE_STORE_MAX_MB')
+
+    def handle(self, *args, **options):
+        store = get_box_image_store()
+
+        if options['prune']:
+            max_bytes = int(options['max_mb'] * 1024 * 1024) if options['max_mb'] is not None else None
+            removed_count, removed_bytes = store.prune(max_bytes)
+            self.stdout.write(self.style.SUCCESS(
+                f"淘汰完成: 删除{removed_count}个文件，释放{removed_bytes / 1024 / 1024:.1f}MB"
+            ))
+
+        stats = store.get_stats()
+        usage = stats['disk_mb'] / stats['max_mb'] * 100 if stats['max_mb'] else 0
+
+        self.stdout.write(f"目录: {stats['directory']}")
+        self.stdout.write(f"文件数: {stats['files']}")
+        line = f"磁盘占用: {stats['disk_mb']:.1f}MB / {stats['max_mb']:.0f}MB ({usage:.1f}%)"
+        self.stdout.write(self.style.WARNING(line) if usage > 100 else line)
+        for label, key in (('最早访问', 'oldest_access'), ('最近访问', 'newest_access')):
+            if stats[key] is not None:
+                self.stdout.write(f"{label}: {datetime.fromtimestamp(stats[key]):%Y-%m-%d %H:%M:%S}")
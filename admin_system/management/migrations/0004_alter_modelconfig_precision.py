@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0003_modelconfig_knowledgebase_embedding_model_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='modelconfig',
+            name='precision',
+            field=models.CharField(choices=[('float16', '半精度'), ('bfloat16', 'BF16半精度'), ('float32', '全精度'), ('int8_dynamic', 'CPU动态INT8量化')], default='float16', max_length=20, verbose_name='精度'),
+        ),
+    ]
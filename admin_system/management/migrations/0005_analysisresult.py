@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0004_alter_modelconfig_precision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='缓存键')),
+                ('image_phash', models.CharField(db_index=True, max_length=64, verbose_name='图像感知哈希')),
+                ('query', models.TextField(verbose_name='查询文本')),
+                ('model_identity', models.CharField(max_length=255, verbose_name='模型')),
+                ('options', models.JSONField(blank=True, default=dict, verbose_name='生成参数')),
+                ('response', models.TextField(verbose_name='分析结果')),
+                ('boxes', models.JSONField(blank=True, default=list, verbose_name='边界框')),
+                ('hit_count', models.IntegerField(default=0, verbose_name='命中次数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True, verbose_name='最近命中时间')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='过期时间')),
+            ],
+            options={
+                'verbose_name': '分析结果缓存',
+                'verbose_name_plural': '分析结果缓存',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
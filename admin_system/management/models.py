@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -94,7 +95,9 @@ class ModelConfig(models.Model):
     
     PRECISION_CHOICES = (
         ('float16', '半精度'),
+        ('bfloat16', 'BF16半精度'),
         ('float32', '全精度'),
+        ('int8_dynamic', 'CPU动态INT8量化'),
     )
     
     name = models.CharField('配置名称', max_length=100)
@@ -121,3 +124,30 @@ class ModelConfig(models.Model):
             ModelConfig.objects.all().update(is_active=False)
         
         super().save(*args, **kwargs)
+
+class AnalysisResult(models.Model):
+    """图像分析结果缓存，按图像感知哈希、查询文本和模型配置保存"""
+    key = models.CharField('缓存键', max_length=64, unique=True)
+    image_phash = models.CharField('图像感知哈希', max_length=64, db_index=True)
+    query = models.TextField('查询文本')
+    model_identity = models.CharField('模型', max_length=255)
+    options = models.JSONField('生成参数', default=dict, blank=True)
+    response = models.TextField('分析结果')
+    boxes = models.JSONField('边界框', default=list, blank=True)
+    hit_count = models.IntegerField('命中次数', default=0)
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    last_hit_at = models.DateTimeField('最近命中时间', blank=True, null=True)
+    expires_at = models.DateTimeField('过期时间', db_index=True)
+    
+    class Meta:
+        verbose_name = '分析结果缓存'
+        verbose_name_plural = '分析结果缓存'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.image_phash[:12]} - {self.query[:30]}"
+    
+    @property
+    def is_expired(self):
+        """是否已过期"""
+        return self.expires_at <= timezone.now()
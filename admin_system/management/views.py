@@ -249,9 +249,11 @@ def reload_model(request):
             
             # 获取模型ID
             model_id = request.POST.get('model_id')
+            # 是否在后台加载，加载期间当前模型继续提供服务
+            background = request.POST.get('background') in ('1', 'true', 'on')
             
             # 重新加载模型
-            result = reload_model_service(model_id)
+            result = reload_model_service(model_id, background=background)
             
             return JsonResponse(result)
             
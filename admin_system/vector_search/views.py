@@ -1,7 +1,6 @@
 from django.shortcuts import render
-from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-import json
+from core.json_codec import JsonResponse, get_json_body
 from .models import VectorIndex
 from .utils import vector_search, import_knowledge_base_to_vector, import_prompt_templates_to_vector, import_all_to_vector
 
@@ -18,7 +17,7 @@ def api_search(request):
         return JsonResponse({'error': '仅支持POST请求'}, status=405)
     
     try:
-        data = json.loads(request.body)
+        data = get_json_body(request)
         index_name = data.get('index', '')
         query = data.get('query', '')
         top_k = int(data.get('top_k', 5))
@@ -44,7 +43,7 @@ def api_import_kb(request):
         return JsonResponse({'error': '仅支持POST请求'}, status=405)
     
     try:
-        data = json.loads(request.body) if request.body else {}
+        data = get_json_body(request) if request.body else {}
         index_name = data.get('index', 'knowledge_base')
         
         result = import_knowledge_base_to_vector(index_name)
@@ -60,7 +59,7 @@ def api_import_prompt_templates(request):
         return JsonResponse({'error': '仅支持POST请求'}, status=405)
     
     try:
-        data = json.loads(request.body) if request.body else {}
+        data = get_json_body(request) if request.body else {}
         index_name = data.get('index', 'prompt_templates')
         
         result = import_prompt_templates_to_vector(index_name)
@@ -76,7 +75,7 @@ def api_import_all(request):
         return JsonResponse({'error': '仅支持POST请求'}, status=405)
     
     try:
-        data = json.loads(request.body) if request.body else {}
+        data = get_json_body(request) if request.body else {}
         index_name = data.get('index', 'combined_index')
         
         result = import_all_to_vector(index_name)
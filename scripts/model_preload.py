@@ -2,12 +2,16 @@
 Qwen-VL-Chat 模型预加载脚本
 
 此脚本用于在启动API服务前预加载模型，提高首次请求的响应速度。
+模型加载完成后作为模型宿主进程，通过本地socket为Web服务提供推理，
+Web服务配置MODEL_HOST_ADDRESSES后即可运行多个工作进程而只加载一份模型。
 可独立运行，也可由启动脚本调用。
 """
 import os
 import sys
 import time
 import logging
+import argparse
+import multiprocessing
 from pathlib import Path
 
 # 设置日志
@@ -17,10 +21,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    """主函数"""
-    logger.info("开始预加载模型...")
-    
+def setup_django():
+    """初始化Django环境"""
     # 获取当前目录
     current_dir = Path.cwd()
     admin_system_dir = current_dir / "admin_system"
@@ -37,8 +39,23 @@ def main():
         import django
         django.setup()
         logger.info("Django环境初始化成功")
+        return True
     except Exception as e:
         logger.error(f"Django环境初始化失败: {e}")
+        return False
+
+def run_host(host, port, model_path, device, precision):
+    """
+    加载模型并作为模型宿主进程提供推理服务
+    
+    Args:
+        host: 监听地址
+        port: 监听端口
+        model_path: 模型路径
+        device: 设备
+        precision: 精度
+    """
+    if not setup_django():
         return
     
     # 加载模型
@@ -46,12 +63,11 @@ def main():
     
     try:
         # 导入模型服务
-        from core.model_service import init_model, get_service_status
+        from core.model_service import init_model, get_service_status, set_local_mode, get_model_host_authkey
+        from core.model_host import ModelHostServer
         
-        # 获取默认模型配置
-        model_path = "D:/AI-DEV/models/Qwen-VL-Chat-Int4"  # 默认路径
-        device = "cuda"  # 默认设备
-        precision = "float16"  # 默认精度
+        # 宿主进程始终在本进程内加载模型
+        set_local_mode()
         
         logger.info(f"使用以下配置加载模型:")
         logger.info(f"路径: {model_path}")
@@ -73,15 +89,13 @@ def main():
             
             # 输出服务可用信息
             logger.info("\n===================================")
-            logger.info("模型加载完成，服务已就绪!")
-            logger.info("API服务地址: http://localhost:8000/api/v1/chat/completions")
-            logger.info("服务状态查询: http://localhost:8000/api/status")
+            logger.info("模型加载完成，宿主进程已就绪!")
+            logger.info(f"模型宿主地址: {host}:{port}")
+            logger.info(f"在Web服务的settings中添加 MODEL_HOST_ADDRESSES = ['{host}:{port}'] 以使用此宿主")
             logger.info("===================================\n")
             
-            # 保持脚本运行以维持模型加载状态
-            logger.info("模型加载进程将保持运行...")
-            while True:
-                time.sleep(60)
+            # 作为模型宿主进程处理推理请求
+            ModelHostServer((host, port), get_model_host_authkey()).serve_forever()
                 
         else:
             logger.error(f"模型加载失败: {result.get('message', '未知错误')}")
@@ -89,5 +103,39 @@ def main():
     except Exception as e:
         logger.exception(f"模型加载过程中出错: {e}")
 
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='预加载模型并作为模型宿主进程提供推理服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=6100, help='监听端口，多个宿主进程依次使用后续端口')
+    parser.add_argument('--workers', type=int, default=1, help='宿主进程数量，每个进程加载一份模型')
+    parser.add_argument('--model-path', default="D:/AI-DEV/models/Qwen-VL-Chat-Int4", help='模型路径')
+    parser.add_argument('--device', default="cuda", help='设备')
+    parser.add_argument('--precision', default="float16", help='精度')
+    args = parser.parse_args()
+    
+    logger.info("开始预加载模型...")
+    
+    if args.workers <= 1:
+        run_host(args.host, args.port, args.model_path, args.device, args.precision)
+        return
+    
+    # 启动多个宿主进程组成进程池
+    processes = []
+    for i in range(args.workers):
+        process = multiprocessing.Process(
+            target=run_host,
+            args=(args.host, args.port + i, args.model_path, args.device, args.precision),
+            name=f"model-host-{i}"
+        )
+        process.start()
+        processes.append(process)
+    
+    addresses = [f"'{args.host}:{args.port + i}'" for i in range(args.workers)]
+    logger.info(f"已启动 {args.workers} 个模型宿主进程，MODEL_HOST_ADDRESSES = [{', '.join(addresses)}]")
+    
+    for process in processes:
+        process.join()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
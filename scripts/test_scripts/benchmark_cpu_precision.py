@@ -0,0 +1,107 @@
+"""
+CPU精度基准测试 - 比较float32、bfloat16和动态int8量化的生成速度与内存占用
+
+每种精度在独立子进程中加载模型，保证RSS互不影响。
+
+用法:
+    python benchmark_cpu_precision.py --model-path D:/AI-DEV/models/Qwen-VL-Chat
+    python benchmark_cpu_precision.py --precisions float32 int8_dynamic --max-new-tokens 64
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+# 添加admin_system到路径，直接使用服务中的ModelWrapper
+ADMIN_SYSTEM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'admin_system'))
+sys.path.insert(0, ADMIN_SYSTEM_DIR)
+
+DEFAULT_PROMPT = "请用三句话介绍一下长城。"
+
+
+def get_rss_mb():
+    """当前进程常驻内存(MB)"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+    except ImportError:
+        import resource
+        # Linux下ru_maxrss单位为KB，这里返回的是峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(model_path, precision, prompt, max_new_tokens, runs, result_queue):
+    """在子进程中加载模型并测量生成速度"""
+    import torch
+    from core.wrappers.model_wrapper import ModelWrapper
+
+    result = {'precision': precision}
+    try:
+        rss_before = get_rss_mb()
+        wrapper = ModelWrapper(model_path, 'cpu', precision)
+        load_result = wrapper.load()
+        if load_result['status'] != 'success':
+            raise RuntimeError(load_result['message'])
+        result['load_time'] = wrapper.load_report['total']
+        result['rss_mb'] = get_rss_mb() - rss_before
+
+        # 预热一次，不计入统计
+        wrapper.model.chat(wrapper.tokenizer, prompt, history=[], max_new_tokens=4)
+
+        total_tokens = 0
+        total_time = 0
+        for _ in range(runs):
+            start = time.time()
+            response, _ = wrapper.model.chat(
+                wrapper.tokenizer,
+                prompt,
+                history=[],
+                max_new_tokens=max_new_tokens
+            )
+            total_time += time.time() - start
+            total_tokens += len(wrapper.tokenizer.encode(response))
+
+        result['tokens_per_second'] = total_tokens / total_time if total_time else 0
+        result['threads'] = torch.get_num_threads()
+    except Exception as e:
+        result['error'] = str(e)
+
+    result_queue.put(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU精度基准测试')
+    parser.add_argument('--model-path', default='D:/AI-DEV/models/Qwen-VL-Chat', help='非量化模型路径')
+    parser.add_argument('--precisions', nargs='+', default=['float32', 'bfloat16', 'int8_dynamic'], help='要比较的精度')
+    parser.add_argument('--prompt', default=DEFAULT_PROMPT, help='测试提示词')
+    parser.add_argument('--max-new-tokens', type=int, default=32, help='每次生成的最大token数')
+    parser.add_argument('--runs', type=int, default=3, help='每种精度的测试次数')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for precision in args.precisions:
+        print(f"测试精度: {precision} ...")
+        result_queue = context.Queue()
+        process = context.Process(
+            target=run_benchmark,
+            args=(args.model_path, precision, args.prompt, args.max_new_tokens, args.runs, result_queue)
+        )
+        process.start()
+        results.append(result_queue.get())
+        process.join()
+
+    print()
+    print(f"{'精度':<14}{'加载(秒)':>10}{'内存(MB)':>12}{'tokens/s':>12}{'相对fp32':>10}")
+    baseline = next((r.get('tokens_per_second') for r in results if r['precision'] == 'float32'), None)
+    for r in results:
+        if 'error' in r:
+            print(f"{r['precision']:<14}出错: {r['error']}")
+            continue
+        speedup = f"{r['tokens_per_second'] / baseline:.2f}x" if baseline else '-'
+        print(f"{r['precision']:<14}{r['load_time']:>10.1f}{r['rss_mb']:>12.0f}{r['tokens_per_second']:>12.2f}{speedup:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+图像预处理基准测试 - 比较完整解码与draft/reduce缩小解码的耗时和内存
+
+对4K和8K的JPEG/PNG测试图像，分别测量原有方式(Image.open后按原始分辨率转换为RGB)
+和core.image_preprocess.decode_image的耗时与峰值内存。每种组合在独立子进程中运行，
+峰值内存取自子进程的ru_maxrss(仅支持Linux/macOS)。
+
+用法:
+    python benchmark_image_preprocess.py
+    python benchmark_image_preprocess.py --runs 5 --max-side 1344
+"""
+import io
+import os
+import sys
+import time
+import base64
+import argparse
+import multiprocessing
+
+# 添加admin_system到路径，直接使用服务中的预处理函数
+ADMIN_SYSTEM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'admin_system'))
+sys.path.insert(0, ADMIN_SYSTEM_DIR)
+
+RESOLUTIONS = {
+    '4K': (3840, 2160),
+    '8K': (7680, 4320),
+}
+
+
+def make_test_image(size, fmt):
+    """生成带渐变和噪点的测试图像，返回base64编码"""
+    from PIL import Image
+
+    width, height = size
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def peak_rss_mb():
+    """当前进程峰值常驻内存(MB)"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(mode, image_base64, runs, max_side, result_queue):
+    """在子进程中执行一种解码方式"""
+    from django.conf import settings
+    settings.configure()
+
+    from PIL import Image
+    from core.image_preprocess import decode_image
+
+    baseline = peak_rss_mb()
+    start = time.time()
+    for _ in range(runs):
+        if mode == 'full':
+            data = base64.b64decode(image_base64)
+            image = Image.open(io.BytesIO(data)).convert('RGB')
+        else:
+            # 测试图像可能超过服务默认的字节数上限，这里只比较解码开销
+            image, _ = decode_image(image_base64, max_side=max_side, max_bytes=len(image_base64))
+    elapsed = (time.time() - start) / runs
+
+    result_queue.put({
+        'latency_ms': elapsed * 1000,
+        'peak_mb': peak_rss_mb() - baseline,
+        'size': image.size,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图像预处理基准测试')
+    parser.add_argument('--runs', type=int, default=3, help='每种组合的解码次数')
+    parser.add_argument('--max-side', type=int, default=1344, help='缩小解码的最长边')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    print(f"{'输入':<10}{'方式':<10}{'输出尺寸':>14}{'耗时(毫秒)':>12}{'峰值内存增量(MB)':>18}")
+    for name, size in RESOLUTIONS.items():
+        for fmt in ('JPEG', 'PNG'):
+            image_base64 = make_test_image(size, fmt)
+            for mode in ('full', 'draft'):
+                result_queue = context.Queue()
+                process = context.Process(
+                    target=run_case,
+                    args=(mode, image_base64, args.runs, args.max_side, result_queue)
+                )
+                process.start()
+                result = result_queue.get()
+                process.join()
+
+                output_size = f"{result['size'][0]}x{result['size'][1]}"
+                print(f"{name + ' ' + fmt:<10}{mode:<10}{output_size:>14}{result['latency_ms']:>12.1f}{result['peak_mb']:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+JSON编解码基准测试 - 比较标准库json与orjson处理大base64请求体的耗时
+
+模拟图像分析请求：请求体为{"image_base64": ..., "query": ...}，分别测量
+1. 原有方式：日志中间件和视图各用json.loads解析一次，响应用django JsonResponse序列化
+2. 现有方式：core.json_codec.get_json_body解析一次并缓存，响应用core.json_codec.JsonResponse序列化
+未安装orjson时第2种方式回退到标准库，只体现少解析一次的收益。
+
+用法:
+    python benchmark_json_codec.py
+    python benchmark_json_codec.py --sizes 1 5 20 --runs 20
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+
+# 添加admin_system到路径，直接使用服务中的编解码函数
+ADMIN_SYSTEM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'admin_system'))
+sys.path.insert(0, ADMIN_SYSTEM_DIR)
+
+
+def make_body(size_mb):
+    """生成包含size_mb MB随机图像数据(编码前)的请求体"""
+    image = base64.b64encode(os.urandom(int(size_mb * 1024 * 1024))).decode('ascii')
+    return json.dumps({'image_base64': image, 'query': '分析这个设计的排版', 'max_tokens': 256}).encode('utf-8')
+
+
+def make_result():
+    """模拟图像分析的响应"""
+    return {
+        'result': '这是一个包含标题、正文和按钮的页面设计。' * 20,
+        'boxes': [{'label': f'元素{i}', 'box': [i, i, i + 100, i + 50]} for i in range(50)],
+        'timings': {'decode_ms': 12.5, 'inference_ms': 1520.3, 'total_ms': 1540.1},
+        'processing_time': '1.54秒',
+    }
+
+
+def timeit(func, runs):
+    """返回单次平均耗时(毫秒)"""
+    func()
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON编解码基准测试')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 5, 20], help='图像数据大小(MB)')
+    parser.add_argument('--runs', type=int, default=10, help='每种情况的运行次数')
+    args = parser.parse_args()
+
+    from django.conf import settings
+    # 大请求体超过Django默认的2.5MB请求体上限，基准测试中取消限制
+    settings.configure(DATA_UPLOAD_MAX_MEMORY_SIZE=None)
+
+    from django.http import JsonResponse as DjangoJsonResponse
+    from django.test import RequestFactory
+    from core import json_codec
+
+    print(f"orjson: {'已安装' if json_codec.orjson is not None else '未安装，使用标准库json'}")
+    factory = RequestFactory()
+    result = make_result()
+
+    print(f"{'大小':>8} {'json.loads':>12} {'codec.loads':>12} {'原有请求':>10} {'现有请求':>10} {'加速':>6}")
+    for size_mb in args.sizes:
+        body = make_body(size_mb)
+
+        stdlib_loads = timeit(lambda: json.loads(body), args.runs)
+        codec_loads = timeit(lambda: json_codec.loads(body), args.runs)
+
+        def before():
+            request = factory.post('/api/analyze', body, content_type='application/json')
+            json.loads(request.body)  # 日志中间件
+            json.loads(request.body)  # 视图
+            DjangoJsonResponse(result)
+
+        def after():
+            request = factory.post('/api/analyze', body, content_type='application/json')
+            json_codec.get_json_body(request)
+            json_codec.get_json_body(request)
+            json_codec.JsonResponse(result)
+
+        before_ms = timeit(before, args.runs)
+        after_ms = timeit(after, args.runs)
+        print(f"{size_mb:>6.1f}MB {stdlib_loads:>10.2f}ms {codec_loads:>10.2f}ms "
+              f"{before_ms:>8.2f}ms {after_ms:>8.2f}ms {before_ms / after_ms:>5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+多图像批量分析基准测试
+
+向/api/analyze一次提交N张图像，统计总耗时和单张图像的平均耗时；使用--serial
+时改为逐张提交，作为对比基线。每次测试都生成新的随机图像，避免命中响应缓存。
+
+用法:
+    python benchmark_multi_image.py
+    python benchmark_multi_image.py --sizes 1 4 8 16 --serial
+"""
+import io
+import time
+import base64
+import random
+import argparse
+import requests
+from PIL import Image, ImageDraw
+
+
+def make_test_image(size=448):
+    """生成带随机色块的测试图像，返回base64编码"""
+    image = Image.new('RGB', (size, size), tuple(random.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(5):
+        x1, y1 = random.randint(0, size - 60), random.randint(0, size - 60)
+        x2, y2 = x1 + random.randint(30, 150), y1 + random.randint(30, 150)
+        draw.rectangle([x1, y1, x2, y2], fill=tuple(random.randint(0, 255) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def post_analyze(base_url, image_base64, query, max_tokens):
+    """调用图像分析接口，返回耗时(秒)"""
+    start = time.time()
+    response = requests.post(
+        f"{base_url}/api/analyze",
+        json={'image_base64': image_base64, 'query': query, 'max_tokens': max_tokens},
+        timeout=600
+    )
+    elapsed = time.time() - start
+    response.raise_for_status()
+    data = response.json()
+    if 'error' in data:
+        raise RuntimeError(data['error'])
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多图像批量分析基准测试')
+    parser.add_argument('--url', default='http://localhost:8000', help='服务地址')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 8, 16], help='每次请求的图像数')
+    parser.add_argument('--query', default='描述这张图片中的色块', help='提问文本')
+    parser.add_argument('--max-tokens', type=int, default=32, help='每张图像的最大生成token数')
+    parser.add_argument('--serial', action='store_true', help='同时测试逐张提交作为对比')
+    args = parser.parse_args()
+
+    # 预热，排除首次请求的额外开销
+    post_analyze(args.url, make_test_image(), args.query, args.max_tokens)
+
+    print(f"{'N':>4}{'模式':>8}{'总耗时(秒)':>14}{'单张耗时(秒)':>14}")
+    for n in args.sizes:
+        images = [make_test_image() for _ in range(n)]
+        elapsed = post_analyze(args.url, images if n > 1 else images[0], args.query, args.max_tokens)
+        print(f"{n:>4}{'批量':>8}{elapsed:>14.2f}{elapsed / n:>14.2f}")
+
+        if args.serial:
+            images = [make_test_image() for _ in range(n)]
+            elapsed = sum(post_analyze(args.url, image, args.query, args.max_tokens) for image in images)
+            print(f"{n:>4}{'逐张':>8}{elapsed:>14.2f}{elapsed / n:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()